@@ -0,0 +1,134 @@
+import math
+import threading
+from sqlalchemy import Table, MetaData, Column, Integer, Float, select, text
+from sqlalchemy.exc import OperationalError
+from .bin_store import bin_store
+from .distances import EARTH_RADIUS
+from .models import Bin
+from .spatial import GridIndex
+
+# R*Tree over bin locations, kept out of Base.metadata: create_all cannot make virtual tables
+bins_rtree = Table(
+    "bins_rtree", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lat", Float), Column("max_lat", Float),
+    Column("min_lon", Float), Column("max_lon", Float)
+)
+
+RTREE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS bins_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    """CREATE TRIGGER IF NOT EXISTS bins_rtree_insert AFTER INSERT ON bins BEGIN
+        INSERT OR REPLACE INTO bins_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS bins_rtree_update AFTER UPDATE OF id, latitude, longitude ON bins BEGIN
+        DELETE FROM bins_rtree WHERE id = old.id;
+        INSERT OR REPLACE INTO bins_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS bins_rtree_delete AFTER DELETE ON bins BEGIN
+        DELETE FROM bins_rtree WHERE id = old.id;
+    END"""
+]
+# Meters per degree of latitude
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def create_spatial_index(engine):
+    """Create the bins R*Tree and its triggers, filling it if it is out of step with bins
+
+    Returns False when the database is not SQLite or SQLite was built without
+    the R*Tree module; area queries then fall back to scanning the coordinates.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as connection:
+            for statement in RTREE_DDL:
+                connection.execute(text(statement))
+            indexed = connection.execute(text("SELECT count(*) FROM bins_rtree")).scalar()
+            total = connection.execute(text("SELECT count(*) FROM bins")).scalar()
+            if indexed != total:
+                # Bins written before the triggers existed
+                print(f"Spatial index: indexing {total} bins")
+                connection.execute(text("DELETE FROM bins_rtree"))
+                connection.execute(text(
+                    "INSERT INTO bins_rtree SELECT id, latitude, latitude, longitude, longitude FROM bins"
+                ))
+    except OperationalError as e:
+        print(f"Spatial index unavailable, area queries will scan bins: {e}")
+        return False
+    return True
+
+
+def radius_box(latitude, longitude, radius):
+    """(west, south, east, north) box enclosing the circle of radius meters around a point"""
+    delta_latitude = radius / METERS_PER_DEGREE
+    delta_longitude = delta_latitude / max(math.cos(math.radians(latitude)), 1e-6)
+    return longitude - delta_longitude, latitude - delta_latitude, longitude + delta_longitude, latitude + delta_latitude
+
+
+class BinLocator:
+    """Spatial lookups over bins: SQL conditions for area queries, and an in-process nearest-neighbour index
+
+    The in-process index is a GridIndex over the bin store snapshot, rebuilt
+    on first use after bins are added, moved or removed.
+    """
+
+    def __init__(self):
+        self.rtree = False
+        self._lock = threading.Lock()
+        self._locations_version = None
+        self._index = None
+        self._ids = None
+
+    def start(self, engine):
+        self.rtree = create_spatial_index(engine)
+
+    def area_conditions(self, bbox=None, near=None, radius=None):
+        """WHERE clauses for bins inside bbox (west, south, east, north) and within radius meters of near (lat, lon)"""
+        conditions = []
+        boxes = []
+        if bbox is not None:
+            boxes.append(bbox)
+        if near is not None:
+            latitude, longitude = near
+            boxes.append(radius_box(latitude, longitude, radius))
+            # Equirectangular distance around the query point, as GridIndex computes it
+            scale_x = METERS_PER_DEGREE * math.cos(math.radians(latitude))
+            dx = (Bin.longitude - longitude) * scale_x
+            dy = (Bin.latitude - latitude) * METERS_PER_DEGREE
+            conditions.append(dx * dx + dy * dy <= radius * radius)
+        for west, south, east, north in boxes:
+            conditions += [
+                Bin.longitude >= west, Bin.longitude <= east,
+                Bin.latitude >= south, Bin.latitude <= north
+            ]
+            if self.rtree:
+                # The R*Tree narrows the candidates; it stores float32 bounds, hence the exact checks above
+                r = bins_rtree.c
+                conditions.append(Bin.id.in_(
+                    select(r.id).where(r.max_lat >= south, r.min_lat <= north, r.max_lon >= west, r.min_lon <= east)
+                ))
+        return conditions
+
+    def _load(self):
+        snapshot = bin_store.snapshot()
+        with self._lock:
+            if self._locations_version == snapshot.locations_version:
+                return self._index, self._ids
+        index = GridIndex(snapshot.latitudes, snapshot.longitudes)
+        with self._lock:
+            self._locations_version, self._index, self._ids = snapshot.locations_version, index, snapshot.ids
+        return index, snapshot.ids
+
+    def nearest(self, latitude, longitude, k=1):
+        """Database ids of the k bins nearest to (latitude, longitude), closest first"""
+        index, ids = self._load()
+        return ids[index.nearest(latitude, longitude, k)].tolist()
+
+    def within_radius(self, latitude, longitude, radius):
+        """Database ids of the bins within radius meters of (latitude, longitude)"""
+        index, ids = self._load()
+        return sorted(ids[index.within_radius(latitude, longitude, radius)].tolist())
+
+
+bin_locator = BinLocator()
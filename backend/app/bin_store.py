@@ -0,0 +1,253 @@
+import threading
+import numpy as np
+from sqlalchemy import select
+from .database import SessionLocal, is_sqlite
+from .models import Bin
+
+# Columns of a bin, in the order the API returns them
+BIN_FIELDS = ("id", "bin_id", "weight", "presence", "longitude", "latitude")
+# Stored in place of a NULL presence; weights use NaN
+PRESENCE_UNKNOWN = np.iinfo(np.int64).min
+# bin_ids per IN (...) clause when reading rows back
+LOAD_CHUNK = 500
+
+
+class BinSnapshot:
+    """Immutable column arrays of every bin, sorted by id
+
+    version changes with any write to bins, locations_version only when bins
+    are added, moved or removed, so caches can key on whichever they depend on.
+    """
+
+    def __init__(self, version, locations_version, ids, bin_ids, weights, presence, longitudes, latitudes,
+                 rows_by_bin_id=None):
+        self.version = version
+        self.locations_version = locations_version
+        self.ids = ids
+        self.bin_ids = bin_ids
+        self.weights = weights
+        self.presence = presence
+        self.longitudes = longitudes
+        self.latitudes = latitudes
+        self.rows_by_bin_id = rows_by_bin_id if rows_by_bin_id is not None else {
+            bin_id: row for row, bin_id in enumerate(bin_ids.tolist())
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ("ids", "bin_ids", "weights", "presence", "longitudes", "latitudes"))
+
+    def rows_of(self, ids):
+        """Row of each id, -1 for ids that are not in the snapshot"""
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, ids), max(len(self.ids) - 1, 0))
+        found = (self.ids[rows] == ids) if len(self.ids) else np.zeros(len(ids), dtype=bool)
+        return np.where(found, rows, -1)
+
+    def values(self, field, rows):
+        """JSON-ready list of one column at rows, None where the database has NULL"""
+        if field == "id":
+            return self.ids[rows].tolist()
+        if field == "bin_id":
+            return self.bin_ids[rows].tolist()
+        if field == "presence":
+            column = self.presence[rows]
+            values = column.tolist()
+            for i in np.flatnonzero(column == PRESENCE_UNKNOWN).tolist():
+                values[i] = None
+            return values
+        column = getattr(self, "weights" if field == "weight" else field + "s")[rows]
+        values = column.tolist()
+        for i in np.flatnonzero(np.isnan(column)).tolist():
+            values[i] = None
+        return values
+
+    def records(self, rows, fields=BIN_FIELDS):
+        """Dicts of the given fields for rows, built column by column"""
+        columns = [self.values(field, rows) for field in fields]
+        return [dict(zip(fields, values)) for values in zip(*columns)]
+
+
+def _snapshot_from_rows(version, locations_version, rows):
+    """Snapshot of (id, bin_id, weight, presence, longitude, latitude) tuples sorted by id"""
+    columns = list(zip(*rows)) if rows else [()] * 6
+    presence = np.array(columns[3], dtype=np.float64)
+    return BinSnapshot(
+        version, locations_version,
+        np.array(columns[0], dtype=np.int64),
+        np.array(columns[1], dtype=object),
+        np.array(columns[2], dtype=np.float64),
+        np.where(np.isnan(presence), PRESENCE_UNKNOWN, np.nan_to_num(presence)).astype(np.int64),
+        np.array(columns[4], dtype=np.float64),
+        np.array(columns[5], dtype=np.float64)
+    )
+
+
+def read_bin_rows(db, bin_ids):
+    """Full rows of bins by bin_id, as stored, for patching the store after a bulk write"""
+    rows = []
+    bin_ids = list(bin_ids)
+    for start in range(0, len(bin_ids), LOAD_CHUNK):
+        rows += db.execute(
+            select(*(getattr(Bin, field) for field in BIN_FIELDS)).where(Bin.bin_id.in_(bin_ids[start:start + LOAD_CHUNK]))
+        ).all()
+    return rows
+
+
+def bin_row(bin):
+    """Store row of a Bin object"""
+    return tuple(getattr(bin, field) for field in BIN_FIELDS)
+
+
+class BinStore:
+    """Process-wide column snapshot of the bins table
+
+    Loaded from the database on first use, then patched by the bin write
+    endpoints and the telemetry writer as they commit (see commit()): each
+    patch swaps in a new snapshot, copying only the columns it changes, so
+    readers always see a consistent one. Writes made by another process are not seen until
+    invalidate() (DELETE /debug/bin-store) reloads it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Writes patched into the store but not committed yet, and their end
+        self._in_flight = 0
+        self._committed = threading.Condition(self._lock)
+        self._snapshot = None
+        self.version = 0
+        self.locations_version = 0
+        self.loads = 0
+        self.patches = 0
+
+    def snapshot(self):
+        while True:
+            with self._lock:
+                if self._snapshot is not None:
+                    return self._snapshot
+                # Rows read now would miss a write already patched but not committed
+                self._committed.wait_for(lambda: self._in_flight == 0 or self._snapshot is not None)
+                if self._snapshot is not None:
+                    return self._snapshot
+                version = self.version
+            db = SessionLocal()
+            try:
+                rows = db.execute(select(*(getattr(Bin, field) for field in BIN_FIELDS)).order_by(Bin.id)).all()
+            finally:
+                db.close()
+            with self._lock:
+                # A write committed while loading may be missing from rows: load again
+                if version == self.version:
+                    self._snapshot = _snapshot_from_rows(self.version, self.locations_version, rows)
+                    self.loads += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self.locations_version += 1
+            self._snapshot = None
+
+    def update(self, weight=None, presence=None):
+        """Set weight and/or presence of bins from {id: value} dicts, as one patch"""
+        if not weight and not presence:
+            return
+        with self._lock:
+            self.version += 1
+            current = self._snapshot
+            if current is None:
+                return
+            changes = {}
+            for name, values, missing, dtype in (("weights", weight, np.nan, np.float64),
+                                                 ("presence", presence, PRESENCE_UNKNOWN, np.int64)):
+                if not values:
+                    continue
+                ids = np.fromiter(values.keys(), dtype=np.int64, count=len(values))
+                rows = current.rows_of(ids)
+                found = rows >= 0
+                column = getattr(current, name).copy()
+                column[rows[found]] = np.array([missing if v is None else v for v in values.values()], dtype=dtype)[found]
+                changes[name] = column
+            self._swap(current, **changes)
+
+    def commit(self, db, patch):
+        """Commit db's transaction, calling patch() to apply its writes to the store first
+
+        patch runs once the pending writes are flushed, while the transaction
+        holds the database write lock, so patches land in commit order. It is
+        skipped when the transaction wrote nothing. Loads wait until the commit
+        returns, so none reads the rows before it under the patched version. A
+        failed commit drops the snapshot, reloaded on next use.
+        """
+        db.flush()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            if not is_sqlite or db.connection().info.get("writing"):
+                patch()
+            db.commit()
+        except Exception:
+            self.invalidate()
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._committed.notify_all()
+
+    def upsert(self, rows):
+        """Add or replace bins from full (id, bin_id, weight, presence, longitude, latitude) rows"""
+        with self._lock:
+            self.version += 1
+            self.locations_version += 1
+            current = self._snapshot
+            if current is None or not rows:
+                return
+            patch = _snapshot_from_rows(0, 0, rows)
+            keep = ~np.isin(current.ids, patch.ids)
+            ids = np.concatenate([current.ids[keep], patch.ids])
+            order = np.argsort(ids, kind="stable")
+            self._snapshot = BinSnapshot(
+                self.version, self.locations_version, ids[order],
+                *(np.concatenate([getattr(current, name)[keep], getattr(patch, name)])[order]
+                  for name in ("bin_ids", "weights", "presence", "longitudes", "latitudes"))
+            )
+            self.patches += 1
+
+    def remove(self, ids):
+        with self._lock:
+            self.version += 1
+            self.locations_version += 1
+            current = self._snapshot
+            if current is None or len(ids) == 0:
+                return
+            keep = ~np.isin(current.ids, np.asarray(list(ids), dtype=np.int64))
+            self._snapshot = BinSnapshot(
+                self.version, self.locations_version,
+                *(getattr(current, name)[keep] for name in ("ids", "bin_ids", "weights", "presence", "longitudes", "latitudes"))
+            )
+            self.patches += 1
+
+    def stats(self):
+        with self._lock:
+            current = self._snapshot
+            return {
+                'loaded': current is not None,
+                'bins': len(current) if current is not None else 0,
+                'bytes': current.nbytes if current is not None else 0,
+                'version': self.version,
+                'locations_version': self.locations_version,
+                'loads': self.loads,
+                'patches': self.patches
+            }
+
+    def _swap(self, current, **columns):
+        """New snapshot sharing every column of current but the given ones"""
+        fields = {name: getattr(current, name) for name in ("ids", "bin_ids", "weights", "presence", "longitudes", "latitudes")}
+        fields.update(columns)
+        self._snapshot = BinSnapshot(self.version, self.locations_version, rows_by_bin_id=current.rows_by_bin_id, **fields)
+        self.patches += 1
+
+
+bin_store = BinStore()
@@ -1,9 +1,85 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from sqlalchemy import create_engine, event, Column, Integer, String, Float
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import asyncio
 import os
+import threading
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///../database/trashway.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# How long a write waits for the database (and for the other writers of this process) before failing
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "10"))
+# Pooled connections: WAL lets that many requests read while one writes
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+
+SQLITE_PRAGMAS = (
+    # Readers see the last commit while a writer appends to the log, instead of waiting for it
+    "PRAGMA journal_mode=WAL",
+    # Durable at checkpoints: safe with WAL, and commits no longer wait for an fsync each
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}",
+    "PRAGMA cache_size=-32000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456"
+)
+
+is_sqlite = DATABASE_URL.startswith("sqlite")
+engine_options = {"connect_args": {"check_same_thread": False}} if is_sqlite else {}
+if ":memory:" not in DATABASE_URL and DATABASE_URL not in ("sqlite://", "sqlite:///"):
+    engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_SIZE)
+engine = create_engine(DATABASE_URL, **engine_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+# SQLite has a single writer: one lock per process queues ours in order instead of
+# leaving them to poll busy_timeout against each other
+write_lock = threading.Lock()
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER")
+
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def acquire_write_lock(connection, cursor, statement, parameters, context, executemany):
+        """Take the writer lock at a transaction's first write, until it commits or rolls back
+
+        Reads run without a transaction (pysqlite only opens one before a
+        write), so they never wait for it.
+        """
+        if connection.info.get("writing") or not statement.lstrip().upper().startswith(WRITE_STATEMENTS):
+            return
+        if not write_lock.acquire(timeout=DB_BUSY_TIMEOUT):
+            raise OperationalError(statement, parameters, Exception("timed out waiting for the database writer"))
+        connection.info["writing"] = True
+
+    def release_write_lock(connection):
+        if connection.info.pop("writing", False):
+            write_lock.release()
+
+    event.listen(engine, "commit", release_write_lock)
+    event.listen(engine, "rollback", release_write_lock)
+
+    @event.listens_for(engine, "checkin")
+    def release_on_checkin(dbapi_connection, connection_record):
+        # A connection returned to the pool mid-transaction is rolled back by the pool
+        if connection_record.info.pop("writing", False):
+            write_lock.release()
+
+
+async def db_thread(function, *args):
+    """Run blocking database work in a thread, off the event loop
+
+    A cancelled caller still waits for the thread to finish, since it may be
+    using the caller's session.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(function, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        raise
@@ -0,0 +1,249 @@
+import numpy as np
+from sqlalchemy import select, delete, or_
+from sqlalchemy.dialects.sqlite import insert
+from .database import db_thread
+from .models import Distance
+from .distances import SparseDistanceGraph, build_distance_matrix
+from .osrm import table_matrix, table_edges
+from .spatial import GridIndex
+
+
+# from_bin_ids per IN (...) clause, and rows decoded per fetch, when reading cached pairs
+LOAD_CHUNK = 500
+FETCH_ROWS = 100000
+# Pairs per upsert (and per commit) when writing routed pairs back
+STORE_CHUNK = 50000
+
+
+def iter_pairs(db, ids):
+    """Cached pairs between ids as matrix index arrays (i, j, distance, duration), one chunk at a time
+
+    Rows come from chunked Core selects, fetched in batches and decoded
+    straight into numpy, so large bin sets never hold every row at once.
+    """
+    if len(ids) == 0:
+        return
+    # Map bin ids to matrix indexes with a sorted lookup instead of per-row dict hits
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+    for start in range(0, len(ids), LOAD_CHUNK):
+        result = db.execute(
+            select(Distance.from_bin_id, Distance.to_bin_id, Distance.distance, Distance.duration)
+            .where(Distance.from_bin_id.in_(ids[start:start + LOAD_CHUNK].tolist()))
+        )
+        while True:
+            rows = result.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            cached = np.array([tuple(row) for row in rows], dtype=np.float64)
+            to_ids = cached[:, 1].astype(np.int64)
+            to_pos = np.minimum(np.searchsorted(sorted_ids, to_ids), len(ids) - 1)
+            selected = sorted_ids[to_pos] == to_ids
+            cached = cached[selected]
+
+            i = order[np.searchsorted(sorted_ids, cached[:, 0].astype(np.int64))]
+            j = order[to_pos[selected]]
+            yield i, j, cached[:, 2], cached[:, 3]
+
+
+def _load_pairs(db, ids):
+    """Cached pairs between ids, as matrix index arrays (i, j, distance, duration)"""
+    chunks = list(iter_pairs(db, ids))
+    if not chunks:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty, np.empty(0), np.empty(0)
+    return tuple(np.concatenate(parts) for parts in zip(*chunks))
+
+
+def load_cached_distances(db, matrix):
+    """Fill matrix cells from the distances table, read in chunks by iter_pairs
+
+    Returns a boolean N x N mask of the cells that were found (diagonal included).
+    """
+    known = np.eye(len(matrix), dtype=bool)
+    i, j, distances, durations = _load_pairs(db, matrix.ids)
+    matrix.distances[i, j] = distances
+    matrix.durations[i, j] = durations
+    known[i, j] = True
+    return known
+
+
+def load_cached_edges(db, ids, rows, cols):
+    """Cached values for an edge list of index pairs, read in chunks by iter_pairs
+
+    Returns per-edge (distances, durations, known) arrays; unknown edges are NaN.
+    """
+    n = len(ids)
+    distances = np.full(len(rows), np.nan, dtype=np.float32)
+    durations = np.full(len(rows), np.nan, dtype=np.float32)
+    i, j, cached_distances, cached_durations = _load_pairs(db, ids)
+    if len(i) == 0:
+        return distances, durations, np.zeros(len(rows), dtype=bool)
+
+    cached_keys = i.astype(np.int64) * n + j
+    order = np.argsort(cached_keys)
+    cached_keys = cached_keys[order]
+    keys = np.asarray(rows, dtype=np.int64) * n + np.asarray(cols, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(cached_keys, keys), len(cached_keys) - 1)
+    known = cached_keys[pos] == keys
+    distances[known] = cached_distances[order[pos[known]]]
+    durations[known] = cached_durations[order[pos[known]]]
+    return distances, durations, known
+
+
+def missing_cover(missing):
+    """Pick a small set of bin indexes whose rows and columns cover every missing cell
+
+    Greedy vertex cover: repeatedly take the bin involved in the most missing pairs.
+    """
+    missing = missing.copy()
+    row_counts = missing.sum(axis=1)
+    col_counts = missing.sum(axis=0)
+    cover = []
+
+    while True:
+        counts = row_counts + col_counts
+        k = int(np.argmax(counts))
+        if counts[k] == 0:
+            return cover
+        cover.append(k)
+        col_counts -= missing[k, :]
+        row_counts -= missing[:, k]
+        missing[k, :] = False
+        missing[:, k] = False
+        row_counts[k] = 0
+        col_counts[k] = 0
+
+
+def store_edges(db, ids, rows, cols, distances, durations, commit=False):
+    """Write an edge list of index pairs back to the distances table, STORE_CHUNK pairs per upsert
+
+    With commit, every chunk is committed on its own, so the database write
+    lock is released between chunks instead of held for the whole list.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.intp)
+    cols = np.asarray(cols, dtype=np.intp)
+    stmt = insert(Distance.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['from_bin_id', 'to_bin_id'],
+        set_={'distance': stmt.excluded.distance, 'duration': stmt.excluded.duration}
+    )
+    for start in range(0, len(rows), STORE_CHUNK):
+        chunk = slice(start, start + STORE_CHUNK)
+        values = [
+            {'from_bin_id': a, 'to_bin_id': b, 'distance': d, 'duration': t}
+            for a, b, d, t in zip(ids[rows[chunk]].tolist(), ids[cols[chunk]].tolist(),
+                                  np.asarray(distances[chunk], dtype=np.float64).tolist(),
+                                  np.asarray(durations[chunk], dtype=np.float64).tolist())
+        ]
+        db.execute(stmt, values)
+        if commit:
+            db.commit()
+    return len(rows)
+
+
+def store_distances(db, matrix, cells, commit=False):
+    """Write matrix cells (boolean mask) back to the distances table, a block of rows at a time"""
+    block = max(1, STORE_CHUNK // max(len(matrix), 1))
+    stored = 0
+    for start in range(0, len(matrix), block):
+        i, j = np.nonzero(cells[start:start + block])
+        i += start
+        stored += store_edges(db, matrix.ids, i, j, matrix.distances[i, j], matrix.durations[i, j], commit)
+    return stored
+
+
+def invalidate_bins(db, bin_ids):
+    """Drop cached distances from or to the given bins (e.g. after a move or deletion)"""
+    db.execute(
+        delete(Distance).where(or_(Distance.from_bin_id.in_(bin_ids), Distance.to_bin_id.in_(bin_ids)))
+    )
+
+
+async def cached_distance_matrix(db, client, ids, points):
+    """Distance matrix for points (lat, lon), reading known pairs from the distances table
+
+    Only the pairs missing from the table are sent to OSRM, and the newly routed
+    pairs are written back. A fully cached bin set costs no routing calls.
+    """
+    matrix = build_distance_matrix(ids, [p[0] for p in points], [p[1] for p in points])
+    # Database work runs in a thread, off the event loop
+    known = await db_thread(load_cached_distances, db, matrix)
+    cover = missing_cover(~known)
+    if not cover:
+        return matrix
+
+    print(f"Distance cache: {int((~known).sum())} missing pairs, routing {len(cover)} bins")
+    if 2 * len(cover) >= len(points):
+        # Mostly cold cache: one full table is cheaper than rows plus columns
+        distances, durations, answered = await table_matrix(client, points, points)
+        keep = known & ~answered
+        matrix.distances = np.where(keep, matrix.distances, distances)
+        matrix.durations = np.where(keep, matrix.durations, durations)
+    else:
+        answered = np.zeros(known.shape, dtype=bool)
+        cover_points = [points[k] for k in cover]
+
+        # Rows of the covering bins, then their columns
+        distances, durations, block_answered = await table_matrix(client, cover_points, points)
+        matrix.distances[cover, :] = np.where(block_answered, distances, matrix.distances[cover, :])
+        matrix.durations[cover, :] = np.where(block_answered, durations, matrix.durations[cover, :])
+        answered[cover, :] = block_answered
+
+        distances, durations, block_answered = await table_matrix(client, points, cover_points)
+        matrix.distances[:, cover] = np.where(block_answered, distances, matrix.distances[:, cover])
+        matrix.durations[:, cover] = np.where(block_answered, durations, matrix.durations[:, cover])
+        answered[:, cover] |= block_answered
+
+    np.fill_diagonal(matrix.distances, 0)
+    np.fill_diagonal(matrix.durations, 0)
+    # Committed chunk by chunk: a cold N x N matrix never holds the write lock in one go
+    stored = await db_thread(store_distances, db, matrix, answered & ~known, True)
+    print(f"Distance cache: stored {stored} pairs")
+    return matrix
+
+
+async def cached_sparse_graph(db, client, ids, points, k):
+    """Sparse k-nearest-neighbour graph for points (lat, lon), index 0 being the depot
+
+    Road distances are looked up in the distances table or routed for each point's
+    k nearest neighbours and for every link to and from the depot only.
+    """
+    n = len(ids)
+    latitudes = [p[0] for p in points]
+    longitudes = [p[1] for p in points]
+    index = GridIndex(latitudes, longitudes)
+    neighbors = index.knn_graph(k)
+
+    # Neighbour edges plus depot -> bin and bin -> depot links
+    others = np.arange(1, n)
+    rows = np.concatenate([np.repeat(np.arange(n), neighbors.shape[1]), np.zeros(n - 1, dtype=np.int64), others])
+    cols = np.concatenate([neighbors.ravel(), others, np.zeros(n - 1, dtype=np.int64)])
+    keys = np.unique(rows.astype(np.int64) * n + cols)
+    rows, cols = keys // n, keys % n
+
+    # Spatially ordered sources keep table requests compact
+    rank = np.empty(n, dtype=np.int64)
+    rank[index.order] = np.arange(n)
+    order = np.argsort(rank[rows], kind="stable")
+    rows, cols = rows[order], cols[order]
+
+    distances, durations, known = await db_thread(load_cached_edges, db, ids, rows, cols)
+    missing = ~known
+    if missing.any():
+        print(f"Distance cache: {int(missing.sum())} of {len(rows)} neighbour pairs missing")
+        routed_distances, routed_durations, answered = await table_edges(
+            client, points, rows[missing], cols[missing]
+        )
+        distances[missing] = routed_distances
+        durations[missing] = routed_durations
+        stored = await db_thread(
+            store_edges, db, ids, rows[missing][answered], cols[missing][answered],
+            routed_distances[answered], routed_durations[answered], True
+        )
+        print(f"Distance cache: stored {stored} pairs")
+
+    edges = dict(zip(zip(rows.tolist(), cols.tolist()), zip(distances.tolist(), durations.tolist())))
+    return SparseDistanceGraph(ids, latitudes, longitudes, neighbors, edges)
@@ -0,0 +1,175 @@
+import math
+import os
+import zlib
+import numpy as np
+
+EARTH_RADIUS = 6371000  # meters
+AVERAGE_SPEED = 30000 / 3600  # 30 km/h in m/s
+BLOCK_SIZE = 1024  # rows/columns per tile, caps temporaries at a few MB
+
+# Trucks start and end their rounds at the depot, kept at index 0 of every matrix.
+# Its id is negative (never a bin id) and derived from its position, so cached
+# depot distances stop matching as soon as the depot moves.
+DEPOT_COORDS = (
+    float(os.getenv("DEPOT_LATITUDE", "48.8566")),
+    float(os.getenv("DEPOT_LONGITUDE", "2.3522"))
+)
+DEPOT_ID = -(zlib.crc32(f"{DEPOT_COORDS[0]:.6f},{DEPOT_COORDS[1]:.6f}".encode()) or 1)
+
+# Above this many bins simulations switch to the sparse k-nearest-neighbour graph
+SPARSE_THRESHOLD = int(os.getenv("SPARSE_DISTANCE_THRESHOLD", "5000"))
+SPARSE_NEIGHBORS = int(os.getenv("SPARSE_NEIGHBORS", "10"))
+
+
+def haversine_block(lat1, lon1, lat2, lon2):
+    """Haversine distances (meters) between two point sets, as a float32 len(lat1) x len(lat2) block"""
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))[:, None]
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))[None, :]
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))[None, :]
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return (2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))).astype(np.float32)
+
+
+def estimate_duration(distance):
+    """Estimate travel time (seconds) from distance assuming 30 km/h average speed"""
+    return (np.asarray(distance, dtype=np.float32) / np.float32(AVERAGE_SPEED)).astype(np.float32)
+
+
+def haversine_distance(coord1, coord2):
+    """Distance and estimated duration between two (lat, lon) points"""
+    distance = haversine_block([coord1[0]], [coord1[1]], [coord2[0]], [coord2[1]])[0, 0]
+    return {
+        'distance': float(distance),
+        'duration': float(estimate_duration(distance))
+    }
+
+
+class DistanceMatrix:
+    """Dense N x N distance (meters) and duration (seconds) matrices indexed by bin id"""
+
+    def __init__(self, ids, distances, durations):
+        self.ids = list(ids)
+        self.index = {bin_id: i for i, bin_id in enumerate(self.ids)}
+        self.distances = distances
+        self.durations = durations
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, bin_id):
+        return bin_id in self.index
+
+    def get(self, from_id, to_id):
+        """Distance and duration between two bin ids"""
+        i = self.index[from_id]
+        j = self.index[to_id]
+        return {
+            'distance': float(self.distances[i, j]),
+            'duration': float(self.durations[i, j])
+        }
+
+    def distance_at(self, i, j):
+        """Distance between matrix indexes i and j"""
+        return float(self.distances[i, j])
+
+    def duration_at(self, i, j):
+        """Duration between matrix indexes i and j"""
+        return float(self.durations[i, j])
+
+    def distances_between(self, rows, cols):
+        """Distances for arrays of index pairs, as a float64 array"""
+        return self.distances[np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)].astype(np.float64)
+
+    def nearest(self, k):
+        """N x k array of each index's k nearest other indexes, closest first"""
+        k = min(k, len(self) - 1)
+        distances = np.array(self.distances, dtype=np.float32)
+        np.fill_diagonal(distances, np.inf)
+        neighbors = np.argpartition(distances, k - 1, axis=1)[:, :k] if k > 0 else np.empty((len(self), 0), dtype=np.intp)
+        order = np.argsort(np.take_along_axis(distances, neighbors, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(neighbors, order, axis=1).astype(np.int32)
+
+
+def build_distance_matrix(ids, latitudes, longitudes, block_size=BLOCK_SIZE):
+    """Build the full haversine distance/duration matrices in tiles of block_size x block_size"""
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    n = len(latitudes)
+
+    distances = np.empty((n, n), dtype=np.float32)
+    durations = np.empty((n, n), dtype=np.float32)
+    for i in range(0, n, block_size):
+        rows = slice(i, min(i + block_size, n))
+        for j in range(0, n, block_size):
+            cols = slice(j, min(j + block_size, n))
+            block = haversine_block(latitudes[rows], longitudes[rows], latitudes[cols], longitudes[cols])
+            distances[rows, cols] = block
+            durations[rows, cols] = estimate_duration(block)
+
+    np.fill_diagonal(distances, 0)
+    np.fill_diagonal(durations, 0)
+    return DistanceMatrix(ids, distances, durations)
+
+
+class SparseDistanceGraph:
+    """Road distances for each point's k nearest neighbours plus every depot link
+
+    Pairs outside the graph are filled on demand with the haversine estimate, so
+    memory and routing grow as O(N*k) instead of O(N^2). Exposes the same lookup
+    interface as DistanceMatrix.
+    """
+
+    def __init__(self, ids, latitudes, longitudes, neighbors, edges):
+        self.ids = list(ids)
+        self.index = {bin_id: i for i, bin_id in enumerate(self.ids)}
+        self.latitudes = np.radians(np.asarray(latitudes, dtype=np.float64)).tolist()
+        self.longitudes = np.radians(np.asarray(longitudes, dtype=np.float64)).tolist()
+        self.neighbors = neighbors
+        # (i, j) -> (distance, duration) for routed pairs
+        self.edges = edges
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, bin_id):
+        return bin_id in self.index
+
+    def _estimate(self, i, j):
+        lat1, lat2 = self.latitudes[i], self.latitudes[j]
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((self.longitudes[j] - self.longitudes[i]) / 2) ** 2
+        distance = 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+        return distance, distance / AVERAGE_SPEED
+
+    def distance_at(self, i, j):
+        """Distance between indexes i and j (road distance if routed, else haversine)"""
+        if i == j:
+            return 0.0
+        edge = self.edges.get((i, j))
+        return edge[0] if edge is not None else self._estimate(i, j)[0]
+
+    def duration_at(self, i, j):
+        """Duration between indexes i and j (road duration if routed, else estimated)"""
+        if i == j:
+            return 0.0
+        edge = self.edges.get((i, j))
+        return edge[1] if edge is not None else self._estimate(i, j)[1]
+
+    def get(self, from_id, to_id):
+        """Distance and duration between two bin ids"""
+        i = self.index[from_id]
+        j = self.index[to_id]
+        return {
+            'distance': self.distance_at(i, j),
+            'duration': self.duration_at(i, j)
+        }
+
+    def distances_between(self, rows, cols):
+        """Distances for arrays of index pairs, as a float64 array"""
+        return np.array([self.distance_at(i, j) for i, j in zip(np.asarray(rows).tolist(), np.asarray(cols).tolist())],
+                        dtype=np.float64)
+
+    def nearest(self, k):
+        """N x k array of each index's k nearest other indexes, closest first"""
+        return self.neighbors[:, :k]
@@ -0,0 +1,131 @@
+import asyncio
+import os
+from .database import SessionLocal
+from .models import Simulation
+
+SIMULATION_WORKERS = int(os.getenv("SIMULATION_WORKERS", "2"))
+# Simulations in these states still have work to do
+ACTIVE_STATUSES = ("pending", "running")
+
+
+class SimulationQueue:
+    """Bounded pool of asyncio workers running the simulations stored as pending
+
+    The state lives in the simulations table: jobs are only simulation ids, so
+    anything pending or running when the process stopped is queued again by
+    start(). Cancelling a running job cancels its task at the next await.
+
+    Jobs also publish progress events that subscribers (the SSE endpoint)
+    receive in order. The latest event of each kind is kept while the job
+    runs, so a late subscriber starts from the current phase and routes.
+    """
+
+    def __init__(self, workers=SIMULATION_WORKERS):
+        self.workers = workers
+        self._runner = None
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._jobs = {}
+        self._progress = {}
+        self._subscribers = {}
+
+    async def start(self, runner):
+        """Start the workers with runner(simulation_id) and re-queue interrupted simulations"""
+        self._runner = runner
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        for simulation_id in self.recover():
+            self._queue.put_nowait(simulation_id)
+
+    async def stop(self):
+        """Stop the workers; simulations they were running stay running and are recovered on restart"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def recover(self):
+        db = SessionLocal()
+        try:
+            interrupted = db.query(Simulation).filter(Simulation.status.in_(ACTIVE_STATUSES)).order_by(Simulation.id).all()
+            for simulation in interrupted:
+                simulation.status = "pending"
+            db.commit()
+            if interrupted:
+                print(f"Recovered {len(interrupted)} interrupted simulations")
+            return [simulation.id for simulation in interrupted]
+        finally:
+            db.close()
+
+    def submit(self, simulation_id):
+        """Queue a simulation; safe to call from request threads"""
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, simulation_id)
+
+    def cancel(self, simulation_id):
+        """Cancel the task running a simulation, if any (the caller marks it cancelled); safe from threads"""
+        self._loop.call_soon_threadsafe(self._cancel, simulation_id)
+
+    def _cancel(self, simulation_id):
+        job = self._jobs.get(simulation_id)
+        if job is not None:
+            job.cancel()
+
+    def publish(self, simulation_id, event, data):
+        """Send (event, data) to the simulation's subscribers; safe to call from solver threads
+
+        A "status" event is the last one of a job and ends its subscriptions.
+        """
+        self._loop.call_soon_threadsafe(self._publish, simulation_id, event, data)
+
+    def subscribe(self, simulation_id):
+        """asyncio.Queue of the simulation's (event, data), starting with its latest events"""
+        queue = asyncio.Queue()
+        for event, data in self._progress.get(simulation_id, {}).items():
+            queue.put_nowait((event, data))
+        self._subscribers.setdefault(simulation_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, simulation_id, queue):
+        subscribers = self._subscribers.get(simulation_id, set())
+        subscribers.discard(queue)
+        if not subscribers:
+            self._subscribers.pop(simulation_id, None)
+
+    def _publish(self, simulation_id, event, data):
+        if event == "status":
+            self._progress.pop(simulation_id, None)
+        else:
+            self._progress.setdefault(simulation_id, {})[event] = data
+        for queue in self._subscribers.get(simulation_id, ()):
+            queue.put_nowait((event, data))
+
+    def stats(self):
+        return {
+            'workers': len(self._workers),
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'running': sorted(self._jobs),
+            'subscribers': sum(len(queues) for queues in self._subscribers.values())
+        }
+
+    async def _work(self):
+        while True:
+            simulation_id = await self._queue.get()
+            job = asyncio.create_task(self._runner(simulation_id))
+            self._jobs[simulation_id] = job
+            try:
+                await job
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    # The worker itself is stopping
+                    job.cancel()
+                    raise
+            except Exception as e:
+                print(f"Simulation {simulation_id} job error: {e}")
+            finally:
+                self._jobs.pop(simulation_id, None)
+                self._queue.task_done()
+
+
+simulation_queue = SimulationQueue()
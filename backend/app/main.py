@@ -1,10 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .database import engine, Base
+from .osrm import routing_client
+from .jobs import simulation_queue
+from .telemetry import telemetry_writer
+from .bin_index import bin_locator
 from .routers import bins, simulations
+from .solver.parallel import shutdown_pool
 
 Base.metadata.create_all(bind=engine)
+# R*Tree over bin locations, kept in sync with bins by triggers
+bin_locator.start(engine)
 
-app = FastAPI(title="Trashway API")
+@asynccontextmanager
+async def lifespan(app):
+    # One routing connection pool for the lifetime of the app
+    await routing_client.start()
+    # Simulation workers, re-queuing whatever a previous run left pending or running
+    await simulation_queue.start(simulations.run_simulation)
+    # Sensor readings are written in batches by a background thread
+    telemetry_writer.start()
+    yield
+    await simulation_queue.stop()
+    # Writes whatever readings are still queued
+    telemetry_writer.stop()
+    await routing_client.close()
+    shutdown_pool()
+
+app = FastAPI(title="Trashway API", lifespan=lifespan)
 
 app.include_router(bins.router)
 app.include_router(simulations.router)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, UniqueConstraint, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -11,6 +11,19 @@ class Bin(Base):
     presence = Column(Integer)
     longitude = Column(Float, nullable=False)
     latitude = Column(Float, nullable=False)
+    # Time of the sensor reading behind weight and presence, None if never measured
+    weight_measured_at = Column(DateTime)
+    presence_measured_at = Column(DateTime)
+
+class Sweep(Base):
+    __tablename__ = "sweeps"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    # Grid and solver options as JSON
+    parameters = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    simulations = relationship("Simulation", back_populates="sweep")
 
 class Simulation(Base):
     __tablename__ = "simulations"
@@ -21,13 +34,25 @@ class Simulation(Base):
     bins_to_collect = Column(Integer, nullable=False)
     total_distance = Column(Float)
     total_time = Column(Float)
+    unserved_bins = Column(Integer)
+    # Re-optimized simulations point to the version they were patched from
+    parent_id = Column(Integer, ForeignKey("simulations.id"))
+    version = Column(Integer, default=1)
+    improvement = Column(Float)
+    # Solver options as JSON, so queued simulations can run after a restart
+    parameters = Column(Text)
+    error = Column(Text)
+    # Runs of a scenario sweep share its matrix and point to it
+    sweep_id = Column(Integer, ForeignKey("sweeps.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="pending")
     
     routes = relationship("Route", back_populates="simulation")
+    sweep = relationship("Sweep", back_populates="simulations")
 
 class Route(Base):
     __tablename__ = "routes"
+    __table_args__ = (Index("ix_routes_simulation", "simulation_id", "truck_id", "bin_order"),)
     id = Column(Integer, primary_key=True, index=True)
     simulation_id = Column(Integer, ForeignKey("simulations.id"), nullable=False)
     truck_id = Column(Integer, nullable=False)
@@ -39,8 +64,25 @@ class Route(Base):
     simulation = relationship("Simulation", back_populates="routes")
     bin = relationship("Bin")
 
+class PackedRoute(Base):
+    """One truck's round in a single row: its stops and legs as little-endian arrays
+    
+    bin_ids is int64, distances (meters) and durations (seconds) to the next
+    stop are float32; the last leg goes back to the depot.
+    """
+    __tablename__ = "packed_routes"
+    __table_args__ = (UniqueConstraint("simulation_id", "truck_id"),)
+    id = Column(Integer, primary_key=True)
+    simulation_id = Column(Integer, ForeignKey("simulations.id"), nullable=False)
+    truck_id = Column(Integer, nullable=False)
+    stops = Column(Integer, nullable=False)
+    bin_ids = Column(LargeBinary, nullable=False)
+    distances = Column(LargeBinary, nullable=False)
+    durations = Column(LargeBinary, nullable=False)
+
 class Distance(Base):
     __tablename__ = "distances"
+    __table_args__ = (UniqueConstraint("from_bin_id", "to_bin_id"),)
     id = Column(Integer, primary_key=True, index=True)
     from_bin_id = Column(Integer, ForeignKey("bins.id"), nullable=False)
     to_bin_id = Column(Integer, ForeignKey("bins.id"), nullable=False)
@@ -48,4 +90,14 @@ class Distance(Base):
     duration = Column(Float, nullable=False)
     
     from_bin = relationship("Bin", foreign_keys=[from_bin_id])
-    to_bin = relationship("Bin", foreign_keys=[to_bin_id])
\ No newline at end of file
+    to_bin = relationship("Bin", foreign_keys=[to_bin_id])
+
+class Measurement(Base):
+    """Append-only history of sensor readings; bins holds the latest values"""
+    __tablename__ = "measurements"
+    __table_args__ = (Index("ix_measurements_bin_time", "bin_id", "measured_at"),)
+    id = Column(Integer, primary_key=True)
+    bin_id = Column(Integer, ForeignKey("bins.id"), nullable=False)
+    weight = Column(Float)
+    presence = Column(Integer)
+    measured_at = Column(DateTime, nullable=False)
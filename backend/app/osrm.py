@@ -0,0 +1,386 @@
+import asyncio
+import os
+import random
+import time
+import aiohttp
+import numpy as np
+from .distances import haversine_block, estimate_duration
+
+OSRM_URL = os.getenv("OSRM_URL", "http://router.project-osrm.org")
+OSRM_PROFILE = os.getenv("OSRM_PROFILE", "driving")
+# The public demo server rejects /table requests above 100 coordinates
+OSRM_MAX_TABLE_COORDINATES = int(os.getenv("OSRM_MAX_TABLE_COORDINATES", "100"))
+# Routing client tuning, shared by every simulation of the process
+OSRM_MAX_CONNECTIONS = int(os.getenv("OSRM_MAX_CONNECTIONS", "16"))
+OSRM_MAX_CONCURRENCY = int(os.getenv("OSRM_MAX_CONCURRENCY", "8"))
+OSRM_RATE_LIMIT = float(os.getenv("OSRM_RATE_LIMIT", "20"))  # requests per second
+OSRM_TIMEOUT = float(os.getenv("OSRM_TIMEOUT", "30"))  # seconds per request
+OSRM_RETRIES = int(os.getenv("OSRM_RETRIES", "3"))
+OSRM_BACKOFF = float(os.getenv("OSRM_BACKOFF", "0.5"))  # seconds, doubled on each retry
+OSRM_MAX_INFLIGHT_KEYS = int(os.getenv("OSRM_MAX_INFLIGHT_KEYS", "1024"))
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: rate tokens per second, bursts up to capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class InFlightPairs:
+    """Pairs of points being routed right now by table requests, shared between concurrent callers
+
+    A caller claims the (source, destination) pairs nobody is routing, fetches
+    them and publishes its result arrays on a future; concurrent callers needing
+    some of these pairs await that future instead of requesting them again, so
+    simulations over overlapping bin sets route their common pairs once. Claims
+    are tracked per source point: sources claiming the same destinations share
+    one entry. Entries are dropped as soon as their fetch completes, and once
+    max_rows sources are in flight new ones are fetched without being shared.
+    """
+
+    def __init__(self, max_rows=OSRM_MAX_INFLIGHT_KEYS):
+        self.max_rows = max_rows
+        self.coalesced = 0
+        self._rows = 0
+        # source point -> [(destination point -> column, row, future of the owner's arrays)]
+        self._claims = {}
+
+    def __len__(self):
+        return self._rows
+
+    async def route(self, sources, destinations, distances, durations, answered, fetch):
+        """Fill the len(sources) x len(destinations) arrays, fetching only unclaimed pairs
+
+        fetch(rows, cols) requests sources[rows] x destinations[cols] into the
+        arrays. Pairs awaited from a caller that gets cancelled are claimed
+        again and fetched by this one.
+        """
+        pending = np.ones(distances.shape, dtype=bool)
+        while pending.any():
+            pending = await self._route_pending(sources, destinations, distances, durations, answered, fetch,
+                                                pending)
+
+    async def _route_pending(self, sources, destinations, distances, durations, answered, fetch, pending):
+        """One round of route() over the pending cells; returns those whose owner was cancelled"""
+        claimed = pending.copy()
+        waits = []
+        if self._claims:
+            for row, source in enumerate(sources):
+                for columns, owner_row, future in self._claims.get(source, ()):
+                    cols = [col for col in np.flatnonzero(claimed[row]).tolist() if destinations[col] in columns]
+                    if cols:
+                        claimed[row, cols] = False
+                        waits.append((row, cols, [columns[destinations[col]] for col in cols], owner_row, future))
+
+        # Rows claiming the same destinations are fetched together
+        groups = {}
+        for row in np.flatnonzero(claimed.any(axis=1)).tolist():
+            groups.setdefault(np.packbits(claimed[row]).tobytes(), []).append(row)
+        groups = [(np.array(rows, dtype=np.intp), np.flatnonzero(claimed[rows[0]])) for rows in groups.values()]
+
+        future = asyncio.get_running_loop().create_future()
+        registered = []
+        for rows, cols in groups:
+            columns = {destinations[col]: col for col in cols.tolist()}
+            for row in rows.tolist()[:max(self.max_rows - self._rows, 0)]:
+                entry = (columns, row, future)
+                self._claims.setdefault(sources[row], []).append(entry)
+                registered.append((sources[row], entry))
+                self._rows += 1
+        try:
+            await asyncio.gather(*[fetch(rows, cols) for rows, cols in groups])
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result((distances, durations, answered))
+        finally:
+            for source, entry in registered:
+                entries = self._claims[source]
+                entries.remove(entry)
+                if not entries:
+                    del self._claims[source]
+            self._rows -= len(registered)
+
+        orphaned = np.zeros(distances.shape, dtype=bool)
+        for row, cols, owner_cols, owner_row, owner in waits:
+            try:
+                owner_distances, owner_durations, owner_answered = await asyncio.shield(owner)
+            except asyncio.CancelledError:
+                if not owner.cancelled():
+                    raise
+                orphaned[row, cols] = True
+                continue
+            done = owner_answered[owner_row, owner_cols]
+            distances[row, cols] = np.where(done, owner_distances[owner_row, owner_cols], distances[row, cols])
+            durations[row, cols] = np.where(done, owner_durations[owner_row, owner_cols], durations[row, cols])
+            answered[row, cols] = done
+            self.coalesced += int(done.sum())
+        return orphaned
+
+
+class RoutingClient:
+    """App-lifetime OSRM client
+
+    One keep-alive connection pool, a global concurrency limit and a token-bucket
+    rate limit shared by every caller, per-request timeouts and jittered
+    exponential retry. Table pairs another caller is already routing are shared
+    instead of requested again (InFlightPairs). Started and closed
+    from the FastAPI lifespan hook; it also starts lazily on first use. Other
+    threads submit their routing to it with run_threadsafe.
+    """
+
+    def __init__(self, base_url=OSRM_URL, profile=OSRM_PROFILE, max_connections=OSRM_MAX_CONNECTIONS,
+                 max_concurrency=OSRM_MAX_CONCURRENCY, rate_limit=OSRM_RATE_LIMIT, timeout=OSRM_TIMEOUT,
+                 retries=OSRM_RETRIES, backoff=OSRM_BACKOFF):
+        self.base_url = base_url
+        self.profile = profile
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+        self._loop = None
+        self.counters = {
+            'requests': 0,
+            'in_flight': 0,
+            'retries': 0,
+            'failures': 0,
+            'fallbacks': 0
+        }
+        self.in_flight = InFlightPairs()
+
+    async def start(self):
+        """Open the connection pool on the running event loop"""
+        if self.session is not None and self._loop is asyncio.get_running_loop():
+            return
+        await self.close()
+        self._loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(self.rate_limit) if self.rate_limit > 0 else None
+        self.in_flight = InFlightPairs(self.in_flight.max_rows)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            try:
+                await self.session.close()
+            except RuntimeError:
+                # The loop the session belonged to is gone
+                pass
+        self.session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def run_threadsafe(self, coroutine):
+        """Run a coroutine using this client on the event loop it was started on, from another thread
+
+        Background threads go through the shared pool and limits instead of
+        opening their own. Blocks until the coroutine is done.
+        """
+        if self._loop is None or self._loop.is_closed() or self.session is None:
+            coroutine.close()
+            raise RuntimeError("Routing client is not started")
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['coalesced'] = self.in_flight.coalesced
+        stats['inflight_rows'] = len(self.in_flight)
+        return stats
+
+    async def get_json(self, url):
+        """GET url and decode JSON, retrying transient errors; None once retries are exhausted"""
+        await self.start()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.counters['retries'] += 1
+                # Jittered exponential backoff: uniform in [0, backoff * 2^attempt]
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+            async with self._semaphore:
+                if self._bucket is not None:
+                    await self._bucket.acquire()
+                self.counters['requests'] += 1
+                self.counters['in_flight'] += 1
+                try:
+                    async with self.session.get(url) as response:
+                        if response.status == 200:
+                            return await response.json()
+                        if response.status not in RETRY_STATUSES:
+                            print(f"OSRM error: HTTP {response.status}")
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"OSRM request error: {e!r}")
+                finally:
+                    self.counters['in_flight'] -= 1
+
+        self.counters['failures'] += 1
+        return None
+
+
+routing_client = RoutingClient()
+
+
+def _format_coordinates(points):
+    # OSRM expects lon,lat pairs
+    return ";".join(f"{lon},{lat}" for lat, lon in points)
+
+
+async def fetch_table(client, sources, destinations):
+    """Request one many-to-many block from the OSRM table service
+
+    Returns (distances, durations) float arrays of shape len(sources) x len(destinations)
+    with NaN for unroutable cells, or None if the request failed.
+    """
+    source_indexes = ";".join(str(i) for i in range(len(sources)))
+    destination_indexes = ";".join(str(len(sources) + i) for i in range(len(destinations)))
+    # Query string built by hand: OSRM wants literal ';' and ',' separators
+    url = (
+        f"{client.base_url}/table/v1/{client.profile}/{_format_coordinates(list(sources) + list(destinations))}"
+        f"?sources={source_indexes}&destinations={destination_indexes}&annotations=distance,duration"
+    )
+
+    data = await client.get_json(url)
+    if data and data.get('code') == 'Ok':
+        # null cells (no route found) become NaN
+        distances = np.array(data['distances'], dtype=np.float64)
+        durations = np.array(data['durations'], dtype=np.float64)
+        return distances, durations
+
+    client.counters['fallbacks'] += 1
+    return None
+
+
+async def table_matrix(client, sources, destinations, max_coordinates=OSRM_MAX_TABLE_COORDINATES):
+    """Many-to-many distances/durations between (lat, lon) point lists
+
+    Source and destination sets are split into chunks so that no request exceeds
+    max_coordinates, and the sub-matrices are merged into float32 arrays. Cells the
+    router could not route keep their haversine estimate. The returned boolean
+    answered mask marks the cells covered by a successful request, so callers can
+    tell an unroutable pair (definitive) from a failed request (worth retrying).
+    Pairs a concurrent caller of the same client is already routing are taken
+    from its requests instead of being fetched again.
+    """
+    # Hashable points, so pairs can be matched against those of concurrent callers
+    sources = [tuple(p) for p in sources]
+    destinations = [tuple(p) for p in destinations]
+    distances = haversine_block(
+        [p[0] for p in sources], [p[1] for p in sources],
+        [p[0] for p in destinations], [p[1] for p in destinations]
+    )
+    durations = estimate_duration(distances)
+    answered = np.zeros(distances.shape, dtype=bool)
+    if not sources or not destinations:
+        return distances, durations, answered
+
+    chunk = max(1, max_coordinates // 2)
+
+    async def fetch_block(rows, cols):
+        # Concurrency and rate are bounded by the client
+        block = await fetch_table(client, [sources[i] for i in rows.tolist()], [destinations[j] for j in cols.tolist()])
+        if block is None:
+            return
+        block_distances, block_durations = block
+        cells = np.ix_(rows, cols)
+        target_distances = distances[cells]
+        target_durations = durations[cells]
+
+        # Per-cell fallback: only overwrite the cells OSRM actually routed
+        routed = ~(np.isnan(block_distances) | np.isnan(block_durations))
+        target_distances[routed] = block_distances[routed]
+        target_durations[routed] = block_durations[routed]
+        distances[cells] = target_distances
+        durations[cells] = target_durations
+        answered[cells] = True
+
+    async def fetch(rows, cols):
+        await asyncio.gather(*[
+            fetch_block(rows[i:i + chunk], cols[j:j + chunk])
+            for i in range(0, len(rows), chunk)
+            for j in range(0, len(cols), chunk)
+        ])
+
+    await client.start()
+    await client.in_flight.route(sources, destinations, distances, durations, answered, fetch)
+    return distances, durations, answered
+
+
+async def table_edges(client, points, sources, targets, max_coordinates=OSRM_MAX_TABLE_COORDINATES):
+    """Distances/durations for an edge list (points[sources[e]] -> points[targets[e]])
+
+    Consecutive edges are grouped by source into table requests whose source and
+    destination sets each stay under max_coordinates / 2, so spatially ordered edges
+    (e.g. k nearest neighbours) cost about one request per group. Returns per-edge
+    (distances, durations, answered) arrays with haversine fallback.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    half = max(1, max_coordinates // 2)
+
+    # Cut the edge list into groups of distinct sources / destinations
+    groups = []
+    group_sources, group_targets, start = set(), set(), 0
+    for e in range(len(sources)):
+        source, target = int(sources[e]), int(targets[e])
+        new_sources = len(group_sources) + (source not in group_sources)
+        new_targets = len(group_targets) + (target not in group_targets)
+        if group_sources and source not in group_sources and (new_sources > half or new_targets > half):
+            groups.append((start, e))
+            group_sources, group_targets, start = set(), set(), e
+        group_sources.add(source)
+        group_targets.add(target)
+    if len(sources):
+        groups.append((start, len(sources)))
+
+    distances = np.empty(len(sources), dtype=np.float32)
+    durations = np.empty(len(sources), dtype=np.float32)
+    answered = np.zeros(len(sources), dtype=bool)
+
+    async def fetch_group(start, end):
+        source_ids = list(dict.fromkeys(sources[start:end].tolist()))
+        target_ids = list(dict.fromkeys(targets[start:end].tolist()))
+        source_pos = {p: i for i, p in enumerate(source_ids)}
+        target_pos = {p: i for i, p in enumerate(target_ids)}
+        block_distances, block_durations, block_answered = await table_matrix(
+            client, [points[p] for p in source_ids], [points[p] for p in target_ids],
+            max_coordinates=max_coordinates
+        )
+        rows = np.array([source_pos[p] for p in sources[start:end].tolist()], dtype=np.intp)
+        cols = np.array([target_pos[p] for p in targets[start:end].tolist()], dtype=np.intp)
+        distances[start:end] = block_distances[rows, cols]
+        durations[start:end] = block_durations[rows, cols]
+        answered[start:end] = block_answered[rows, cols]
+
+    await asyncio.gather(*[fetch_group(start, end) for start, end in groups])
+    return distances, durations, answered
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from .distances import DEPOT_COORDS
+from .solver.local_search import LOCAL_SEARCH_NEIGHBORS
+from .solver.alns import ALNS_NEIGHBORS
+from .solver.decompose import CLUSTER_SIZE
+from .solver.parallel import SOLVER_WORKERS
+
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", "128"))
+RESULT_CACHE_BYTES = int(float(os.getenv("RESULT_CACHE_MB", "64")) * 1024 * 1024)
+# Bookkeeping of an entry besides its arrays
+ENTRY_OVERHEAD = 512
+
+# Settings outside the request that change what a solve returns
+SOLVER_SETTINGS = {
+    'depot': list(DEPOT_COORDS),
+    'local_search_neighbors': LOCAL_SEARCH_NEIGHBORS,
+    'alns_neighbors': ALNS_NEIGHBORS,
+    'cluster_size': CLUSTER_SIZE,
+    'solver_workers': SOLVER_WORKERS
+}
+
+
+def result_key(bins_data, parameters):
+    """SHA-256 over the bins in selection order (id, coordinates, weight, presence),
+    the simulation parameters and the solver settings"""
+    digest = hashlib.sha256()
+    digest.update(np.array(
+        [[b['id'], b['latitude'], b['longitude'], b['weight'], b['presence']] for b in bins_data],
+        dtype=np.float64
+    ).tobytes())
+    digest.update(json.dumps([parameters, SOLVER_SETTINGS], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class CachedResult:
+    """Routes of a completed simulation, as rows of
+    (truck_id, bin_order, bin_id, distance_to_next, time_to_next), and the
+    ids of every bin it was asked to collect, served or not"""
+
+    def __init__(self, rows, bin_ids, total_distance, total_time, unserved_bins, improvement):
+        self.rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+        self.bin_ids = np.unique(np.asarray(bin_ids, dtype=np.int64))
+        self.total_distance = total_distance
+        self.total_time = total_time
+        self.unserved_bins = unserved_bins
+        self.improvement = improvement
+
+    @property
+    def size(self):
+        return self.rows.nbytes + self.bin_ids.nbytes + ENTRY_OVERHEAD
+
+
+class ResultCache:
+    """In-memory LRU of simulation results keyed by result_key
+
+    Keys already change with any bin of the simulation, so stale entries can
+    never hit; invalidate() drops them early to free their room. Entries are
+    evicted least recently used first once there are more than max_entries or
+    they take more than max_bytes.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_ENTRIES, max_bytes=RESULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_bin = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.bytes += entry.size
+            for bin_id in entry.bin_ids.tolist():
+                self._by_bin.setdefault(bin_id, set()).add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, bin_ids):
+        """Drop the results of simulations collecting any of these bins"""
+        with self._lock:
+            for bin_id in bin_ids:
+                for key in list(self._by_bin.get(bin_id, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_bin.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for bin_id in entry.bin_ids.tolist():
+            keys = self._by_bin.get(bin_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_bin[bin_id]
+
+
+result_cache = ResultCache()
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+from .models import PackedRoute, Route
+
+# "rows" writes one routes row per stop, "packed" one packed_routes row per truck
+ROUTE_STORAGE = os.getenv("ROUTE_STORAGE", "rows")
+ROUTE_COLUMNS = ("truck_id", "bin_order", "bin_id", "distance_to_next", "time_to_next")
+
+
+def write_routes(db, simulation_id, rows, storage=None):
+    """Insert a simulation's stops with one executemany, in the caller's transaction
+
+    rows are (truck_id, bin_order, bin_id, distance_to_next, time_to_next),
+    bin_order counting from 0 in each truck.
+    """
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+    if len(rows) == 0:
+        return
+    rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+    if (storage or ROUTE_STORAGE) == "packed":
+        trucks = rows[:, 0].astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, np.diff(trucks) != 0])
+        ends = np.r_[starts[1:], len(rows)]
+        db.execute(insert(PackedRoute.__table__), [
+            {
+                'simulation_id': simulation_id,
+                'truck_id': int(trucks[start]),
+                'stops': int(end - start),
+                'bin_ids': rows[start:end, 2].astype('<i8').tobytes(),
+                'distances': rows[start:end, 3].astype('<f4').tobytes(),
+                'durations': rows[start:end, 4].astype('<f4').tobytes()
+            } for start, end in zip(starts.tolist(), ends.tolist())
+        ])
+        return
+
+    values = [
+        {
+            'simulation_id': simulation_id,
+            'truck_id': int(truck_id),
+            'bin_order': int(bin_order),
+            'bin_id': int(bin_id),
+            'distance_to_next': None if distance != distance else distance,
+            'time_to_next': None if duration != duration else duration
+        } for truck_id, bin_order, bin_id, distance, duration in rows.tolist()
+    ]
+    db.execute(insert(Route.__table__), values)
+
+
+def read_routes(db, simulation_id):
+    """A simulation's stops as an (n x 5) float64 array of ROUTE_COLUMNS, by truck and order
+
+    Stops are read from both storages, so simulations stored either way are
+    returned alike. Missing legs are NaN.
+    """
+    parts = [np.array([tuple(row) for row in db.execute(
+        select(*(getattr(Route, column) for column in ROUTE_COLUMNS))
+        .where(Route.simulation_id == simulation_id)
+        .order_by(Route.truck_id, Route.bin_order)
+    )], dtype=np.float64).reshape(-1, 5)]
+    for truck_id, bin_ids, distances, durations in db.execute(
+        select(PackedRoute.truck_id, PackedRoute.bin_ids, PackedRoute.distances, PackedRoute.durations)
+        .where(PackedRoute.simulation_id == simulation_id)
+        .order_by(PackedRoute.truck_id)
+    ):
+        bin_ids = np.frombuffer(bin_ids, dtype='<i8')
+        parts.append(np.column_stack([
+            np.full(len(bin_ids), truck_id), np.arange(len(bin_ids)), bin_ids,
+            np.frombuffer(distances, dtype='<f4'), np.frombuffer(durations, dtype='<f4')
+        ]).astype(np.float64))
+    rows = np.concatenate(parts)
+    if len(parts[0]) and len(parts) > 1:
+        rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+    return rows
+
+
+def trucks_used(db, simulation_ids):
+    """Number of trucks with at least one stop, per simulation id"""
+    counts = dict(db.execute(
+        select(Route.simulation_id, func.count(func.distinct(Route.truck_id)))
+        .where(Route.simulation_id.in_(simulation_ids))
+        .group_by(Route.simulation_id)
+    ).all())
+    for simulation_id, trucks in db.execute(
+        select(PackedRoute.simulation_id, func.count(PackedRoute.id))
+        .where(PackedRoute.simulation_id.in_(simulation_ids))
+        .group_by(PackedRoute.simulation_id)
+    ):
+        counts[simulation_id] = counts.get(simulation_id, 0) + trucks
+    return counts
+
+
+def delete_routes(db, simulation_id):
+    db.execute(delete(Route.__table__).where(Route.__table__.c.simulation_id == simulation_id))
+    db.execute(delete(PackedRoute.__table__).where(PackedRoute.__table__.c.simulation_id == simulation_id))
@@ -1,10 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from ..database import SessionLocal
-from ..models import Bin
-from pydantic import BaseModel
-from typing import List
-from datetime import datetime
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert
+from ..database import SessionLocal, engine
+from ..models import Bin, Distance, Measurement
+from ..distance_cache import invalidate_bins
+from ..distances import haversine_distance
+from ..bin_index import bin_locator
+from ..bin_store import BIN_FIELDS, bin_store, bin_row, read_bin_rows
+from ..snapshots import snapshot_store
+from ..result_cache import result_cache
+from ..telemetry import telemetry_writer
+from pydantic import BaseModel, ValidationError
+from typing import Any, List, Optional
+from datetime import datetime, timezone
+import json
+import numpy as np
 
 router = APIRouter()
 
@@ -31,6 +43,14 @@ class BinWeightUpdate(BaseModel):
 class BinGeneralUpdate(BaseModel):
     weight: float = None
     presence: int = None
+    longitude: float = None
+    latitude: float = None
+
+class Reading(BaseModel):
+    bin_id: str  # sensor-side id, as in BinCreate
+    weight: Optional[float] = None
+    presence: Optional[int] = None
+    measured_at: Optional[datetime] = None  # defaults to the time the batch is received
 
 @router.post("/bins/", response_model=dict)
 def create_bin(bin: BinCreate, db: Session = Depends(get_db)):
@@ -43,24 +63,414 @@ def create_bin(bin: BinCreate, db: Session = Depends(get_db)):
     }
     db_bin = Bin(**bin_data)
     db.add(db_bin)
-    db.commit()
+    bin_store.commit(db, lambda: bin_store.upsert([bin_row(db_bin)]))
     db.refresh(db_bin)
+    snapshot_store.request_rebuild()
     return {"id": db_bin.id}
 
-@router.get("/bins/", response_model=List[dict])
-def read_bins(db: Session = Depends(get_db)):
-    bins = db.query(Bin).all()
-    result = []
+# Ids per IN (...) clause, well below SQLite's bound parameter limit
+BULK_CHUNK = 500
+BIN_COLUMNS = ("weight", "presence", "longitude", "latitude")
+
+def chunks(values, size=BULK_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def validate_bins(rows):
+    """Validate raw bin rows one by one
+    
+    Returns (bins, errors): the valid rows as dicts, and an error per invalid
+    row with its index in the request.
+    """
+    bins, errors, seen = [], [], set()
+    for index, row in enumerate(rows):
+        try:
+            bin = BinCreate.model_validate(row)
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "bin_id": row.get("bin_id") if isinstance(row, dict) else None,
+                "error": "; ".join(
+                    f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err['loc'] else err['msg'] for err in e.errors()
+                )
+            })
+            continue
+        error = None
+        if bin.bin_id in seen:
+            error = "duplicate bin_id in request"
+        elif not (-90 <= bin.latitude <= 90 and -180 <= bin.longitude <= 180):
+            error = "coordinates out of range"
+        elif bin.weight < 0:
+            error = "weight must not be negative"
+        elif bin.presence not in (0, 1):
+            error = "presence must be 0 or 1"
+        if error:
+            errors.append({"index": index, "bin_id": bin.bin_id, "error": error})
+            continue
+        seen.add(bin.bin_id)
+        bins.append(bin.model_dump())
+    return bins, errors
+
+def upsert_bins(db, bins):
+    """Insert or update bins by bin_id with one executemany, in the caller's transaction
+    
+    Cached distances of moved bins are dropped. Returns (inserted, updated,
+    changed, moved): counts, then the ids of existing bins whose data or
+    position changed.
+    """
+    existing = {}
+    for bin_ids in chunks(b["bin_id"] for b in bins):
+        for row in db.execute(
+            select(Bin.id, Bin.bin_id, *(getattr(Bin, column) for column in BIN_COLUMNS))
+            .where(Bin.bin_id.in_(bin_ids))
+        ):
+            existing[row.bin_id] = row
+    
+    changed, moved = [], []
     for b in bins:
-        bin_dict = {
-            "id": b.id,
-            "bin_id": b.bin_id,
-            "weight": b.weight,
-            "presence": b.presence,
-            "longitude": b.longitude,
-            "latitude": b.latitude
-        }
-        result.append(bin_dict)
+        row = existing.get(b["bin_id"])
+        if row is None:
+            continue
+        if (row.longitude, row.latitude) != (b["longitude"], b["latitude"]):
+            moved.append(row.id)
+        if any(getattr(row, column) != b[column] for column in BIN_COLUMNS):
+            changed.append(row.id)
+    
+    if bins:
+        # Core statements on the table: one executemany, no ORM objects
+        statement = insert(Bin.__table__)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[Bin.bin_id],
+                set_={column: statement.excluded[column] for column in BIN_COLUMNS}
+            ),
+            bins
+        )
+    for bin_ids in chunks(moved):
+        invalidate_bins(db, bin_ids)
+    return len(bins) - len(existing), len(existing), changed, moved
+
+@router.post("/bins/bulk", response_model=dict)
+def bulk_upsert_bins(rows: List[Any], db: Session = Depends(get_db)):
+    """Insert or update many bins by bin_id in one transaction
+    
+    Invalid rows are skipped and reported in errors with their index; the
+    others are written.
+    """
+    bins, errors = validate_bins(rows)
+    try:
+        inserted, updated, changed, moved = upsert_bins(db, bins)
+        bin_store.commit(db, lambda: bin_store.upsert(read_bin_rows(db, [b["bin_id"] for b in bins])))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    result_cache.invalidate(changed)
+    if inserted or moved:
+        snapshot_store.request_rebuild()
+    return {"inserted": inserted, "updated": updated, "errors": errors}
+
+@router.put("/bins/", response_model=dict)
+def replace_bins(rows: List[Any], db: Session = Depends(get_db)):
+    """Atomically replace the whole bin set
+    
+    Bins are matched by bin_id, so kept bins keep their id and cached
+    distances; bins missing from the request are deleted. Nothing is written
+    if any row is invalid (422 with the row errors).
+    """
+    bins, errors = validate_bins(rows)
+    if errors:
+        raise HTTPException(status_code=422, detail={"errors": errors})
+    try:
+        inserted, updated, changed, moved = upsert_bins(db, bins)
+        kept = {b["bin_id"] for b in bins}
+        removed = [row.id for row in db.execute(select(Bin.id, Bin.bin_id)) if row.bin_id not in kept]
+        delete_bin_ids(db, removed)
+
+        def patch():
+            bin_store.remove(removed)
+            bin_store.upsert(read_bin_rows(db, [b["bin_id"] for b in bins]))
+        bin_store.commit(db, patch)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    result_cache.invalidate(changed + removed)
+    if inserted or moved or removed:
+        snapshot_store.request_rebuild()
+    return {"inserted": inserted, "updated": updated, "deleted": len(removed), "errors": []}
+
+def delete_bin_ids(db, ids):
+    """Delete bins and their cached distances with executemany, in the caller's transaction"""
+    if not ids:
+        return
+    for bin_ids in chunks(ids):
+        invalidate_bins(db, bin_ids)
+    db.execute(
+        delete(Bin.__table__).where(Bin.__table__.c.id == bindparam("bin_pk")),
+        [{"bin_pk": bin_id} for bin_id in ids]
+    )
+
+@router.delete("/bins/", response_model=dict)
+def delete_bins(
+    ids: Optional[List[int]] = Query(None),
+    presence: Optional[int] = None,
+    min_weight: Optional[float] = None,
+    max_weight: Optional[float] = None,
+    all: bool = False,
+    db: Session = Depends(get_db)
+):
+    """Delete the bins matching every given filter in one transaction
+    
+    Without any filter, all=true is required to delete every bin.
+    """
+    conditions = bin_conditions(ids, presence, min_weight, max_weight)
+    if not conditions and not all:
+        raise HTTPException(status_code=400, detail="Give at least one filter, or all=true to delete every bin")
+    
+    try:
+        if conditions:
+            removed = db.execute(select(Bin.id).where(*conditions)).scalars().all()
+            delete_bin_ids(db, removed)
+        else:
+            removed = db.execute(select(Bin.id)).scalars().all()
+            db.execute(delete(Distance))
+            db.execute(delete(Bin))
+        bin_store.commit(db, lambda: bin_store.remove(removed))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    result_cache.invalidate(removed)
+    if removed:
+        snapshot_store.request_rebuild()
+    return {"deleted": len(removed)}
+
+# Readings accepted per ingestion request
+MAX_READINGS = 50000
+
+@router.post("/bins/telemetry", response_model=dict, status_code=202)
+def ingest_telemetry(rows: List[Any]):
+    """Queue a batch of sensor readings for the background writer
+    
+    Readings are validated here and written later in large transactions, so
+    the request never waits on the database. Invalid readings are reported
+    with their index; readings of unknown bins are counted by the writer.
+    Answers 503 when the writer is too far behind.
+    """
+    if len(rows) > MAX_READINGS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_READINGS} readings per request")
+    received_at = datetime.utcnow()
+    readings, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            reading = Reading.model_validate(row)
+        except ValidationError as e:
+            errors.append({"index": index, "error": str(e.errors()[0]['msg'])})
+            continue
+        if reading.weight is None and reading.presence is None:
+            errors.append({"index": index, "error": "weight or presence is required"})
+        elif reading.weight is not None and reading.weight < 0:
+            errors.append({"index": index, "error": "weight must not be negative"})
+        elif reading.presence not in (None, 0, 1):
+            errors.append({"index": index, "error": "presence must be 0 or 1"})
+        else:
+            measured_at = reading.measured_at or received_at
+            if measured_at.tzinfo is not None:
+                # Stored naive in UTC like every other timestamp
+                measured_at = measured_at.astimezone(timezone.utc).replace(tzinfo=None)
+            readings.append((reading.bin_id, reading.weight, reading.presence, measured_at))
+    
+    if not telemetry_writer.submit(readings):
+        raise HTTPException(status_code=503, detail="Telemetry writer is busy, retry later")
+    return {"accepted": len(readings), "errors": errors}
+
+@router.get("/bins/{bin_id}/measurements", response_model=List[dict])
+def read_measurements(bin_id: int, since: Optional[datetime] = None, limit: int = 1000,
+                      db: Session = Depends(get_db)):
+    """Readings of a bin, most recent first"""
+    query = select(Measurement.weight, Measurement.presence, Measurement.measured_at).where(
+        Measurement.bin_id == bin_id
+    )
+    if since is not None:
+        query = query.where(Measurement.measured_at >= since)
+    rows = db.execute(query.order_by(Measurement.measured_at.desc()).limit(min(limit, 100000))).all()
+    return [
+        {"weight": row.weight, "presence": row.presence, "measured_at": row.measured_at}
+        for row in rows
+    ]
+
+@router.get("/debug/telemetry", response_model=dict)
+def debug_telemetry():
+    """Telemetry writer queue and counters"""
+    return telemetry_writer.stats()
+
+@router.get("/debug/bin-store", response_model=dict)
+def debug_bin_store():
+    """In-memory bin snapshot: size, versions, loads and patches"""
+    return bin_store.stats()
+
+@router.delete("/debug/bin-store", response_model=dict)
+def reload_bin_store():
+    """Drop the bin snapshot so the next read loads it again, after writes from outside the API"""
+    bin_store.invalidate()
+    return {"success": True}
+
+# Rows fetched and serialized per chunk when streaming
+STREAM_CHUNK = 1000
+
+def bin_conditions(ids=None, presence=None, min_weight=None, max_weight=None):
+    """WHERE clauses shared by the bin listing and bulk delete filters"""
+    conditions = []
+    if ids is not None:
+        conditions.append(Bin.id.in_(ids))
+    if presence is not None:
+        conditions.append(Bin.presence == presence)
+    if min_weight is not None:
+        conditions.append(Bin.weight >= min_weight)
+    if max_weight is not None:
+        conditions.append(Bin.weight <= max_weight)
+    return conditions
+
+def query_chunks(query, fields):
+    """Rows of a Core SELECT as lists of dicts, STREAM_CHUNK at a time
+    
+    Runs on its own connection: the request's session is closed by the time
+    the response body is sent.
+    """
+    with engine.connect() as connection:
+        result = connection.execute(query)
+        while True:
+            rows = result.fetchmany(STREAM_CHUNK)
+            if not rows:
+                break
+            yield [dict(zip(fields, row)) for row in rows]
+
+def stream_rows(chunks, fmt):
+    """Chunks of dicts as NDJSON lines or one JSON array"""
+    if fmt == "json":
+        yield "["
+    first = True
+    for records in chunks:
+        if not records:
+            continue
+        lines = [json.dumps(record) for record in records]
+        if fmt == "ndjson":
+            yield "\n".join(lines) + "\n"
+        else:
+            yield ("" if first else ",") + ",".join(lines)
+        first = False
+    if fmt == "json":
+        yield "]"
+
+def parse_floats(value, count, message):
+    try:
+        values = [float(part) for part in value.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        raise HTTPException(status_code=400, detail=message)
+    return values
+
+@router.get("/bins/", response_model=List[dict])
+def read_bins(
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    presence: Optional[int] = None,
+    min_weight: Optional[float] = None,
+    max_weight: Optional[float] = None,
+    bbox: Optional[str] = None,
+    near: Optional[str] = None,
+    radius: Optional[float] = None,
+    stream: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Bins ordered by id, as a JSON list
+    
+    Keyset pagination: pass limit, then the X-Next-Cursor header of each page
+    as after_id for the next one. fields is a comma-separated projection
+    (e.g. "id,latitude,longitude"). stream="ndjson" or stream="json" sends the
+    rows as they are read (one object per line, or a chunked JSON array), so
+    memory use and time to first byte do not grow with the table.
+    
+    bbox="west,south,east,north" keeps the bins inside a box (a map viewport),
+    near="lat,lon" with radius in meters those around a point; both use the
+    bins R*Tree when SQLite has it.
+    """
+    columns = tuple(field.strip() for field in fields.split(",") if field.strip()) if fields else BIN_FIELDS
+    unknown = [field for field in columns if field not in BIN_FIELDS]
+    if unknown or not columns:
+        raise HTTPException(status_code=400, detail=f"fields must be among {', '.join(BIN_FIELDS)}")
+    if stream not in (None, "ndjson", "json"):
+        raise HTTPException(status_code=400, detail="stream must be 'ndjson' or 'json'")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    if bbox is not None:
+        bbox = parse_floats(bbox, 4, "bbox must be west,south,east,north")
+    if near is not None:
+        near = parse_floats(near, 2, "near must be lat,lon")
+        if radius is None or radius < 0:
+            raise HTTPException(status_code=400, detail="near needs a radius in meters")
+    
+    media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+    headers = {}
+    if bbox is None and near is None:
+        # Everything else is served from the in-memory snapshot, filtered with array masks
+        snapshot = bin_store.snapshot()
+        start = int(np.searchsorted(snapshot.ids, after_id, side="right")) if after_id is not None else 0
+        mask = np.ones(len(snapshot) - start, dtype=bool)
+        if presence is not None:
+            mask &= snapshot.presence[start:] == presence
+        if min_weight is not None:
+            mask &= snapshot.weights[start:] >= min_weight
+        if max_weight is not None:
+            mask &= snapshot.weights[start:] <= max_weight
+        rows = np.flatnonzero(mask) + start
+        if limit is not None:
+            if stream is None and len(rows) > limit:
+                headers["X-Next-Cursor"] = str(snapshot.ids[rows[limit - 1]])
+            rows = rows[:limit]
+        if stream is not None:
+            chunks = (snapshot.records(rows[first:first + STREAM_CHUNK], columns) for first in range(0, len(rows), STREAM_CHUNK))
+            return StreamingResponse(stream_rows(chunks, stream), media_type=media_type)
+        return JSONResponse(snapshot.records(rows, columns), headers=headers)
+    
+    query = select(*(getattr(Bin, field) for field in columns)).where(
+        *bin_conditions(presence=presence, min_weight=min_weight, max_weight=max_weight),
+        *bin_locator.area_conditions(bbox, near, radius)
+    )
+    if after_id is not None:
+        query = query.where(Bin.id > after_id)
+    query = query.order_by(Bin.id)
+    if limit is not None:
+        # One extra row tells whether there is a next page
+        query = query.limit(limit + 1 if stream is None else limit)
+    
+    if stream is not None:
+        return StreamingResponse(stream_rows(query_chunks(query, columns), stream), media_type=media_type)
+    
+    # The cursor is the last id, fetched alongside when it is not projected
+    cursor_extra = limit is not None and "id" not in columns
+    rows = db.execute(query.add_columns(Bin.id) if cursor_extra else query).all()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = str(rows[-1][-1] if cursor_extra else rows[-1][columns.index("id")])
+    # Plain dicts straight to JSON, without validating every row against the response model
+    return JSONResponse([dict(zip(columns, row)) for row in rows], headers=headers)
+
+@router.get("/bins/nearest", response_model=List[dict])
+def read_nearest_bins(latitude: float, longitude: float, k: int = 5):
+    """The k bins nearest to a point, closest first, with their straight-line distance in meters"""
+    if k < 1:
+        raise HTTPException(status_code=400, detail="k must be at least 1")
+    ids = bin_locator.nearest(latitude, longitude, k)
+    snapshot = bin_store.snapshot()
+    rows = snapshot.rows_of(ids)
+    result = snapshot.records(rows[rows >= 0])
+    for b in result:
+        b["distance"] = haversine_distance((latitude, longitude), (b["latitude"], b["longitude"]))['distance']
     return result
 
 @router.delete("/bins/{bin_id}", response_model=dict)
@@ -68,8 +478,11 @@ def delete_bin(bin_id: int, db: Session = Depends(get_db)):
     bin = db.query(Bin).filter(Bin.id == bin_id).first()
     if not bin:
         raise HTTPException(status_code=404, detail="Bin not found")
+    invalidate_bins(db, [bin.id])
     db.delete(bin)
-    db.commit()
+    bin_store.commit(db, lambda: bin_store.remove([bin_id]))
+    result_cache.invalidate([bin_id])
+    snapshot_store.request_rebuild()
     return {"success": True}
 
 @router.patch("/bins/{bin_id}/presence", response_model=dict)
@@ -78,8 +491,11 @@ def update_bin_presence(bin_id: int, bin_update: BinUpdate, db: Session = Depend
     if not bin:
         raise HTTPException(status_code=404, detail="Bin not found")
     
+    # A manual value is as recent as a reading taken now: older readings no longer replace it
     bin.presence = bin_update.presence
-    db.commit()
+    bin.presence_measured_at = datetime.utcnow()
+    bin_store.commit(db, lambda: bin_store.update(presence={bin_id: bin_update.presence}))
+    result_cache.invalidate([bin_id])
     
     return {"success": True}
 
@@ -90,7 +506,9 @@ def update_bin_weight(bin_id: int, bin_weight_update: BinWeightUpdate, db: Sessi
         raise HTTPException(status_code=404, detail="Bin not found")
     
     bin.weight = bin_weight_update.weight
-    db.commit()
+    bin.weight_measured_at = datetime.utcnow()
+    bin_store.commit(db, lambda: bin_store.update(weight={bin_id: bin_weight_update.weight}))
+    result_cache.invalidate([bin_id])
     
     return {"success": True}
 
@@ -100,10 +518,29 @@ def update_bin_general(bin_id: int, bin_general_update: BinGeneralUpdate, db: Se
     if not bin:
         raise HTTPException(status_code=404, detail="Bin not found")
     
+    now = datetime.utcnow()
     if bin_general_update.presence is not None:
         bin.presence = bin_general_update.presence
+        bin.presence_measured_at = now
     if bin_general_update.weight is not None:
         bin.weight = bin_general_update.weight
-    db.commit()
+        bin.weight_measured_at = now
+    
+    # Moving a bin makes its cached distances stale
+    moved = False
+    if bin_general_update.longitude is not None and bin_general_update.longitude != bin.longitude:
+        bin.longitude = bin_general_update.longitude
+        moved = True
+    if bin_general_update.latitude is not None and bin_general_update.latitude != bin.latitude:
+        bin.latitude = bin_general_update.latitude
+        moved = True
+    if moved:
+        invalidate_bins(db, [bin.id])
+        bin_store.commit(db, lambda: bin_store.upsert([bin_row(bin)]))
+    else:
+        bin_store.commit(db, lambda: bin_store.update(weight={bin_id: bin.weight}, presence={bin_id: bin.presence}))
+    result_cache.invalidate([bin_id])
+    if moved:
+        snapshot_store.request_rebuild()
     
     return {"success": True}
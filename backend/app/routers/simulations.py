@@ -1,19 +1,39 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from ..database import SessionLocal
-from ..models import Bin, Simulation, Route, Distance
+from ..database import SessionLocal, db_thread
+from ..models import Bin, Simulation, Distance, Sweep
+from ..distances import (
+    DEPOT_ID, DEPOT_COORDS, SPARSE_THRESHOLD, SPARSE_NEIGHBORS, build_distance_matrix, haversine_distance
+)
+from ..osrm import routing_client
+from ..distance_cache import cached_distance_matrix, cached_sparse_graph
+from ..snapshots import snapshot_store
+from ..bin_store import bin_store
+from ..solver.parallel import ALGORITHMS, multi_start
+from ..solver.decompose import DECOMPOSITIONS, solve_decomposed
+from ..solver.incremental import patch_routes
+from ..solver.batch import solve_batch
+from ..solver.uncertainty import overflow_risk, route_loads
+from ..jobs import ACTIVE_STATUSES, simulation_queue
+from ..result_cache import CachedResult, result_cache, result_key
+from ..route_store import delete_routes, read_routes, trucks_used, write_routes
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 import asyncio
-import aiohttp
+import itertools
+import json
+import numpy as np
 import random
-import math
+import time
 import traceback
 
 router = APIRouter()
 
+# Seconds between SSE keep-alive comments when a simulation has nothing new
+EVENTS_KEEPALIVE = 15.0
+
 def get_db():
     db = SessionLocal()
     try:
@@ -26,6 +46,22 @@ class SimulationCreate(BaseModel):
     max_trucks: int
     max_capacity: float
     bins_to_collect: int
+    distance_mode: Optional[str] = None  # "dense", "sparse" or None to pick by bin count
+    neighbors: int = SPARSE_NEIGHBORS
+    time_limit: float = 5.0  # seconds of local search after construction, 0 to skip
+    parallel_starts: int = 1  # independent seeded runs in the solver process pool, best kept
+    seed: Optional[int] = None
+    algorithm: str = "local_search"  # or "alns" to keep improving until time_limit
+    decomposition: Optional[str] = None  # "sweep" or "kmeans" to solve geographic clusters in parallel
+    use_cache: bool = True  # reuse the routes of an identical earlier run (same bins, parameters and seed)
+
+class SimulationDelta(BaseModel):
+    added: List[int] = []  # bins to add to the rounds
+    removed: List[int] = []  # bins to drop from the rounds
+    changed: List[int] = []  # bins whose weight or position changed, moved to their best place
+    time_limit: float = 0.5  # seconds of local repair around the patched bins
+    name: Optional[str] = None
+    seed: Optional[int] = None
 
 class SimulationResponse(BaseModel):
     id: int
@@ -35,12 +71,112 @@ class SimulationResponse(BaseModel):
     bins_to_collect: int
     total_distance: Optional[float]
     total_time: Optional[float]
-    status: str
+    unserved_bins: Optional[int] = None
+    improvement: Optional[float] = None  # meters saved by local search
+    parent_id: Optional[int] = None
+    version: Optional[int] = None
+    status: str  # pending, running, completed, failed or cancelled
+    error: Optional[str] = None
+    sweep_id: Optional[int] = None
     created_at: datetime
     
     class Config:
         from_attributes = True
 
+class SimulationSweep(BaseModel):
+    name: str
+    max_trucks: List[int]  # every combination of the three lists is solved
+    max_capacity: List[float]
+    bins_to_collect: List[int]
+    distance_mode: Optional[str] = None
+    neighbors: int = SPARSE_NEIGHBORS
+    time_limit: float = 5.0  # seconds per run
+    seed: Optional[int] = None
+    algorithm: str = "local_search"
+    use_cache: bool = True
+
+class SweepRun(BaseModel):
+    simulation_id: int
+    max_trucks: int
+    max_capacity: float
+    bins_to_collect: int
+    total_distance: Optional[float]
+    total_time: Optional[float]
+    trucks_used: int
+    unserved_bins: Optional[int]
+    status: str
+
+class SweepResponse(BaseModel):
+    id: int
+    name: str
+    created_at: datetime
+    runs: List[SweepRun]
+
+class TruckRisk(BaseModel):
+    truck_id: int
+    bins: int
+    expected_load: float
+    load_p95: float
+    overflow_probability: float
+    expected_extra_trips: float
+
+class UncertaintyResponse(BaseModel):
+    simulation_id: int
+    scenarios: int
+    max_capacity: float
+    unknown_weights: int  # bins without a measured weight, drawn at random
+    overflow_probability: float  # at least one truck over capacity
+    expected_extra_trips: float
+    trucks: List[TruckRisk]
+
+# Solver options kept in Simulation.parameters so queued runs survive a restart
+SOLVER_OPTIONS = {'name', 'max_trucks', 'max_capacity', 'bins_to_collect'}
+# Largest max_trucks x max_capacity x bins_to_collect grid of a sweep
+MAX_SWEEP_RUNS = 200
+MAX_SCENARIOS = 100000
+
+def simulation_response(sim):
+    return SimulationResponse(
+        id=sim.id,
+        name=sim.name,
+        max_trucks=sim.max_trucks,
+        max_capacity=sim.max_capacity,
+        bins_to_collect=sim.bins_to_collect,
+        total_distance=sim.total_distance,
+        total_time=sim.total_time,
+        unserved_bins=sim.unserved_bins,
+        improvement=sim.improvement,
+        parent_id=sim.parent_id,
+        version=sim.version,
+        status=sim.status,
+        error=sim.error,
+        sweep_id=sim.sweep_id,
+        created_at=sim.created_at
+    )
+
+def sweep_response(db, sweep):
+    """Comparison table of a sweep's runs"""
+    simulations = db.query(Simulation).filter(Simulation.sweep_id == sweep.id).order_by(Simulation.id).all()
+    trucks = trucks_used(db, [sim.id for sim in simulations])
+    return SweepResponse(
+        id=sweep.id,
+        name=sweep.name,
+        created_at=sweep.created_at,
+        runs=[
+            SweepRun(
+                simulation_id=sim.id,
+                max_trucks=sim.max_trucks,
+                max_capacity=sim.max_capacity,
+                bins_to_collect=sim.bins_to_collect,
+                total_distance=sim.total_distance,
+                total_time=sim.total_time,
+                trucks_used=trucks.get(sim.id, 0),
+                unserved_bins=sim.unserved_bins,
+                status=sim.status
+            ) for sim in simulations
+        ]
+    )
+
 class RouteResponse(BaseModel):
     truck_id: int
     bin_order: int
@@ -51,208 +187,722 @@ class RouteResponse(BaseModel):
     distance_to_next: Optional[float]
     time_to_next: Optional[float]
 
-# OSRM Service Functions
-async def get_route_info(session, start_coords, end_coords):
-    """Get route information from OSRM API"""
-    url = f"http://router.project-osrm.org/route/v1/driving/{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}"
-    params = {
-        'overview': 'false',
-        'alternatives': 'false',
-        'steps': 'false'
-    }
+async def batch_distance_calculation(db, bins_coords, distance_mode=None, neighbors=SPARSE_NEIGHBORS):
+    """Calculate distances between all bins, routing only pairs missing from the distances table
     
-    try:
-        async with session.get(url, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                if data['code'] == 'Ok' and data['routes']:
-                    route = data['routes'][0]
-                    return {
-                        'distance': route['distance'],  # meters
-                        'duration': route['duration']   # seconds
-                    }
-    except Exception as e:
-        print(f"OSRM API error: {e}")
-    
-    # Fallback to euclidean distance
-    return calculate_euclidean_distance(start_coords, end_coords)
-
-def calculate_euclidean_distance(coord1, coord2):
-    """Calculate euclidean distance as fallback"""
-    lat1, lon1 = coord1
-    lat2, lon2 = coord2
-    
-    # Rough conversion to meters (not accurate but for fallback)
-    lat_diff = abs(lat2 - lat1) * 111000  # 1 degree lat ≈ 111km
-    lon_diff = abs(lon2 - lon1) * 111000 * math.cos(math.radians((lat1 + lat2) / 2))
-    
-    distance = math.sqrt(lat_diff**2 + lon_diff**2)
-    # Estimate time assuming 30 km/h average speed
-    duration = distance / (30000 / 3600)  # 30 km/h in m/s
-    
-    return {
-        'distance': distance,
-        'duration': duration
-    }
-
-async def batch_distance_calculation(bins_coords, batch_size=20):
-    """Calculate distances between bins in batches to limit API calls"""
-    distances = {}
-    
-    async with aiohttp.ClientSession() as session:
-        # Batch the distance calculations
-        for i in range(0, len(bins_coords), batch_size):
-            batch = bins_coords[i:i + batch_size]
-            tasks = []
-            
-            for j, (bin_id1, coords1) in enumerate(batch):
-                for k, (bin_id2, coords2) in enumerate(bins_coords):
-                    if bin_id1 != bin_id2 and (bin_id1, bin_id2) not in distances:
-                        tasks.append(get_route_info(session, coords1, coords2))
-                        
-            # Execute batch
-            if tasks:
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                # Store results
-                result_idx = 0
-                for j, (bin_id1, coords1) in enumerate(batch):
-                    for k, (bin_id2, coords2) in enumerate(bins_coords):
-                        if bin_id1 != bin_id2 and (bin_id1, bin_id2) not in distances:
-                            if result_idx < len(results) and not isinstance(results[result_idx], Exception):
-                                distances[(bin_id1, bin_id2)] = results[result_idx]
-                            else:
-                                # Fallback to euclidean
-                                distances[(bin_id1, bin_id2)] = calculate_euclidean_distance(coords1, coords2)
-                            result_idx += 1
-                
-                # Add small delay between batches to be respectful to the API
-                await asyncio.sleep(1)
-    
-    return distances
-
-def optimize_routes(bins_data, max_trucks, max_capacity, distances):
-    """Optimize routes using a simple greedy algorithm"""
+    bins_coords starts with the depot. In sparse mode only each bin's nearest
+    neighbours and its depot links are routed.
+    """
+    ids = [bin_id for bin_id, _ in bins_coords]
+    points = [coords for _, coords in bins_coords]
     
+    if distance_mode is None:
+        distance_mode = "sparse" if len(bins_coords) > SPARSE_THRESHOLD else "dense"
+    if distance_mode == "sparse":
+        return await cached_sparse_graph(db, routing_client, ids, points, neighbors)
+    
+    # Memory-mapped snapshot of the whole bin set, when it is up to date
+    matrix = await db_thread(snapshot_store.matrix_for, db, ids)
+    if matrix is not None:
+        return matrix
+    
+    matrix = await cached_distance_matrix(db, routing_client, ids, points)
+    snapshot_store.request_rebuild()
+    return matrix
+
+def collection_demands(bins_data, distances, seed=None):
+    """Bins by matrix index and the demand array the solvers work on"""
     # For simulation purposes, treat all bins as needing collection
     # Assign a random weight between 10-90 for bins with 0 weight
+    rng = random.Random(seed)
     available_bins = []
     for bin_data in bins_data:
         if bin_data['weight'] == 0:
             # Assign random weight for simulation
             bin_data = bin_data.copy()
-            bin_data['weight'] = random.uniform(10, 90)
+            bin_data['weight'] = rng.uniform(10, 90)
         available_bins.append(bin_data)
     
-    if not available_bins:
-        return []
+    by_index = {distances.index[b['id']]: b for b in available_bins}
+    demands = np.zeros(len(distances))
+    for index, bin_data in by_index.items():
+        demands[index] = bin_data['weight']
+    return by_index, demands
+
+def optimize_routes(bins_data, max_trucks, max_capacity, distances, time_limit=None, parallel_starts=1, seed=None,
+                    algorithm="local_search", decomposition=None, on_improve=None):
+    """Optimize routes with the Clarke-Wright savings heuristic followed by local search
+    
+    distances is a DistanceMatrix or SparseDistanceGraph covering the depot and
+    the ids in bins_data. time_limit bounds the local search in seconds, across
+    all parallel_starts (None runs it to a local optimum, 0 skips it). With
+    algorithm="alns" the remaining budget goes to ALNS. seed makes the random
+    weights and the randomized starts reproducible. decomposition ("sweep" or
+    "kmeans") solves capacity-balanced clusters in parallel instead of the
+    parallel starts. on_improve(cost, routes) receives the best routes so far,
+    as bin ids, while the solver improves them. Returns
+    (routes, unserved, stats): the bins of each truck in visiting order, the bins
+    no truck could take within max_capacity, and the solver statistics.
+    """
     
-    # Simple round-robin assignment for now
-    routes = [[] for _ in range(max_trucks)]
-    current_loads = [0.0] * max_trucks
+    by_index, demands = collection_demands(bins_data, distances, seed)
+    if not by_index:
+        return [], [], None
     
-    bin_index = 0
-    for bin_data in available_bins:
-        # Find truck with lightest load that can accommodate this bin
-        best_truck = None
-        best_load = float('inf')
-        
-        for truck_id in range(max_trucks):
-            if current_loads[truck_id] + bin_data['weight'] <= max_capacity:
-                if current_loads[truck_id] < best_load:
-                    best_load = current_loads[truck_id]
-                    best_truck = truck_id
-        
-        if best_truck is not None:
-            routes[best_truck].append(bin_data)
-            current_loads[best_truck] += bin_data['weight']
-        else:
-            # If no truck can accommodate, add to first truck anyway
-            routes[0].append(bin_data)
-            current_loads[0] += bin_data['weight']
+    report = None
+    if on_improve is not None:
+        def report(cost, routes):
+            on_improve(cost, [[by_index[i]['id'] for i in route] for route in routes])
+    
+    depot = distances.index[DEPOT_ID]
+    if decomposition:
+        latitudes = np.full(len(distances), DEPOT_COORDS[0])
+        longitudes = np.full(len(distances), DEPOT_COORDS[1])
+        for index, bin_data in by_index.items():
+            latitudes[index] = bin_data['latitude']
+            longitudes[index] = bin_data['longitude']
+        routes, unserved, stats = solve_decomposed(
+            distances, demands, list(by_index), max_trucks, max_capacity, latitudes, longitudes, depot=depot,
+            method=decomposition, time_limit=time_limit, seed=seed, algorithm=algorithm, on_improve=report
+        )
+        print(f"Decomposition: {stats['clusters']} clusters in {stats['cluster_seconds']:.2f}s, "
+              f"boundary repair of {stats['boundary_bins']} bins in {stats['repair_seconds']:.2f}s")
+    else:
+        routes, unserved, stats = multi_start(
+            distances, demands, list(by_index), max_trucks, max_capacity, depot=depot,
+            starts=parallel_starts, time_limit=time_limit, seed=seed, algorithm=algorithm, on_improve=report
+        )
+    if stats and 'initial_cost' in stats:
+        print(f"Local search: {stats['initial_cost']:.0f} m -> {stats['final_cost']:.0f} m "
+              f"in {stats['elapsed']:.2f}s, moves {stats['moves']}")
+    if stats and 'iterations' in stats:
+        print(f"ALNS: {stats['iterations']} iterations, {stats['final_cost']:.0f} m")
+    if stats and 'starts' in stats:
+        print(f"Multi-start: best of {stats['starts']} runs is start {stats['best_start']}")
+    
+    return [[by_index[i] for i in route] for route in routes], [by_index[i] for i in unserved], stats
+
+def select_bins(bins_to_collect):
+    """Present bins to collect, heaviest first (bins_to_collect=0 selects all), from the bin snapshot"""
+    snapshot = bin_store.snapshot()
+    rows = np.flatnonzero(snapshot.presence == 1)
+    # Heaviest first, unknown weights last, then by id, as ORDER BY weight DESC, id would
+    rows = rows[np.lexsort((snapshot.ids[rows], -snapshot.weights[rows]))]
+    if bins_to_collect > 0:
+        rows = rows[:bins_to_collect]
+    return snapshot.records(rows, ('id', 'weight', 'presence', 'longitude', 'latitude'))
+
+def simulation_key(bins_data, simulation):
+    """Result cache key of a simulation over the bins it collects"""
+    parameters = {key: value for key, value in json.loads(simulation.parameters or "{}").items() if key != 'use_cache'}
+    parameters.update(
+        max_trucks=simulation.max_trucks,
+        max_capacity=simulation.max_capacity,
+        bins_to_collect=simulation.bins_to_collect
+    )
+    return result_key(bins_data, parameters)
+
+def complete_from_cache(db, simulation, cached):
+    """Copy a cached result's routes to the simulation and mark it completed"""
+    write_routes(db, simulation.id, cached.rows)
+    simulation.total_distance = cached.total_distance
+    simulation.total_time = cached.total_time
+    simulation.unserved_bins = cached.unserved_bins
+    simulation.improvement = cached.improvement
+    simulation.status = "completed"
+
+def cache_result(db, key, simulation, bins_data):
+    """Store a completed simulation's routes in the result cache"""
+    result_cache.put(key, CachedResult(
+        read_routes(db, simulation.id), [b['id'] for b in bins_data], simulation.total_distance, simulation.total_time,
+        simulation.unserved_bins, simulation.improvement
+    ))
+
+def save_routes(db, simulation_id, routes, distances):
+    """Write the stops of each truck in one bulk insert and return (total_distance, total_time)
+    
+    Rounds start and end at the depot: the last stop's distance_to_next is the
+    trip back to the depot.
+    """
+    total_distance = 0.0
+    total_time = 0.0
+    rows = []
     
-    # Remove empty routes
-    routes = [route for route in routes if route]
+    for truck_id, route in enumerate(routes):
+        if not route:
+            continue
+        leg = distances.get(DEPOT_ID, route[0]['id'])
+        total_distance += leg['distance']
+        total_time += leg['duration']
+        
+        for bin_order, bin_data in enumerate(route):
+            next_id = route[bin_order + 1]['id'] if bin_order + 1 < len(route) else DEPOT_ID
+            leg = distances.get(bin_data['id'], next_id)
+            total_distance += leg['distance']
+            total_time += leg['duration']
+            
+            rows.append((truck_id, bin_order, bin_data['id'], leg['distance'], leg['duration']))
     
-    return routes
+    write_routes(db, simulation_id, rows)
+    return total_distance, total_time
 
 @router.post("/simulations/", response_model=SimulationResponse)
-async def create_simulation(simulation: SimulationCreate, db: Session = Depends(get_db)):
+def create_simulation(simulation: SimulationCreate, db: Session = Depends(get_db)):
+    """Store the simulation as pending and queue it; poll GET /simulations/{id} for the result
+    
+    An identical earlier run (same bins, parameters and seed) found in the
+    result cache completes the simulation at once with a copy of its routes.
+    """
     try:
         print(f"Creating simulation: {simulation.name}")
+        if simulation.distance_mode not in (None, "dense", "sparse"):
+            raise HTTPException(status_code=400, detail="distance_mode must be 'dense' or 'sparse'")
+        if simulation.parallel_starts < 1:
+            raise HTTPException(status_code=400, detail="parallel_starts must be at least 1")
+        if simulation.algorithm not in ALGORITHMS:
+            raise HTTPException(status_code=400, detail=f"algorithm must be one of {', '.join(ALGORITHMS)}")
+        if simulation.decomposition not in (None,) + DECOMPOSITIONS:
+            raise HTTPException(status_code=400, detail=f"decomposition must be one of {', '.join(DECOMPOSITIONS)}")
         
-        # Create simulation record
         db_simulation = Simulation(
             name=simulation.name,
             max_trucks=simulation.max_trucks,
             max_capacity=simulation.max_capacity,
             bins_to_collect=simulation.bins_to_collect,
-            status="completed",  # Mark as completed immediately for testing
-            total_distance=123.45,  # Dummy values
-            total_time=67.89
+            parameters=json.dumps(simulation.model_dump(exclude=SOLVER_OPTIONS)),
+            version=1,
+            status="pending"
         )
+        cached = None
+        if simulation.use_cache:
+            bins_data = select_bins(simulation.bins_to_collect)
+            cached = result_cache.get(simulation_key(bins_data, db_simulation))
         db.add(db_simulation)
+        if cached is not None:
+            db.flush()
+            complete_from_cache(db, db_simulation, cached)
+            db.commit()
+            db.refresh(db_simulation)
+            print(f"Simulation {db_simulation.id} served from the result cache")
+            return simulation_response(db_simulation)
         db.commit()
         db.refresh(db_simulation)
+        simulation_queue.submit(db_simulation.id)
         
-        print(f"Simulation {db_simulation.id} created successfully")
-        
-        return SimulationResponse(
-            id=db_simulation.id,
-            name=db_simulation.name,
-            max_trucks=db_simulation.max_trucks,
-            max_capacity=db_simulation.max_capacity,
-            bins_to_collect=db_simulation.bins_to_collect,
-            total_distance=db_simulation.total_distance,
-            total_time=db_simulation.total_time,
-            status=db_simulation.status,
-            created_at=db_simulation.created_at
-        )
+        print(f"Simulation {db_simulation.id} queued")
+        return simulation_response(db_simulation)
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error creating simulation: {str(e)}")
         print(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@router.post("/simulations/sweep", response_model=SweepResponse)
+async def sweep_simulations(sweep: SimulationSweep, db: Session = Depends(get_db)):
+    """Solve every max_trucks x max_capacity x bins_to_collect combination over one distance matrix
+    
+    Bins are selected heaviest first, so every bins_to_collect is a prefix of
+    the largest selection: its distances are computed once and all the runs are
+    solved in parallel in the solver process pool. Each run is stored as a
+    completed Simulation linked to the sweep; runs found in the result cache are
+    copied instead of solved. Returns the comparison table of the runs.
+    """
+    try:
+        if not (sweep.max_trucks and sweep.max_capacity and sweep.bins_to_collect):
+            raise HTTPException(status_code=400, detail="max_trucks, max_capacity and bins_to_collect need a value each")
+        grid = list(itertools.product(sweep.max_trucks, sweep.max_capacity, sweep.bins_to_collect))
+        if len(grid) > MAX_SWEEP_RUNS:
+            raise HTTPException(status_code=400, detail=f"A sweep is limited to {MAX_SWEEP_RUNS} runs")
+        if sweep.distance_mode not in (None, "dense", "sparse"):
+            raise HTTPException(status_code=400, detail="distance_mode must be 'dense' or 'sparse'")
+        if sweep.algorithm not in ALGORITHMS:
+            raise HTTPException(status_code=400, detail=f"algorithm must be one of {', '.join(ALGORITHMS)}")
+        
+        print(f"Sweep {sweep.name}: {len(grid)} runs")
+        options = sweep.model_dump(exclude={'name', 'max_trucks', 'max_capacity', 'bins_to_collect'})
+        
+        def create():
+            selected = select_bins(0 if 0 in sweep.bins_to_collect else max(sweep.bins_to_collect))
+            db_sweep = Sweep(name=sweep.name, parameters=json.dumps(sweep.model_dump(exclude={'name'})))
+            db.add(db_sweep)
+            db.flush()
+            
+            runs = []
+            for max_trucks, max_capacity, bins_to_collect in grid:
+                bins_data = selected[:bins_to_collect] if bins_to_collect > 0 else selected
+                run = SimulationCreate(
+                    name=f"{sweep.name} ({max_trucks} trucks, {max_capacity:g} kg, {bins_to_collect or 'all'} bins)",
+                    max_trucks=max_trucks, max_capacity=max_capacity, bins_to_collect=bins_to_collect, **options
+                )
+                db_simulation = Simulation(
+                    name=run.name,
+                    max_trucks=max_trucks,
+                    max_capacity=max_capacity,
+                    bins_to_collect=bins_to_collect,
+                    parameters=json.dumps(run.model_dump(exclude=SOLVER_OPTIONS)),
+                    sweep_id=db_sweep.id,
+                    version=1,
+                    status="running"
+                )
+                db.add(db_simulation)
+                key = simulation_key(bins_data, db_simulation)
+                runs.append((db_simulation, bins_data, key, result_cache.get(key) if sweep.use_cache else None))
+            db.commit()
+            # The solve below reads them on the event loop
+            for db_simulation, *_ in runs:
+                db.refresh(db_simulation)
+            db.refresh(db_sweep)
+            return selected, db_sweep, runs
+        
+        selected, db_sweep, runs = await db_thread(create)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error creating sweep: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    try:
+        to_solve = [(db_simulation, bins_data) for db_simulation, bins_data, _, cached in runs
+                    if cached is None and bins_data]
+        distances, results = None, {}
+        if to_solve:
+            # One matrix for the largest selection, shared by every run
+            distances = await batch_distance_calculation(
+                db,
+                [(DEPOT_ID, DEPOT_COORDS)] + [(b['id'], (b['latitude'], b['longitude'])) for b in selected],
+                sweep.distance_mode,
+                sweep.neighbors
+            )
+            variants = []
+            for db_simulation, bins_data in to_solve:
+                by_index, demands = collection_demands(bins_data, distances, sweep.seed)
+                variants.append((demands, list(by_index), db_simulation.max_trucks, db_simulation.max_capacity))
+            started = time.time()
+            solved = await asyncio.to_thread(
+                solve_batch, distances, variants, distances.index[DEPOT_ID], sweep.time_limit, sweep.seed,
+                sweep.algorithm
+            )
+            print(f"Sweep {db_sweep.id}: {len(variants)} runs solved in {time.time() - started:.2f}s")
+            results = dict(zip((db_simulation.id for db_simulation, _ in to_solve), solved))
+        
+        def persist():
+            for db_simulation, bins_data, key, cached in runs:
+                db.refresh(db_simulation)
+                if db_simulation.status != "running":
+                    # Cancelled meanwhile
+                    continue
+                if cached is not None:
+                    complete_from_cache(db, db_simulation, cached)
+                    continue
+                routes, unserved, stats = results.get(db_simulation.id, ([], [], None))
+                by_index = {distances.index[b['id']]: b for b in bins_data} if bins_data else {}
+                db_simulation.total_distance, db_simulation.total_time = save_routes(
+                    db, db_simulation.id, [[by_index[i] for i in route] for route in routes], distances
+                )
+                db_simulation.unserved_bins = len(unserved)
+                db_simulation.improvement = stats.get('improvement') if stats else None
+                db_simulation.status = "completed"
+            db.commit()
+            
+            for db_simulation, bins_data, key, cached in runs:
+                if cached is None and db_simulation.status == "completed":
+                    cache_result(db, key, db_simulation, bins_data)
+            return sweep_response(db, db_sweep)
+        
+        return await db_thread(persist)
+    
+    except Exception as e:
+        print(f"Error running sweep {db_sweep.id}: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        
+        def fail():
+            db.rollback()
+            db.query(Simulation).filter(Simulation.sweep_id == db_sweep.id, Simulation.status == "running").update(
+                {'status': "failed", 'error': str(e)}
+            )
+            db.commit()
+        
+        await db_thread(fail)
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@router.get("/simulations/sweep/{sweep_id}", response_model=SweepResponse)
+def get_sweep(sweep_id: int, db: Session = Depends(get_db)):
+    sweep = db.query(Sweep).filter(Sweep.id == sweep_id).first()
+    if not sweep:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    return sweep_response(db, sweep)
+
+async def run_simulation(simulation_id):
+    """Job body: select bins, compute distances, solve and persist the routes
+    
+    Moves the simulation from pending to running, then completed or failed. A
+    simulation cancelled meanwhile is left as is and its results are dropped.
+    Progress goes to the queue's subscribers: "phase" events (distances,
+    construction, improvement, persistence) with a percentage, "incumbent"
+    events with the best routes so far and a final "status" event.
+    """
+    def report_phase(phase, percent):
+        simulation_queue.publish(simulation_id, "phase", {'phase': phase, 'percent': percent})
+    
+    db = SessionLocal()
+    try:
+        def start():
+            db_simulation = db.query(Simulation).filter(Simulation.id == simulation_id).first()
+            if db_simulation is None or db_simulation.status != "pending":
+                return None
+            db_simulation.status = "running"
+            db.commit()
+            db.refresh(db_simulation)
+            return db_simulation
+        
+        db_simulation = await db_thread(start)
+        if db_simulation is None:
+            return
+        options = json.loads(db_simulation.parameters or "{}")
+        time_limit = options.get('time_limit', 5.0)
+        report_phase("distances", 0)
+        
+        # Select the bins to collect, fullest first (0 = all bins)
+        bins_data = await db_thread(select_bins, db_simulation.bins_to_collect)
+        key = simulation_key(bins_data, db_simulation)
+        cached = result_cache.get(key) if options.get('use_cache', True) else None
+        if cached is not None:
+            # An identical simulation completed while this one was queued
+            def complete():
+                complete_from_cache(db, db_simulation, cached)
+                db.commit()
+                return simulation_response(db_simulation)
+            
+            response = await db_thread(complete)
+            simulation_queue.publish(simulation_id, "status", response.model_dump(mode="json"))
+            print(f"Simulation {simulation_id} served from the result cache")
+            return
+        
+        # Distances from the cache, missing pairs from the OSRM table service
+        distances = await batch_distance_calculation(
+            db,
+            [(DEPOT_ID, DEPOT_COORDS)] + [(b['id'], (b['latitude'], b['longitude'])) for b in bins_data],
+            options.get('distance_mode'),
+            options.get('neighbors', SPARSE_NEIGHBORS)
+        )
+        report_phase("construction", 10)
+        
+        solve_started = time.time()
+        def on_improve(cost, routes):
+            # Called from the solver thread; the solve spans 10-90% of the time budget
+            percent = 10 + 80 * min((time.time() - solve_started) / time_limit, 1.0) if time_limit else None
+            report_phase("improvement", percent)
+            simulation_queue.publish(simulation_id, "incumbent", {'cost': cost, 'routes': routes})
+        
+        # CPU-bound: keep the event loop serving requests meanwhile
+        optimized_routes, unserved, stats = await asyncio.to_thread(
+            optimize_routes, bins_data, db_simulation.max_trucks, db_simulation.max_capacity, distances,
+            time_limit, options.get('parallel_starts', 1), options.get('seed'),
+            options.get('algorithm', "local_search"), options.get('decomposition'), on_improve
+        )
+        if unserved:
+            print(f"{len(unserved)} bins could not be served")
+        
+        def persist():
+            db.refresh(db_simulation)
+            if db_simulation.status != "running":
+                return None
+            report_phase("persistence", 90)
+            db_simulation.total_distance, db_simulation.total_time = save_routes(
+                db, db_simulation.id, optimized_routes, distances
+            )
+            db_simulation.unserved_bins = len(unserved)
+            db_simulation.improvement = stats.get('improvement') if stats else None
+            db_simulation.status = "completed"
+            db.commit()
+            cache_result(db, key, db_simulation, bins_data)
+            return simulation_response(db_simulation)
+        
+        response = await db_thread(persist)
+        if response is None:
+            print(f"Simulation {simulation_id} was {db_simulation.status}, dropping its results")
+            return
+        simulation_queue.publish(simulation_id, "status", response.model_dump(mode="json"))
+        print(f"Simulation {simulation_id} completed")
+    
+    except asyncio.CancelledError:
+        # Cancelled by the user (already marked) or by shutdown (recovered on restart)
+        await db_thread(db.rollback)
+        raise
+    except Exception as e:
+        print(f"Error running simulation {simulation_id}: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        
+        def fail():
+            db.rollback()
+            db_simulation = db.query(Simulation).filter(Simulation.id == simulation_id).first()
+            if db_simulation is None or db_simulation.status != "running":
+                return None
+            db_simulation.status = "failed"
+            db_simulation.error = str(e)
+            db.commit()
+            return simulation_response(db_simulation)
+        
+        response = await db_thread(fail)
+        if response is not None:
+            simulation_queue.publish(simulation_id, "status", response.model_dump(mode="json"))
+    finally:
+        await db_thread(db.close)
+
+@router.get("/simulations/{simulation_id}", response_model=SimulationResponse)
+def get_simulation(simulation_id: int, db: Session = Depends(get_db)):
+    simulation = db.query(Simulation).filter(Simulation.id == simulation_id).first()
+    if not simulation:
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    return simulation_response(simulation)
+
+@router.post("/simulations/{simulation_id}/cancel", response_model=SimulationResponse)
+def cancel_simulation(simulation_id: int, db: Session = Depends(get_db)):
+    """Cancel a pending or running simulation"""
+    simulation = db.query(Simulation).filter(Simulation.id == simulation_id).first()
+    if not simulation:
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    if simulation.status not in ACTIVE_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Simulation is already {simulation.status}")
+    simulation.status = "cancelled"
+    db.commit()
+    simulation_queue.cancel(simulation_id)
+    response = simulation_response(simulation)
+    simulation_queue.publish(simulation_id, "status", response.model_dump(mode="json"))
+    return response
+
+@router.get("/simulations/{simulation_id}/events")
+async def simulation_events(simulation_id: int, db: Session = Depends(get_db)):
+    """Server-sent events of a simulation's progress, until its final "status" event
+    
+    "phase" events carry the phase and percent complete, "incumbent" events the
+    cost and routes (bin ids per truck) of the best solution so far. A finished
+    simulation only sends its status.
+    """
+    # Subscribe before reading the status so the final event cannot be missed
+    events = simulation_queue.subscribe(simulation_id)
+    simulation = await db_thread(db.query(Simulation).filter(Simulation.id == simulation_id).first)
+    if not simulation:
+        simulation_queue.unsubscribe(simulation_id, events)
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    if simulation.status not in ACTIVE_STATUSES:
+        events.put_nowait(("status", simulation_response(simulation).model_dump(mode="json")))
+    await db_thread(db.close)
+    
+    async def stream():
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event == "status":
+                    break
+        finally:
+            simulation_queue.unsubscribe(simulation_id, events)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={'Cache-Control': "no-cache"})
+
+@router.post("/simulations/{simulation_id}/reoptimize", response_model=SimulationResponse)
+async def reoptimize_simulation(simulation_id: int, delta: SimulationDelta, db: Session = Depends(get_db)):
+    """Patch a completed simulation's rounds with a delta of bins and save them as a new version
+    
+    Bins that were deleted or are no longer present are always removed. For
+    simulations over all bins (bins_to_collect=0), present bins missing from
+    the rounds are always added.
+    """
+    try:
+        def load():
+            parent = db.query(Simulation).filter(Simulation.id == simulation_id).first()
+            if not parent:
+                raise HTTPException(status_code=404, detail="Simulation not found")
+            if parent.status != "completed":
+                raise HTTPException(status_code=409, detail="Only completed simulations can be re-optimized")
+            
+            stops = [(int(truck_id), int(bin_id)) for truck_id, _, bin_id, _, _ in read_routes(db, simulation_id).tolist()]
+            wanted_ids = {bin_id for _, bin_id in stops} | set(delta.added) | set(delta.changed)
+            query = db.query(Bin)
+            if parent.bins_to_collect == 0:
+                query = query.filter((Bin.id.in_(wanted_ids)) | (Bin.presence == 1))
+            else:
+                query = query.filter(Bin.id.in_(wanted_ids))
+            return parent, stops, {b.id: b for b in query.all()}
+        
+        parent, stops, bins = await db_thread(load)
+        routed_ids = {bin_id for _, bin_id in stops}
+        present = {bin_id for bin_id, b in bins.items() if b.presence == 1}
+        removed = (routed_ids - present) | set(delta.removed)
+        added = (set(delta.added) & present) - routed_ids
+        if parent.bins_to_collect == 0:
+            added |= present - routed_ids
+        added -= removed
+        changed = (set(delta.changed) & routed_ids & present) - removed
+        
+        bins_data = [
+            {
+                'id': b.id,
+                'weight': b.weight,
+                'longitude': b.longitude,
+                'latitude': b.latitude
+            } for bin_id, b in sorted(bins.items()) if bin_id in present and bin_id not in removed
+            and (bin_id in routed_ids or bin_id in added)
+        ]
+        # Routed bins left out of the selection have no place in the matrix: dropped from their trucks here
+        selected = {b['id'] for b in bins_data}
+        removed = routed_ids - selected
+        print(f"Re-optimizing simulation {simulation_id}: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+        
+        distances = await batch_distance_calculation(
+            db, [(DEPOT_ID, DEPOT_COORDS)] + [(b['id'], (b['latitude'], b['longitude'])) for b in bins_data]
+        )
+        by_index, demands = collection_demands(bins_data, distances, delta.seed)
+        
+        trucks = {}
+        for truck_id, bin_id in stops:
+            if bin_id in selected:
+                trucks.setdefault(truck_id, []).append(distances.index[bin_id])
+        routes, unserved, stats = await asyncio.to_thread(
+            patch_routes, distances, list(trucks.values()), demands, parent.max_trucks, parent.max_capacity,
+            depot=distances.index[DEPOT_ID],
+            inserted=[distances.index[bin_id] for bin_id in added | changed],
+            time_limit=delta.time_limit
+        )
+        print(f"Patched in {stats['elapsed'] * 1000:.1f} ms, {len(unserved)} bins unserved")
+        
+        # Unserved bins of a limited selection were never stored, they stay unserved
+        carried = (parent.unserved_bins or 0) if parent.bins_to_collect != 0 else 0
+        db_simulation = Simulation(
+            name=delta.name or parent.name,
+            max_trucks=parent.max_trucks,
+            max_capacity=parent.max_capacity,
+            bins_to_collect=parent.bins_to_collect,
+            unserved_bins=len(unserved) + carried,
+            improvement=stats.get('improvement'),
+            parameters=parent.parameters,
+            parent_id=parent.id,
+            version=(parent.version or 1) + 1,
+            status="completed"
+        )
+        
+        def persist():
+            db.add(db_simulation)
+            db.flush()
+            db_simulation.total_distance, db_simulation.total_time = save_routes(
+                db, db_simulation.id, [[by_index[i] for i in route] for route in routes], distances
+            )
+            db.commit()
+            db.refresh(db_simulation)
+            return simulation_response(db_simulation)
+        
+        return await db_thread(persist)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error re-optimizing simulation: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@router.get("/simulations/{simulation_id}/uncertainty", response_model=UncertaintyResponse)
+def simulation_uncertainty(simulation_id: int, scenarios: int = 1000, seed: Optional[int] = None,
+                           weight_noise: float = 0.0, db: Session = Depends(get_db)):
+    """Monte-Carlo risk of the simulation's trucks overflowing under uncertain bin weights
+    
+    Bins with a zero weight are drawn like the simulations draw them; with
+    weight_noise > 0 the known weights vary too (relative standard deviation).
+    The routes are kept as they are: every scenario only sums its sampled
+    weights per truck, all scenarios at once as NumPy arrays.
+    """
+    if not 1 <= scenarios <= MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"scenarios must be between 1 and {MAX_SCENARIOS}")
+    if weight_noise < 0:
+        raise HTTPException(status_code=400, detail="weight_noise must not be negative")
+    simulation = db.query(Simulation).filter(Simulation.id == simulation_id).first()
+    if not simulation:
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    if simulation.status != "completed":
+        raise HTTPException(status_code=409, detail="Only completed simulations can be evaluated")
+    
+    stops = read_routes(db, simulation_id)
+    snapshot = bin_store.snapshot()
+    # Stops of deleted bins are left out, as the routes endpoint does
+    bin_rows = snapshot.rows_of(stops[:, 2].astype(np.int64))
+    stops, bin_rows = stops[bin_rows >= 0], bin_rows[bin_rows >= 0]
+    truck_ids, numbers = np.unique(stops[:, 0].astype(np.int64), return_inverse=True)
+    truck_ids = truck_ids.tolist()
+    weights = np.nan_to_num(snapshot.weights[bin_rows])
+    unknown = weights == 0
+    
+    loads = route_loads(weights, unknown, numbers, scenarios, seed, weight_noise)
+    risk = overflow_risk(loads, simulation.max_capacity)
+    bins_per_truck = np.bincount(numbers, minlength=len(truck_ids))
+    return UncertaintyResponse(
+        simulation_id=simulation_id,
+        scenarios=scenarios,
+        max_capacity=simulation.max_capacity,
+        unknown_weights=int(unknown.sum()),
+        overflow_probability=risk['any_overflow_probability'],
+        expected_extra_trips=risk['total_expected_extra_trips'],
+        trucks=[
+            TruckRisk(
+                truck_id=truck_id,
+                bins=int(bins_per_truck[number]),
+                expected_load=float(risk['expected_load'][number]),
+                load_p95=float(risk['load_p95'][number]),
+                overflow_probability=float(risk['overflow_probability'][number]),
+                expected_extra_trips=float(risk['expected_extra_trips'][number])
+            ) for number, truck_id in enumerate(truck_ids)
+        ]
+    )
+
 @router.get("/simulations/{simulation_id}/routes", response_model=List[RouteResponse])
 def get_simulation_routes(simulation_id: int, db: Session = Depends(get_db)):
-    routes = db.query(Route).join(Bin).filter(Route.simulation_id == simulation_id).order_by(Route.truck_id, Route.bin_order).all()
+    """Stops of every truck in order, with their bin's position and weight
+    
+    Reads per-stop rows and packed per-truck rows alike. Stops of bins deleted
+    since are left out.
+    """
+    stops = read_routes(db, simulation_id)
+    snapshot = bin_store.snapshot()
+    bin_rows = snapshot.rows_of(stops[:, 2].astype(np.int64))
+    stops, bin_rows = stops[bin_rows >= 0], bin_rows[bin_rows >= 0]
+    legs = np.where(np.isnan(stops[:, 3:]), None, stops[:, 3:]).tolist()
     
     return [
         RouteResponse(
-            truck_id=route.truck_id,
-            bin_order=route.bin_order,
-            bin_id=route.bin_id,
-            longitude=route.bin.longitude,
-            latitude=route.bin.latitude,
-            weight=route.bin.weight,
-            distance_to_next=route.distance_to_next,
-            time_to_next=route.time_to_next
-        ) for route in routes
+            truck_id=truck_id,
+            bin_order=bin_order,
+            bin_id=bin_id,
+            longitude=longitude,
+            latitude=latitude,
+            weight=weight,
+            distance_to_next=distance_to_next,
+            time_to_next=time_to_next
+        ) for truck_id, bin_order, bin_id, longitude, latitude, weight, (distance_to_next, time_to_next) in zip(
+            stops[:, 0].astype(np.int64).tolist(), stops[:, 1].astype(np.int64).tolist(),
+            stops[:, 2].astype(np.int64).tolist(), snapshot.longitudes[bin_rows].tolist(),
+            snapshot.latitudes[bin_rows].tolist(), snapshot.values('weight', bin_rows), legs
+        )
     ]
 
 @router.get("/simulations/", response_model=List[SimulationResponse])
 def get_simulations(db: Session = Depends(get_db)):
     simulations = db.query(Simulation).order_by(Simulation.created_at.desc()).all()
     
-    return [
-        SimulationResponse(
-            id=sim.id,
-            name=sim.name,
-            max_trucks=sim.max_trucks,
-            max_capacity=sim.max_capacity,
-            bins_to_collect=sim.bins_to_collect,
-            total_distance=sim.total_distance,
-            total_time=sim.total_time,
-            status=sim.status,
-            created_at=sim.created_at
-        ) for sim in simulations
-    ]
+    return [simulation_response(sim) for sim in simulations]
 
 @router.delete("/simulations/{simulation_id}")
 def delete_simulation(simulation_id: int, db: Session = Depends(get_db)):
+    simulation_queue.cancel(simulation_id)
+    simulation_queue.publish(simulation_id, "status", {'id': simulation_id, 'status': "deleted"})
     # Delete routes first
-    db.query(Route).filter(Route.simulation_id == simulation_id).delete()
+    delete_routes(db, simulation_id)
     # Delete simulation
     simulation = db.query(Simulation).filter(Simulation.id == simulation_id).first()
     if simulation:
@@ -262,32 +912,30 @@ def delete_simulation(simulation_id: int, db: Session = Depends(get_db)):
     raise HTTPException(status_code=404, detail="Simulation not found")
 
 @router.get("/debug/test-simulation")
-async def debug_test_simulation(db: Session = Depends(get_db)):
+def debug_test_simulation():
     """Debug endpoint to test simulation logic step by step"""
     try:
         # Step 1: Get bins
-        bins = db.query(Bin).filter(Bin.presence == 1).limit(3).all()
-        print(f"Found {len(bins)} bins")
+        snapshot = bin_store.snapshot()
+        bins_data = snapshot.records(np.flatnonzero(snapshot.presence == 1)[:3], ('id', 'weight', 'longitude', 'latitude'))
+        print(f"Found {len(bins_data)} bins")
         
-        bins_data = [
-            {
-                'id': bin.id,
-                'weight': bin.weight,
-                'longitude': bin.longitude,
-                'latitude': bin.latitude
-            } for bin in bins
-        ]
         print(f"Bins data: {bins_data}")
         
         # Step 2: Test distance calculation
         if len(bins_data) >= 2:
             coord1 = (bins_data[0]['latitude'], bins_data[0]['longitude'])
             coord2 = (bins_data[1]['latitude'], bins_data[1]['longitude'])
-            distance = calculate_euclidean_distance(coord1, coord2)
+            distance = haversine_distance(coord1, coord2)
             print(f"Test distance: {distance}")
         
         # Step 3: Test route optimization
-        optimized_routes = optimize_routes(bins_data, 1, 500, {})
+        matrix = build_distance_matrix(
+            [DEPOT_ID] + [b['id'] for b in bins_data],
+            [DEPOT_COORDS[0]] + [b['latitude'] for b in bins_data],
+            [DEPOT_COORDS[1]] + [b['longitude'] for b in bins_data]
+        )
+        optimized_routes, unserved, _ = optimize_routes(bins_data, 1, 500, matrix)
         print(f"Optimized routes: {optimized_routes}")
         
         return {
@@ -299,4 +947,24 @@ async def debug_test_simulation(db: Session = Depends(get_db)):
     except Exception as e:
         print(f"Debug error: {str(e)}")
         print(f"Traceback: {traceback.format_exc()}")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+@router.get("/debug/jobs")
+def debug_jobs():
+    """Simulation queue: workers, queued jobs and the simulations running"""
+    return simulation_queue.stats()
+
+@router.get("/debug/result-cache")
+def debug_result_cache():
+    """Result cache entries, size and hit counts"""
+    return result_cache.stats()
+
+@router.delete("/debug/result-cache")
+def clear_result_cache():
+    result_cache.clear()
+    return {"success": True}
+
+@router.get("/debug/routing-stats")
+def debug_routing_stats():
+    """Routing client counters: requests, in-flight, retries, failures and fallbacks"""
+    return routing_client.stats()
@@ -0,0 +1,255 @@
+import glob
+import hashlib
+import os
+import threading
+import numpy as np
+from sqlalchemy import select
+from .database import SessionLocal, engine
+from .models import Bin
+from .distances import (
+    BLOCK_SIZE, DEPOT_ID, DEPOT_COORDS, SPARSE_THRESHOLD, DistanceMatrix, estimate_duration, haversine_block
+)
+from .distance_cache import iter_pairs, missing_cover
+from .osrm import routing_client, table_matrix
+
+# Snapshots live next to the SQLite file (database/trashway.db) unless overridden
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.dirname(os.path.abspath(engine.url.database or ".")))
+SNAPSHOT_REBUILD_DELAY = float(os.getenv("SNAPSHOT_REBUILD_DELAY", "5"))
+
+# File layout: magic | n (uint64) | sha256 fingerprint (32 bytes) | ids (n x int64)
+# | padding to 64 bytes | distances (n x n float32) | durations (n x n float32)
+MAGIC = b"TWDMAT01"
+HEADER_SIZE = len(MAGIC) + 8 + 32
+ALIGNMENT = 64
+
+
+def bin_set_fingerprint(ids, latitudes, longitudes):
+    """SHA-256 over the ordered bin ids and their coordinates"""
+    digest = hashlib.sha256()
+    digest.update(np.asarray(ids, dtype=np.int64).tobytes())
+    digest.update(np.asarray(latitudes, dtype=np.float64).tobytes())
+    digest.update(np.asarray(longitudes, dtype=np.float64).tobytes())
+    return digest.digest()
+
+
+def current_bin_set(db):
+    """Ids and coordinates of the depot followed by every bin, ordered by id"""
+    rows = db.execute(select(Bin.id, Bin.latitude, Bin.longitude).order_by(Bin.id)).all()
+    rows = [(DEPOT_ID, *DEPOT_COORDS)] + rows
+    return [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows]
+
+
+def _data_offset(n):
+    end = HEADER_SIZE + 8 * n
+    return (end + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def create_snapshot(path, ids, fingerprint):
+    """Allocate a snapshot file and map its matrices for writing
+
+    Returns (distances, durations) as writable numpy.memmap, so a matrix is
+    filled in place instead of being built in memory first.
+    """
+    n = len(ids)
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(n).tobytes())
+        f.write(fingerprint)
+        f.write(np.asarray(ids, dtype=np.int64).tobytes())
+        f.truncate(_data_offset(n) + 8 * n * n)
+    offset = _data_offset(n)
+    distances = np.memmap(path, dtype=np.float32, mode="r+", offset=offset, shape=(n, n))
+    durations = np.memmap(path, dtype=np.float32, mode="r+", offset=offset + 4 * n * n, shape=(n, n))
+    return distances, durations
+
+
+def open_snapshot(path):
+    """Open a snapshot as a read-only DistanceMatrix backed by numpy.memmap
+
+    Returns (fingerprint, matrix). Pages are shared between processes through
+    the OS page cache.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a distance snapshot: {path}")
+        n = int(np.frombuffer(header, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        fingerprint = header[len(MAGIC) + 8:]
+        ids = np.frombuffer(f.read(8 * n), dtype=np.int64)
+
+    offset = _data_offset(n)
+    distances = np.memmap(path, dtype=np.float32, mode="r", offset=offset, shape=(n, n))
+    durations = np.memmap(path, dtype=np.float32, mode="r", offset=offset + 4 * n * n, shape=(n, n))
+    return fingerprint, DistanceMatrix(ids.tolist(), distances, durations)
+
+
+class SnapshotStore:
+    """Snapshots of the full bin set keyed by fingerprint, rebuilt in the background"""
+
+    def __init__(self, directory=SNAPSHOT_DIR, rebuild_delay=SNAPSHOT_REBUILD_DELAY):
+        self.directory = directory
+        self.rebuild_delay = rebuild_delay
+        self._lock = threading.Lock()
+        self._opened = {}
+        self._timer = None
+        self._building = False
+
+    def path_for(self, fingerprint):
+        return os.path.join(self.directory, f"distances-{fingerprint.hex()[:16]}.bin")
+
+    def lookup(self, fingerprint):
+        """Memory-mapped matrix for a fingerprint, or None if no snapshot exists"""
+        with self._lock:
+            if fingerprint in self._opened:
+                return self._opened[fingerprint]
+        path = self.path_for(fingerprint)
+        if not os.path.exists(path):
+            return None
+        try:
+            stored_fingerprint, matrix = open_snapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"Snapshot error: {e}")
+            return None
+        if stored_fingerprint != fingerprint:
+            return None
+        with self._lock:
+            # Only the current bin set is worth keeping mapped
+            self._opened = {fingerprint: matrix}
+        return matrix
+
+    def matrix_for(self, db, ids):
+        """Matrix restricted to ids from the current snapshot, or None if it is stale or missing"""
+        matrix = self.lookup(bin_set_fingerprint(*current_bin_set(db)))
+        if matrix is None or not all(bin_id in matrix for bin_id in ids):
+            return None
+        if list(ids) == matrix.ids:
+            # Whole bin set: zero-copy view of the mapped pages
+            return matrix
+        rows = np.array([matrix.index[bin_id] for bin_id in ids], dtype=np.intp)
+        return DistanceMatrix(ids, matrix.distances[np.ix_(rows, rows)], matrix.durations[np.ix_(rows, rows)])
+
+    def request_rebuild(self):
+        """Schedule a background rebuild, debounced so bursts of bin writes build once"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.rebuild_delay, self._rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _rebuild(self):
+        with self._lock:
+            self._timer = None
+            if self._building:
+                # A build is already running, try again once it is done
+                self._timer = threading.Timer(self.rebuild_delay, self._rebuild)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+            self._building = True
+        try:
+            self.build()
+        except Exception as e:
+            print(f"Snapshot build error: {e}")
+        finally:
+            with self._lock:
+                self._building = False
+
+    def build(self):
+        """Compute and write the snapshot for the current bin set if it does not exist yet
+
+        Bin sets above SPARSE_THRESHOLD are skipped: their simulations use the
+        sparse graph, and a dense matrix of them would not fit in memory. The
+        matrices are filled in place in the mapped file: haversine estimates,
+        then the pairs of the distances table read in chunks, then the missing
+        pairs from OSRM. Routed pairs only go to the snapshot. Returns the
+        snapshot path, or None when none was written.
+        """
+        db = SessionLocal()
+        try:
+            ids, latitudes, longitudes = current_bin_set(db)
+            fingerprint = bin_set_fingerprint(ids, latitudes, longitudes)
+            path = self.path_for(fingerprint)
+            if os.path.exists(path):
+                return path
+            if len(ids) < 2 or len(ids) - 1 > SPARSE_THRESHOLD:
+                return None
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            distances, durations = create_snapshot(tmp_path, ids, fingerprint)
+            complete = False
+            try:
+                complete = self._fill(db, ids, latitudes, longitudes, distances, durations)
+                distances.flush()
+                durations.flush()
+            finally:
+                del distances, durations
+                if not complete:
+                    os.remove(tmp_path)
+            if not complete:
+                # Failed requests would leave estimates in the snapshot for good: retry on the next rebuild
+                print(f"Snapshot not written: routing failed for some of the {len(ids)} bins")
+                return None
+            os.replace(tmp_path, path)
+            print(f"Snapshot written: {path} ({len(ids)} bins)")
+        finally:
+            db.close()
+
+        # Older snapshots belong to previous bin sets
+        for old_path in glob.glob(os.path.join(self.directory, "distances-*.bin")):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        return path
+
+    def _fill(self, db, ids, latitudes, longitudes, distances, durations):
+        """Fill mapped matrices of the bin set; False if some missing pairs could not be routed"""
+        n = len(ids)
+        for i in range(0, n, BLOCK_SIZE):
+            for j in range(0, n, BLOCK_SIZE):
+                block = haversine_block(latitudes[i:i + BLOCK_SIZE], longitudes[i:i + BLOCK_SIZE],
+                                        latitudes[j:j + BLOCK_SIZE], longitudes[j:j + BLOCK_SIZE])
+                distances[i:i + BLOCK_SIZE, j:j + BLOCK_SIZE] = block
+                durations[i:i + BLOCK_SIZE, j:j + BLOCK_SIZE] = estimate_duration(block)
+
+        known = np.eye(n, dtype=bool)
+        for i, j, cached_distances, cached_durations in iter_pairs(db, ids):
+            distances[i, j] = cached_distances
+            durations[i, j] = cached_durations
+            known[i, j] = True
+
+        cover = missing_cover(~known)
+        if cover:
+            print(f"Snapshot: {int((~known).sum())} missing pairs, routing {len(cover)} bins")
+            # Mostly cold: rows of every bin cover every pair, otherwise rows then columns of the cover
+            passes = [(list(range(n)), True)] if 2 * len(cover) >= n else [(cover, True), (cover, False)]
+
+            async def route(client):
+                points = list(zip(latitudes, longitudes))
+                for indexes, as_rows in passes:
+                    for start in range(0, len(indexes), BLOCK_SIZE):
+                        block = np.asarray(indexes[start:start + BLOCK_SIZE], dtype=np.intp)
+                        block_points = [points[k] for k in block.tolist()]
+                        if as_rows:
+                            cells = (block, slice(None))
+                            routed = await table_matrix(client, block_points, points)
+                        else:
+                            cells = (slice(None), block)
+                            routed = await table_matrix(client, points, block_points)
+                        block_distances, block_durations, answered = routed
+                        write = answered & ~known[cells]
+                        distances[cells] = np.where(write, block_distances, distances[cells])
+                        durations[cells] = np.where(write, block_durations, durations[cells])
+                        known[cells] |= answered
+
+            # On the app's loop, so a rebuild shares the concurrency and rate limits of the simulations
+            routing_client.run_threadsafe(route(routing_client))
+
+        np.fill_diagonal(distances, 0)
+        np.fill_diagonal(durations, 0)
+        return bool(known.all())
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,452 @@
+import math
+import random
+import time
+import numpy as np
+from .local_search import REPORT_INTERVAL
+
+# Insertion positions are only searched next to a bin's nearest neighbours
+ALNS_NEIGHBORS = 15
+# Iterations run without a deadline
+ALNS_ITERATIONS = 5000
+# Operator weights are updated every SEGMENT iterations with these scores
+SEGMENT = 100
+REACTION = 0.1
+SCORE_BEST = 33
+SCORE_BETTER = 9
+SCORE_ACCEPTED = 13
+# Start temperature accepts half of the time a repair 5% worse than the distance
+# share of the bins removed, then cools to FINAL_TEMPERATURE of it as the budget
+# runs out
+START_WORSENING = 0.2
+FINAL_TEMPERATURE = 0.002
+# Worst and Shaw removal pick ranked candidates as rank = len * random() ** power
+RANDOMNESS = 3
+
+
+class Problem:
+    """Read-only data shared by every solution of one ALNS run"""
+
+    def __init__(self, distances, demands, max_trucks, max_capacity, depot, neighbors, customers):
+        self.distances = distances
+        self.dist = distances.distance_at
+        self.demands = [float(d) for d in demands]
+        self.max_trucks = max_trucks
+        self.max_capacity = max_capacity
+        self.depot = depot
+        self.customers = customers
+        is_customer = np.zeros(len(distances), dtype=bool)
+        is_customer[customers] = True
+
+        # Neighbour lists with both leg lengths looked up once: near[c] = [(v, d(v, c), d(c, v))]
+        nearest = distances.nearest(neighbors)[customers]
+        rows = np.repeat(np.asarray(customers, dtype=np.intp), nearest.shape[1])
+        cols = nearest.ravel().astype(np.intp)
+        valid = is_customer[cols] & (cols != rows)
+        rows, cols = rows[valid], cols[valid]
+        self.near = {c: [] for c in customers}
+        for c, v, d_vc, d_cv in zip(rows.tolist(), cols.tolist(),
+                                    distances.distances_between(cols, rows).tolist(),
+                                    distances.distances_between(rows, cols).tolist()):
+            self.near[c].append((v, d_vc, d_cv))
+        self.neighbors = {c: [v for v, _, _ in near] for c, near in self.near.items()}
+        self.near_set = {c: set(neighbors) for c, neighbors in self.neighbors.items()}
+
+        depots = np.full(len(customers), depot, dtype=np.intp)
+        self.from_depot = dict(zip(customers, distances.distances_between(depots, customers).tolist()))
+        self.to_depot = dict(zip(customers, distances.distances_between(customers, depots).tolist()))
+        # An unserved bin costs more than any detour serving it
+        self.penalty = 2 * max(self.from_depot[c] + self.to_depot[c] for c in customers) + 1.0
+
+
+class Solution:
+    """Routes as plain index lists plus array-backed lookups
+
+    route_of, position and leg_in (length of the leg arriving at a bin) are lists
+    indexed by matrix index, -1 when unassigned; loads, costs and tail_legs (the
+    leg back to the depot) are per route. Copying is a handful of list copies.
+    """
+
+    __slots__ = ('problem', 'routes', 'route_of', 'position', 'leg_in', 'loads', 'costs', 'tail_legs', 'unassigned')
+
+    def __init__(self, problem, routes, unassigned, size):
+        self.problem = problem
+        self.routes = [list(route) for route in routes]
+        self.routes += [[] for _ in range(problem.max_trucks - len(self.routes))]
+        self.route_of = [-1] * size
+        self.position = [-1] * size
+        self.leg_in = [0.0] * size
+        self.loads = [0.0] * len(self.routes)
+        self.costs = [0.0] * len(self.routes)
+        self.tail_legs = [0.0] * len(self.routes)
+        self.unassigned = set(unassigned)
+        for r in range(len(self.routes)):
+            self.reindex(r)
+
+    def copy(self):
+        other = Solution.__new__(Solution)
+        other.problem = self.problem
+        other.routes = [route[:] for route in self.routes]
+        other.route_of = self.route_of[:]
+        other.position = self.position[:]
+        other.leg_in = self.leg_in[:]
+        other.loads = self.loads[:]
+        other.costs = self.costs[:]
+        other.tail_legs = self.tail_legs[:]
+        other.unassigned = set(self.unassigned)
+        return other
+
+    def reindex(self, r):
+        """Refresh positions, load and cost of route r after it changed"""
+        problem = self.problem
+        dist, demands, depot = problem.dist, problem.demands, problem.depot
+        route_of, position, leg_in = self.route_of, self.position, self.leg_in
+        load = 0.0
+        cost = 0.0
+        previous = depot
+        for p, c in enumerate(self.routes[r]):
+            route_of[c] = r
+            position[c] = p
+            load += demands[c]
+            leg = dist(previous, c)
+            leg_in[c] = leg
+            cost += leg
+            previous = c
+        self.loads[r] = load
+        self.tail_legs[r] = dist(previous, depot) if self.routes[r] else 0.0
+        self.costs[r] = cost + self.tail_legs[r]
+
+    def distance(self):
+        return sum(self.costs)
+
+    def objective(self):
+        return sum(self.costs) + self.problem.penalty * len(self.unassigned)
+
+    def remove(self, customers):
+        touched = set()
+        for c in sorted(customers, key=lambda c: -self.position[c]):
+            r = self.route_of[c]
+            del self.routes[r][self.position[c]]
+            self.route_of[c] = -1
+            self.position[c] = -1
+            self.unassigned.add(c)
+            touched.add(r)
+        for r in touched:
+            self.reindex(r)
+
+    def insert(self, c, r, p):
+        self.routes[r].insert(p, c)
+        self.unassigned.discard(c)
+        self.reindex(r)
+
+
+def _insertion_options(sol, c):
+    """Cheapest feasible insertion of c per route: {route: (delta, route, position)}
+
+    Only the positions just before and after c's nearest routed neighbours and
+    the first empty route are tried, each with a single distance lookup; every
+    position of every feasible route is scanned only when none of those fit.
+    """
+    problem = sol.problem
+    dist = problem.dist
+    demand = problem.demands[c]
+    capacity = problem.max_capacity
+    routes, loads, route_of, position, leg_in = sol.routes, sol.loads, sol.route_of, sol.position, sol.leg_in
+    best = {}
+
+    for v, d_vc, d_cv in problem.near[c]:
+        r = route_of[v]
+        if r < 0 or loads[r] + demand > capacity:
+            continue
+        route = routes[r]
+        p = position[v]
+        # After v
+        if p + 1 < len(route):
+            following = route[p + 1]
+            delta = d_vc + dist(c, following) - leg_in[following]
+        else:
+            delta = d_vc + problem.to_depot[c] - sol.tail_legs[r]
+        current = best.get(r)
+        if current is None or delta < current[0]:
+            best[r] = current = (delta, r, p + 1)
+        # Before v
+        previous_leg = dist(route[p - 1], c) if p > 0 else problem.from_depot[c]
+        delta = previous_leg + d_cv - leg_in[v]
+        if delta < current[0]:
+            best[r] = (delta, r, p)
+
+    if demand <= capacity:
+        for r, route in enumerate(routes):
+            if not route:
+                delta = problem.from_depot[c] + problem.to_depot[c]
+                if r not in best or delta < best[r][0]:
+                    best[r] = (delta, r, 0)
+                break
+
+    if not best:
+        depot = problem.depot
+        for r, route in enumerate(routes):
+            if not route or loads[r] + demand > capacity:
+                continue
+            stops = [depot] + route + [depot]
+            legs = [leg_in[v] for v in route] + [sol.tail_legs[r]]
+            deltas = (problem.distances.distances_between(stops[:-1], [c] * len(legs))
+                      + problem.distances.distances_between([c] * len(legs), stops[1:]) - legs)
+            p = int(deltas.argmin())
+            best[r] = (float(deltas[p]), r, p)
+    return best
+
+
+# Destroy operators: each removes about q bins from the solution
+
+def destroy_random(sol, q, rng):
+    served = [c for c in sol.problem.customers if sol.route_of[c] >= 0]
+    sol.remove(rng.sample(served, min(q, len(served))))
+
+
+def destroy_worst(sol, q, rng):
+    """Remove the bins whose detour costs the most, with some randomness"""
+    dist, depot, leg_in = sol.problem.dist, sol.problem.depot, sol.leg_in
+    gains = []
+    for r, route in enumerate(sol.routes):
+        previous = depot
+        for p, c in enumerate(route):
+            if p + 1 < len(route):
+                following = route[p + 1]
+                leg_out = leg_in[following]
+            else:
+                following, leg_out = depot, sol.tail_legs[r]
+            gains.append((leg_in[c] + leg_out - dist(previous, following), c))
+            previous = c
+    gains.sort(reverse=True)
+    removed = []
+    while gains and len(removed) < q:
+        removed.append(gains.pop(int(len(gains) * rng.random() ** RANDOMNESS))[1])
+    sol.remove(removed)
+
+
+def destroy_shaw(sol, q, rng):
+    """Remove a cluster of related (nearby) bins grown from a random seed bin"""
+    neighbors = sol.problem.neighbors
+    served = [c for c in sol.problem.customers if sol.route_of[c] >= 0]
+    if not served:
+        return
+    removed = [rng.choice(served)]
+    chosen = set(removed)
+    while len(removed) < q:
+        related = [v for v in neighbors[rng.choice(removed)] if v not in chosen and sol.route_of[v] >= 0]
+        if not related:
+            # The cluster is exhausted around this bin, jump to another one
+            remaining = [c for c in served if c not in chosen]
+            if not remaining:
+                break
+            related = [rng.choice(remaining)]
+        c = related[int(len(related) * rng.random() ** RANDOMNESS)]
+        removed.append(c)
+        chosen.add(c)
+    sol.remove(removed)
+
+
+def destroy_route(sol, q, rng):
+    """Empty one whole route, preferring short ones"""
+    candidates = [r for r, route in enumerate(sol.routes) if route]
+    if not candidates:
+        return
+    candidates.sort(key=lambda r: len(sol.routes[r]))
+    r = candidates[int(len(candidates) * rng.random() ** RANDOMNESS)]
+    sol.remove(list(sol.routes[r]))
+
+
+# Repair operators: each re-inserts unassigned bins where feasible
+
+def repair_greedy(sol, rng):
+    pending = list(sol.unassigned)
+    rng.shuffle(pending)
+    for c in pending:
+        options = _insertion_options(sol, c)
+        if options:
+            _, r, p = min(options.values())
+            sol.insert(c, r, p)
+
+
+def _regret_key(options, k, penalty):
+    costs = sorted(option[0] for option in options.values())
+    if not costs:
+        return None
+    costs += [penalty] * (k - len(costs))
+    return (sum(cost - costs[0] for cost in costs[1:k]), -costs[0])
+
+
+def _repair_regret(sol, rng, k):
+    """Insert first the bin that would lose the most by not getting its best route now
+
+    After each insertion only the options touching the changed route are
+    updated: shifted when the insertion happened before them, recomputed when
+    they split the same leg, no longer fit, or the new bin is a neighbour.
+    """
+    problem = sol.problem
+    demands, capacity, penalty = problem.demands, problem.max_capacity, problem.penalty
+    pending = list(sol.unassigned)
+    rng.shuffle(pending)
+    options = {c: _insertion_options(sol, c) for c in pending}
+    keys = {c: _regret_key(options[c], k, penalty) for c in pending}
+    while pending:
+        candidates = [c for c in pending if keys[c] is not None]
+        if not candidates:
+            break
+        c = max(candidates, key=keys.__getitem__)
+        _, r, p = min(options[c].values())
+        sol.insert(c, r, p)
+        pending.remove(c)
+        del options[c], keys[c]
+
+        for other in pending:
+            other_options = options[other]
+            if r not in other_options and c not in problem.near_set[other]:
+                continue
+            if c in problem.near_set[other] or sol.loads[r] + demands[other] > capacity:
+                other_options = options[other] = _insertion_options(sol, other)
+            else:
+                delta, _, position = other_options[r]
+                if position == p:
+                    other_options = options[other] = _insertion_options(sol, other)
+                elif position > p:
+                    other_options[r] = (delta, r, position + 1)
+                else:
+                    continue
+            keys[other] = _regret_key(other_options, k, penalty)
+
+
+def repair_regret2(sol, rng):
+    _repair_regret(sol, rng, 2)
+
+
+def repair_regret3(sol, rng):
+    _repair_regret(sol, rng, 3)
+
+
+DESTROY_OPERATORS = [destroy_random, destroy_worst, destroy_shaw, destroy_route]
+REPAIR_OPERATORS = [repair_greedy, repair_regret2, repair_regret3]
+
+
+def _pick(weights, rng):
+    threshold = rng.random() * sum(weights)
+    for i, weight in enumerate(weights):
+        threshold -= weight
+        if threshold <= 0:
+            return i
+    return len(weights) - 1
+
+
+def alns(distances, routes, unserved, demands, max_trucks, max_capacity, depot=0, deadline=None,
+         seed=None, neighbors=ALNS_NEIGHBORS, max_iterations=None, on_improve=None):
+    """Adaptive Large Neighbourhood Search from an initial solution
+
+    Each iteration removes q bins with a destroy operator (random, worst-cost,
+    Shaw/related, whole route) and re-inserts them with a repair operator
+    (greedy, regret-2, regret-3). Operators are drawn by roulette with weights
+    adapted every SEGMENT iterations from how useful they were, and candidates
+    are accepted by simulated annealing cooled over the time budget.
+
+    Anytime: the best feasible solution seen is kept and returned once deadline
+    (a time.time() value) passes, or after max_iterations (ALNS_ITERATIONS when
+    there is no deadline). Unserved bins cost a penalty above any detour, so
+    serving more bins always wins. on_improve(cost, routes) gets the new best
+    solutions, at most every REPORT_INTERVAL seconds. Returns
+    (routes, unserved, stats).
+    """
+    started = time.time()
+    rng = random.Random(seed)
+    if max_iterations is None and deadline is None:
+        max_iterations = ALNS_ITERATIONS
+
+    # Bins heavier than a truck can never be inserted
+    infeasible = [c for c in unserved if demands[c] > max_capacity]
+    pending = [c for c in unserved if demands[c] <= max_capacity]
+    customers = [c for route in routes for c in route] + pending
+    if not customers:
+        return [list(route) for route in routes], list(unserved), None
+
+    problem = Problem(distances, demands, max(max_trucks, len(routes)), max_capacity, depot, neighbors, customers)
+    current = Solution(problem, routes, pending, len(distances))
+    if pending:
+        repair_greedy(current, rng)
+    best = current.copy()
+    initial_cost = current.distance()
+    current_objective = best_objective = current.objective()
+
+    n = len(customers)
+    q_min = min(4, n)
+    q_max = max(q_min, min(40, n // 5))
+    start_temperature = START_WORSENING * current.distance() / n * (q_min + q_max) / 2 / math.log(2) or 1.0
+    destroy_weights = [1.0] * len(DESTROY_OPERATORS)
+    repair_weights = [1.0] * len(REPAIR_OPERATORS)
+    destroy_scores = [0.0] * len(DESTROY_OPERATORS)
+    repair_scores = [0.0] * len(REPAIR_OPERATORS)
+    destroy_uses = [0] * len(DESTROY_OPERATORS)
+    repair_uses = [0] * len(REPAIR_OPERATORS)
+
+    iterations = 0
+    reported, unreported = started, False
+    while True:
+        now = time.time()
+        if unreported and now - reported > REPORT_INTERVAL:
+            on_improve(best.distance(), [route for route in best.routes if route])
+            reported, unreported = now, False
+        if deadline is not None and now >= deadline:
+            break
+        if max_iterations is not None and iterations >= max_iterations:
+            break
+
+        if deadline is not None:
+            progress = (now - started) / max(deadline - started, 1e-9)
+        else:
+            progress = iterations / max_iterations
+        temperature = start_temperature * FINAL_TEMPERATURE ** progress
+
+        d = _pick(destroy_weights, rng)
+        r = _pick(repair_weights, rng)
+        candidate = current.copy()
+        DESTROY_OPERATORS[d](candidate, rng.randint(q_min, q_max), rng)
+        REPAIR_OPERATORS[r](candidate, rng)
+        candidate_objective = candidate.objective()
+
+        score = 0
+        delta = candidate_objective - current_objective
+        if delta < 0 or rng.random() < math.exp(-delta / temperature):
+            if candidate_objective < best_objective - 1e-6:
+                best, best_objective = candidate.copy(), candidate_objective
+                unreported = on_improve is not None
+                score = SCORE_BEST
+            elif delta < 0:
+                score = SCORE_BETTER
+            else:
+                score = SCORE_ACCEPTED
+            current, current_objective = candidate, candidate_objective
+
+        destroy_scores[d] += score
+        repair_scores[r] += score
+        destroy_uses[d] += 1
+        repair_uses[r] += 1
+        iterations += 1
+        if iterations % SEGMENT == 0:
+            for weights, scores, uses in ((destroy_weights, destroy_scores, destroy_uses),
+                                          (repair_weights, repair_scores, repair_uses)):
+                for i in range(len(weights)):
+                    if uses[i]:
+                        weights[i] = (1 - REACTION) * weights[i] + REACTION * scores[i] / uses[i]
+                    weights[i] = max(weights[i], 0.05)
+                    scores[i] = 0.0
+                    uses[i] = 0
+
+    elapsed = time.time() - started
+    final_cost = best.distance()
+    return [route for route in best.routes if route], sorted(best.unassigned) + infeasible, {
+        'initial_cost': initial_cost,
+        'final_cost': final_cost,
+        'improvement': initial_cost - final_cost,
+        'iterations': iterations,
+        'iterations_per_second': iterations / elapsed if elapsed > 0 else None,
+        'elapsed': elapsed,
+        'destroy_weights': dict(zip((op.__name__ for op in DESTROY_OPERATORS), destroy_weights)),
+        'repair_weights': dict(zip((op.__name__ for op in REPAIR_OPERATORS), repair_weights))
+    }
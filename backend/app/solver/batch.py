@@ -0,0 +1,46 @@
+import time
+import numpy as np
+from .parallel import SharedProblem, _attach, solve_once, solver_pool
+from .decompose import sub_matrix
+
+
+def _solve_variant(spec, demands, customers, max_trucks, max_capacity, depot, time_limit, seed, algorithm):
+    """Solve one variant on the shared matrix, restricted to its own bins"""
+    distances, _, _ = _attach(spec)
+    # The budget starts when the variant does, not when it was queued
+    deadline = time.time() + time_limit if time_limit is not None else None
+    indexes = [depot] + [c for c in customers if c != depot]
+    if len(indexes) == len(distances):
+        return solve_once(distances, demands, customers, max_trucks, max_capacity, depot, deadline, seed, algorithm)
+
+    # Neighbour lists of the full matrix would mostly point at bins of other variants
+    routes, unserved, stats = solve_once(
+        sub_matrix(distances, indexes), np.asarray(demands)[indexes], list(range(1, len(indexes))),
+        max_trucks, max_capacity, 0, deadline, seed, algorithm
+    )
+    return [[indexes[i] for i in route] for route in routes], [indexes[i] for i in unserved], stats
+
+
+def solve_batch(distances, variants, depot=0, time_limit=None, seed=None, algorithm="local_search"):
+    """Solve several problems over one distance matrix in the solver process pool
+
+    variants is a list of (demands, customers, max_trucks, max_capacity). The
+    matrix is copied to shared memory once and every worker maps it, so only
+    the small per-variant arrays are sent with each task. Each variant gets its
+    own time_limit from the moment a worker picks it up.
+
+    Returns a list of (routes, unserved, stats) in the order of variants.
+    """
+    if not variants:
+        return []
+    shared = SharedProblem(distances, np.zeros(len(distances)), [])
+    try:
+        pool = solver_pool()
+        futures = [
+            pool.submit(_solve_variant, shared.spec, np.asarray(demands, dtype=np.float64), list(customers),
+                        max_trucks, max_capacity, depot, time_limit, seed, algorithm)
+            for demands, customers, max_trucks, max_capacity in variants
+        ]
+        return [future.result() for future in futures]
+    finally:
+        shared.close()
@@ -0,0 +1,214 @@
+import math
+import time
+import numpy as np
+from ..distances import EARTH_RADIUS, DistanceMatrix
+from .parallel import SOLVER_WORKERS, route_cost, solver_pool, solve_once
+from .local_search import improve_routes
+from .alns import alns
+
+# Target number of bins per cluster: big enough for good routes, small enough
+# that each cluster solves in a fraction of the budget
+CLUSTER_SIZE = 250
+# Share of the time budget kept for the boundary repair
+REPAIR_SHARE = 0.2
+# Capacitated k-means lets clusters exceed their demand share by this much
+KMEANS_SLACK = 0.1
+KMEANS_ITERATIONS = 10
+DECOMPOSITIONS = ("sweep", "kmeans")
+
+
+def _project(latitudes, longitudes, origin_latitude):
+    scale = EARTH_RADIUS * np.pi / 180
+    return (np.asarray(longitudes, dtype=np.float64) * scale * np.cos(np.radians(origin_latitude)),
+            np.asarray(latitudes, dtype=np.float64) * scale)
+
+
+def sweep_clusters(latitudes, longitudes, demands, customers, depot, k):
+    """Split customers into k clusters of about equal demand by polar angle around the depot
+
+    The sweep starts in the widest angular gap so no natural group is cut in two.
+    Returns a list of index lists.
+    """
+    customers = np.asarray(customers, dtype=np.intp)
+    x, y = _project(latitudes, longitudes, latitudes[depot])
+    angles = np.arctan2(y[customers] - y[depot], x[customers] - x[depot])
+    order = np.argsort(angles, kind="stable")
+    sorted_angles = angles[order]
+    gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+    order = np.roll(order, -int((gaps.argmax() + 1) % len(order)))
+
+    swept = customers[order]
+    cumulative = np.cumsum(np.asarray(demands, dtype=np.float64)[swept])
+    share = cumulative[-1] / k if cumulative[-1] > 0 else 1.0
+    labels = np.minimum(((cumulative - 1e-9) // share).astype(np.intp), k - 1)
+    return [swept[labels == label].tolist() for label in range(k) if np.any(labels == label)]
+
+
+def kmeans_clusters(latitudes, longitudes, demands, customers, depot, k, iterations=KMEANS_ITERATIONS):
+    """Capacitated k-means over projected coordinates, seeded from the sweep
+
+    Each round assigns bins to their nearest centre that still has room (demand
+    share plus KMEANS_SLACK), the bins with the most to lose first, then moves
+    the centres to their cluster's centroid. Returns a list of index lists.
+    """
+    customers = np.asarray(customers, dtype=np.intp)
+    x, y = _project(latitudes, longitudes, latitudes[depot])
+    points = np.column_stack((x[customers], y[customers]))
+    weights = np.asarray(demands, dtype=np.float64)[customers]
+    limit = weights.sum() / k * (1 + KMEANS_SLACK) if weights.sum() > 0 else math.inf
+
+    position = {c: i for i, c in enumerate(customers.tolist())}
+    centers = np.array([points[[position[c] for c in cluster]].mean(axis=0)
+                        for cluster in sweep_clusters(latitudes, longitudes, demands, customers, depot, k)])
+    labels = None
+    for _ in range(iterations):
+        gaps = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        preference = np.argsort(gaps, axis=1)
+        ranked = np.take_along_axis(gaps, preference, axis=1)
+        regret = ranked[:, 1] - ranked[:, 0] if centers.shape[0] > 1 else np.zeros(len(points))
+
+        new_labels = np.empty(len(points), dtype=np.intp)
+        loads = np.zeros(len(centers))
+        for i in np.argsort(-regret, kind="stable").tolist():
+            for center in preference[i].tolist():
+                if loads[center] + weights[i] <= limit:
+                    break
+            else:
+                center = int(loads.argmin())
+            new_labels[i] = center
+            loads[center] += weights[i]
+
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for center in range(len(centers)):
+            members = labels == center
+            if members.any():
+                centers[center] = points[members].mean(axis=0)
+
+    return [customers[labels == center].tolist() for center in range(len(centers)) if np.any(labels == center)]
+
+
+def allocate_trucks(demands, clusters, max_trucks):
+    """Trucks per cluster in proportion to its demand, at least one each (largest remainder)"""
+    loads = np.array([float(np.sum(np.asarray(demands)[cluster])) for cluster in clusters])
+    total = loads.sum()
+    quotas = loads / total * max_trucks if total > 0 else np.full(len(clusters), max_trucks / len(clusters))
+    trucks = np.maximum(np.floor(quotas).astype(int), 1)
+    for i in np.argsort(-(quotas - np.floor(quotas)), kind="stable").tolist():
+        if trucks.sum() >= max_trucks:
+            break
+        trucks[i] += 1
+    while trucks.sum() > max_trucks:
+        # Too many clusters got their minimum truck: take back from the best-served that can spare one
+        i = int(np.argmax(np.where(trucks > 1, trucks - quotas, -np.inf)))
+        trucks[i] -= 1
+    return trucks.tolist()
+
+
+def sub_matrix(distances, indexes):
+    """Dense distances between indexes, as a DistanceMatrix over 0..len(indexes)-1"""
+    indexes = np.asarray(indexes, dtype=np.intp)
+    if isinstance(distances, DistanceMatrix):
+        block = np.asarray(distances.distances[np.ix_(indexes, indexes)], dtype=np.float32)
+    else:
+        rows = np.repeat(indexes, len(indexes))
+        cols = np.tile(indexes, len(indexes))
+        block = distances.distances_between(rows, cols).astype(np.float32).reshape(len(indexes), len(indexes))
+    # The solver only reads distances
+    return DistanceMatrix(range(len(indexes)), block, None)
+
+
+def _solve_cluster(matrix, demands, trucks, max_capacity, time_limit, seed, algorithm):
+    """Solve one cluster on its own matrix, depot at 0"""
+    deadline = time.time() + time_limit if time_limit is not None else None
+    return solve_once(matrix, demands, list(range(1, len(matrix))), trucks, max_capacity, 0, deadline, seed, algorithm)
+
+
+def solve_decomposed(distances, demands, customers, max_trucks, max_capacity, latitudes, longitudes, depot=0,
+                     method="sweep", time_limit=None, seed=None, algorithm="local_search",
+                     cluster_size=CLUSTER_SIZE, on_improve=None):
+    """Cluster-first, route-second solve for large bin sets
+
+    Bins are split into about len(customers) / cluster_size capacity-balanced
+    clusters (method "sweep" or "kmeans" over latitudes/longitudes by matrix
+    index), trucks are shared out by demand, and every cluster is solved on its
+    own small matrix in the solver process pool. A boundary repair then runs the
+    local search over the bins whose nearest neighbours lie in another cluster
+    and re-inserts unserved bins wherever they fit. Work per cluster is bounded,
+    so the total grows linearly with the number of bins. on_improve(cost, routes)
+    gets the merged cluster routes, then the boundary repair's progress.
+
+    Returns (routes, unserved, stats) like multi_start.
+    """
+    started = time.time()
+    customers = list(customers)
+    k = max(1, min(max_trucks, math.ceil(len(customers) / cluster_size)))
+    clusters = (kmeans_clusters if method == "kmeans" else sweep_clusters)(
+        latitudes, longitudes, demands, customers, depot, k
+    )
+    trucks = allocate_trucks(demands, clusters, max_trucks)
+
+    # Clusters queue up when there are more of them than workers: share the budget out
+    cluster_time = None
+    if time_limit is not None:
+        cluster_time = time_limit * (1 - REPAIR_SHARE) * min(1.0, SOLVER_WORKERS / len(clusters))
+
+    pool = solver_pool()
+    futures = []
+    for number, (cluster, cluster_trucks) in enumerate(zip(clusters, trucks)):
+        indexes = [depot] + cluster
+        futures.append(pool.submit(
+            _solve_cluster, sub_matrix(distances, indexes), np.asarray(demands)[indexes], cluster_trucks,
+            max_capacity, cluster_time, seed + number if seed is not None else None, algorithm
+        ))
+
+    routes, unserved = [], []
+    improvement = 0.0
+    for cluster, future in zip(clusters, futures):
+        indexes = [depot] + cluster
+        cluster_routes, cluster_unserved, cluster_stats = future.result()
+        routes.extend([indexes[i] for i in route] for route in cluster_routes)
+        unserved.extend(indexes[i] for i in cluster_unserved)
+        if cluster_stats:
+            improvement += cluster_stats['improvement']
+    solved = time.time()
+
+    # Boundary repair: bins next to another cluster may belong to its routes
+    label = {c: number for number, cluster in enumerate(clusters) for c in cluster}
+    nearest = distances.nearest(10)
+    boundary = [c for c in customers if c in label and any(
+        label.get(v, label[c]) != label[c] for v in nearest[c].tolist()
+    )]
+    if unserved:
+        # ALNS without iterations is its greedy repair of the unassigned bins
+        routes, unserved, _ = alns(distances, routes, unserved, demands, max_trucks, max_capacity,
+                                   depot=depot, max_iterations=0)
+    repair_time = None
+    if time_limit is not None:
+        repair_time = max(started + time_limit - time.time(), 0.0)
+    cost = route_cost(distances, routes, depot)
+    # Same shape as improve_routes' stats when the budget leaves no time for the repair
+    stats = {
+        'initial_cost': cost,
+        'final_cost': cost,
+        'improvement': 0.0,
+        'moves': {'2-opt': 0, 'or-opt': 0, 'relocate': 0, 'swap': 0},
+        'elapsed': 0.0,
+        'timed_out': True
+    }
+    if on_improve is not None:
+        on_improve(cost, routes)
+    if repair_time is None or repair_time > 0:
+        routes, stats = improve_routes(distances, routes, demands, max_capacity, depot=depot,
+                                       time_limit=repair_time, focus=boundary, on_improve=on_improve)
+        improvement += stats['improvement']
+
+    return routes, unserved, dict(
+        stats,
+        improvement=improvement,
+        clusters=len(clusters),
+        boundary_bins=len(boundary),
+        cluster_seconds=solved - started,
+        repair_seconds=time.time() - solved
+    )
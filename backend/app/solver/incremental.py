@@ -0,0 +1,60 @@
+import time
+from .alns import alns
+from .local_search import improve_routes
+
+# Local repair also scans this many nearest neighbours of every patched bin
+REPAIR_NEIGHBORS = 10
+
+
+def patch_routes(distances, routes, demands, max_trucks, max_capacity, depot=0, removed=(), inserted=(),
+                 time_limit=None):
+    """Apply a delta of removed and inserted bins to existing routes
+
+    Removed bins are dropped from their route. Routes pushed over max_capacity
+    by new weights give up their heaviest bins until they fit. Inserted and
+    displaced bins then go to their cheapest feasible position, and the local
+    search runs only around the patched bins. Bins that changed (weight or
+    position) are passed as inserted: they are taken out and placed again.
+
+    Returns (routes, unserved, stats).
+    """
+    started = time.time()
+    removed = set(removed)
+    before = sum(len(route) for route in routes)
+    routes = [[c for c in route if c not in removed] for route in routes]
+    dropped = before - sum(len(route) for route in routes)
+    pending = [c for c in dict.fromkeys(inserted) if c != depot]
+    pending_set = set(pending)
+    routes = [[c for c in route if c not in pending_set] for route in routes]
+
+    displaced = 0
+    for route in routes:
+        load = sum(demands[c] for c in route)
+        while load > max_capacity and route:
+            heaviest = max(route, key=lambda c: demands[c])
+            route.remove(heaviest)
+            load -= demands[heaviest]
+            pending.append(heaviest)
+            displaced += 1
+
+    unserved = []
+    if pending:
+        # ALNS without iterations is its greedy repair of the unassigned bins
+        routes, unserved, _ = alns(distances, [route for route in routes if route], pending, demands,
+                                   max_trucks, max_capacity, depot=depot, max_iterations=0)
+    routes = [route for route in routes if route]
+
+    stats = {'removed': dropped, 'inserted': len(pending) - displaced, 'displaced': displaced}
+    routed = {c for route in routes for c in route}
+    focus = {c for c in pending if c in routed}
+    if focus:
+        nearest = distances.nearest(REPAIR_NEIGHBORS)
+        focus.update(v for c in list(focus) for v in nearest[c].tolist() if v in routed)
+        if time_limit is not None:
+            time_limit = max(time_limit - (time.time() - started), 0.0)
+        if time_limit is None or time_limit > 0:
+            routes, repair = improve_routes(distances, routes, demands, max_capacity, depot=depot,
+                                            time_limit=time_limit, focus=sorted(focus))
+            stats.update(repair)
+    stats['elapsed'] = time.time() - started
+    return routes, unserved, stats
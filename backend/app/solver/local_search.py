@@ -0,0 +1,220 @@
+import random
+import time
+
+# Candidate moves only pair a bin with its nearest neighbours
+LOCAL_SEARCH_NEIGHBORS = 20
+EPSILON = 1e-6
+# Minimum seconds between two on_improve calls
+REPORT_INTERVAL = 0.5
+
+
+class RouteSet:
+    """Routes as depot-delimited tours with cached positions, loads and leg prefix sums
+
+    tours[r] = [depot, c1, ..., ck, depot]. forward[r][k] is the cost of the first k
+    legs, backward[r][k] the cost of the same legs driven in reverse, so the cost of
+    any reversed segment (2-opt on asymmetric distances) is available in O(1).
+    """
+
+    def __init__(self, distances, routes, demands, depot):
+        self.dist = distances.distance_at
+        self.demands = demands
+        self.depot = depot
+        self.tours = [[depot] + list(route) + [depot] for route in routes]
+        self.route_of = {}
+        self.position = {}
+        self.loads = []
+        self.forward = []
+        self.backward = []
+        for r in range(len(self.tours)):
+            self.loads.append(0.0)
+            self.forward.append(None)
+            self.backward.append(None)
+            self.refresh(r)
+
+    def refresh(self, r):
+        """Recompute positions, load and prefix sums of route r after it changed"""
+        tour = self.tours[r]
+        dist = self.dist
+        forward = [0.0]
+        backward = [0.0]
+        load = 0.0
+        for k in range(len(tour) - 1):
+            a, b = tour[k], tour[k + 1]
+            forward.append(forward[-1] + dist(a, b))
+            backward.append(backward[-1] + dist(b, a))
+            if k > 0:
+                self.route_of[a] = r
+                self.position[a] = k
+                load += self.demands[a]
+        self.forward[r] = forward
+        self.backward[r] = backward
+        self.loads[r] = load
+
+    def cost(self):
+        return sum(forward[-1] for forward in self.forward)
+
+    def routes(self):
+        return [tour[1:-1] for tour in self.tours if len(tour) > 2]
+
+
+def _move_segment(rs, r, i, length, j):
+    """Delta of moving tour[i:i+length] of route r to just after position j of the same route"""
+    tour = rs.tours[r]
+    dist = rs.dist
+    prev_node, next_node = tour[i - 1], tour[i + length]
+    first, last = tour[i], tour[i + length - 1]
+    a, b = tour[j], tour[j + 1]
+    return (dist(prev_node, next_node) - dist(prev_node, first) - dist(last, next_node)
+            + dist(a, first) + dist(last, b) - dist(a, b))
+
+
+def _apply_segment(rs, r, i, length, j):
+    tour = rs.tours[r]
+    segment = tour[i:i + length]
+    if j > i:
+        tour[j + 1:j + 1] = segment
+        del tour[i:i + length]
+    else:
+        del tour[i:i + length]
+        tour[j + 1:j + 1] = segment
+    rs.refresh(r)
+
+
+def _two_opt(rs, r, i, j):
+    """Delta of reversing tour[i+1..j] of route r (i < j)"""
+    tour = rs.tours[r]
+    dist = rs.dist
+    a, b, c, e = tour[i], tour[i + 1], tour[j], tour[j + 1]
+    inside_forward = rs.forward[r][j] - rs.forward[r][i + 1]
+    inside_backward = rs.backward[r][j] - rs.backward[r][i + 1]
+    return dist(a, c) + dist(b, e) - dist(a, b) - dist(c, e) + inside_backward - inside_forward
+
+
+def _relocate(rs, ru, i, rv, j):
+    """Delta of moving the bin at ru[i] to just after rv[j] (different routes)"""
+    tu, tv = rs.tours[ru], rs.tours[rv]
+    dist = rs.dist
+    p, u, n = tu[i - 1], tu[i], tu[i + 1]
+    a, b = tv[j], tv[j + 1]
+    return dist(p, n) - dist(p, u) - dist(u, n) + dist(a, u) + dist(u, b) - dist(a, b)
+
+
+def _swap(rs, ru, i, rv, j):
+    """Delta of exchanging ru[i] and rv[j] (different routes)"""
+    tu, tv = rs.tours[ru], rs.tours[rv]
+    dist = rs.dist
+    pu, u, nu = tu[i - 1], tu[i], tu[i + 1]
+    pv, v, nv = tv[j - 1], tv[j], tv[j + 1]
+    return (dist(pu, v) + dist(v, nu) - dist(pu, u) - dist(u, nu)
+            + dist(pv, u) + dist(u, nv) - dist(pv, v) - dist(v, nv))
+
+
+def improve_routes(distances, routes, demands, max_capacity, depot=0, time_limit=None,
+                   neighbors=LOCAL_SEARCH_NEIGHBORS, seed=None, focus=None, on_improve=None):
+    """Local search over constructed routes
+
+    Intra-route 2-opt and Or-opt (segments of 1-3 bins), inter-route relocate and
+    swap. Every move is priced in O(1) from the distance lookups and the cached
+    prefix sums, capacity is checked against cached route loads, and candidates
+    are restricted to each bin's nearest neighbours. First-improvement descent
+    until no move improves or time_limit (seconds) runs out. With a seed, bins
+    are scanned in a shuffled order so repeated runs reach different optima.
+    focus restricts the scan to those bins; moves may still touch any route.
+    on_improve(cost, routes) is called with the current routes at most every
+    REPORT_INTERVAL seconds while they improve.
+
+    Returns (routes, stats) with the initial and final cost, the improvement and
+    the number of moves applied per kind.
+    """
+    started = time.monotonic()
+    deadline = started + time_limit if time_limit is not None else None
+    rs = RouteSet(distances, routes, demands, depot)
+    initial_cost = rs.cost()
+    stats = {'2-opt': 0, 'or-opt': 0, 'relocate': 0, 'swap': 0}
+
+    customers = list(rs.route_of) if focus is None else [c for c in focus if c in rs.route_of]
+    if seed is not None:
+        random.Random(seed).shuffle(customers)
+    customer_set = set(rs.route_of)
+    nearest = distances.nearest(neighbors)
+    candidates = {u: [v for v in nearest[u].tolist() if v in customer_set] for u in customers}
+
+    timed_out = False
+    improved = True
+    reported = started
+    while improved and not timed_out:
+        improved = False
+        for u in customers:
+            if deadline is not None and time.monotonic() > deadline:
+                timed_out = True
+                break
+            if _improve_bin(rs, u, candidates[u], max_capacity, stats):
+                improved = True
+                if on_improve is not None and time.monotonic() - reported > REPORT_INTERVAL:
+                    reported = time.monotonic()
+                    on_improve(rs.cost(), rs.routes())
+
+    final_cost = rs.cost()
+    return rs.routes(), {
+        'initial_cost': initial_cost,
+        'final_cost': final_cost,
+        'improvement': initial_cost - final_cost,
+        'moves': stats,
+        'elapsed': time.monotonic() - started,
+        'timed_out': timed_out
+    }
+
+
+def _improve_bin(rs, u, candidates, max_capacity, stats):
+    """Try the moves bringing u next to one of its neighbours; apply the first improving one"""
+    demands = rs.demands
+    for v in candidates:
+        ru, rv = rs.route_of[u], rs.route_of[v]
+        i, j = rs.position[u], rs.position[v]
+
+        if ru == rv:
+            last = len(rs.tours[ru]) - 2
+            # 2-opt: make u and v adjacent by reversing the stretch between them
+            a, b = (i, j) if i < j else (j, i)
+            if _two_opt(rs, ru, a, b) < -EPSILON:
+                tour = rs.tours[ru]
+                tour[a + 1:b + 1] = tour[a + 1:b + 1][::-1]
+                rs.refresh(ru)
+                stats['2-opt'] += 1
+                return True
+            # Or-opt: move a segment starting at u to just after v or just before v
+            for length in (1, 2, 3):
+                if i + length - 1 > last:
+                    break
+                for target in (j, j - 1):
+                    if i - 1 <= target <= i + length - 1:
+                        continue
+                    if _move_segment(rs, ru, i, length, target) < -EPSILON:
+                        _apply_segment(rs, ru, i, length, target)
+                        stats['or-opt'] += 1
+                        return True
+            continue
+
+        # Relocate u next to v (after v, or before v) when the load fits
+        if rs.loads[rv] + demands[u] <= max_capacity:
+            for target in (j, j - 1):
+                if _relocate(rs, ru, i, rv, target) < -EPSILON:
+                    del rs.tours[ru][i]
+                    rs.tours[rv].insert(target + 1, u)
+                    rs.refresh(ru)
+                    rs.refresh(rv)
+                    stats['relocate'] += 1
+                    return True
+
+        # Swap u and v when both loads still fit
+        if (rs.loads[ru] - demands[u] + demands[v] <= max_capacity
+                and rs.loads[rv] - demands[v] + demands[u] <= max_capacity):
+            if _swap(rs, ru, i, rv, j) < -EPSILON:
+                rs.tours[ru][i], rs.tours[rv][j] = v, u
+                rs.refresh(ru)
+                rs.refresh(rv)
+                stats['swap'] += 1
+                return True
+
+    return False
@@ -0,0 +1,202 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from ..distances import DistanceMatrix, SparseDistanceGraph
+from .savings import clarke_wright
+from .local_search import improve_routes
+from .alns import alns
+
+ALGORITHMS = ("local_search", "alns")
+
+SOLVER_WORKERS = int(os.getenv("SOLVER_WORKERS", str(os.cpu_count() or 1)))
+# Savings perturbation of the randomized starts (start 0 is the plain heuristic)
+START_NOISE = 0.1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Worker side: the last shared block attached, kept across tasks of the same request
+_attached = {}
+
+
+def solver_pool():
+    """Process pool shared by every multi-start solve, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: workers must not inherit the server's event loop and threads
+            _pool = ProcessPoolExecutor(max_workers=SOLVER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+class SharedProblem:
+    """Distances, demands and customers copied once into one shared memory block
+
+    Workers map the block by name instead of unpickling an N x N matrix per task.
+    Dense matrices share their distance array, sparse graphs their coordinates,
+    neighbour lists and routed edges.
+    """
+
+    def __init__(self, distances, demands, customers):
+        arrays = {
+            'demands': np.asarray(demands, dtype=np.float64),
+            'customers': np.asarray(customers, dtype=np.int64)
+        }
+        if isinstance(distances, SparseDistanceGraph):
+            self.kind = "sparse"
+            edges = list(distances.edges.items())
+            arrays['latitudes'] = np.degrees(np.asarray(distances.latitudes, dtype=np.float64))
+            arrays['longitudes'] = np.degrees(np.asarray(distances.longitudes, dtype=np.float64))
+            arrays['neighbors'] = np.asarray(distances.neighbors, dtype=np.int32)
+            arrays['edge_pairs'] = np.array([pair for pair, _ in edges], dtype=np.int64).reshape(-1, 2)
+            arrays['edge_values'] = np.array([value for _, value in edges], dtype=np.float64).reshape(-1, 2)
+        else:
+            self.kind = "dense"
+            arrays['distances'] = np.asarray(distances.distances, dtype=np.float32)
+
+        layout = []
+        offset = 0
+        for key, array in arrays.items():
+            offset = (offset + 63) // 64 * 64
+            layout.append((key, array.dtype.str, array.shape, offset))
+            offset += array.nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (key, dtype, shape, start), array in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=start)[...] = array
+        self.spec = (self.shm.name, self.kind, len(distances), layout)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach(spec):
+    """Map a shared problem in a worker, rebuilding the distance object once per block"""
+    name, kind, n, layout = spec
+    if name in _attached:
+        return _attached[name][1:]
+    for shm, *_ in _attached.values():
+        shm.close()
+    _attached.clear()
+
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start) for key, dtype, shape, start in layout}
+    if kind == "sparse":
+        edges = dict(zip(map(tuple, arrays['edge_pairs'].tolist()), map(tuple, arrays['edge_values'].tolist())))
+        distances = SparseDistanceGraph(range(n), arrays['latitudes'], arrays['longitudes'], arrays['neighbors'], edges)
+    else:
+        # The solver only reads distances
+        distances = DistanceMatrix(range(n), arrays['distances'], None)
+    _attached[name] = (shm, distances, arrays['demands'], arrays['customers'].tolist())
+    return _attached[name][1:]
+
+
+def solve_once(distances, demands, customers, max_trucks, max_capacity, depot=0, deadline=None, seed=None,
+               algorithm="local_search", perturb=False, on_improve=None):
+    """One construction-plus-improvement run
+
+    deadline is a wall-clock time.time() value shared by every start. perturb
+    randomizes the construction and the local search from seed; without it
+    they are deterministic. With algorithm="alns" the local optimum is handed to
+    ALNS (seeded by seed) until the deadline. on_improve(cost, routes) gets the
+    constructed routes, then the improvements. Returns (routes, unserved, stats).
+    """
+    noise = START_NOISE if perturb else 0.0
+    routes, unserved = clarke_wright(distances, demands, customers, max_trucks, max_capacity,
+                                     depot=depot, noise=noise, seed=seed)
+    if on_improve is not None:
+        on_improve(route_cost(distances, routes, depot), routes)
+    time_limit = max(deadline - time.time(), 0.0) if deadline is not None else None
+    stats = None
+    if time_limit is None or time_limit > 0:
+        routes, stats = improve_routes(distances, routes, demands, max_capacity, depot=depot,
+                                       time_limit=time_limit, seed=seed if perturb else None,
+                                       on_improve=on_improve)
+    if algorithm == "alns" and (deadline is None or time.time() < deadline):
+        routes, unserved, alns_stats = alns(distances, routes, unserved, demands, max_trucks, max_capacity,
+                                            depot=depot, deadline=deadline, seed=seed, on_improve=on_improve)
+        if alns_stats:
+            # Improvement is reported against the construction
+            alns_stats['improvement'] = stats['initial_cost'] - alns_stats['final_cost']
+            stats = dict(stats, **{key: value for key, value in alns_stats.items() if key != 'initial_cost'})
+    return routes, unserved, stats
+
+
+def _solve_shared(spec, max_trucks, max_capacity, depot, deadline, seed, algorithm, perturb):
+    distances, demands, customers = _attach(spec)
+    if perturb and deadline is not None and time.time() >= deadline:
+        # Started after the budget ran out: only the deterministic start is mandatory
+        return None
+    return solve_once(distances, demands, customers, max_trucks, max_capacity, depot, deadline, seed, algorithm,
+                      perturb)
+
+
+def route_cost(distances, routes, depot=0):
+    return sum(
+        sum(distances.distance_at(a, b) for a, b in zip([depot] + route, route + [depot]))
+        for route in routes
+    )
+
+
+def multi_start(distances, demands, customers, max_trucks, max_capacity, depot=0, starts=1,
+                time_limit=None, seed=None, algorithm="local_search", on_improve=None):
+    """Best of independent seeded construction-plus-improvement runs
+
+    Start 0 is the deterministic heuristic, the others perturb the savings order
+    and the local search scan order with seeds seed+1, seed+2, ... They run in the
+    solver process pool on the shared problem, all bound by the same wall-clock
+    time_limit. algorithm is passed to solve_once. Solutions serving more bins
+    win, then the shortest. on_improve(cost, routes) follows a single start
+    run, and otherwise gets the best start so far each time one finishes.
+
+    Returns (routes, unserved, stats) of the best start, stats gaining the
+    number of starts completed and the index of the winner.
+    """
+    deadline = time.time() + time_limit if time_limit is not None else None
+    if starts <= 1:
+        routes, unserved, stats = solve_once(distances, demands, customers, max_trucks, max_capacity, depot, deadline,
+                                             seed, algorithm, on_improve=on_improve)
+        return routes, unserved, stats
+
+    base_seed = seed if seed is not None else int.from_bytes(os.urandom(4), "little")
+    seeds = [base_seed + k for k in range(starts)]
+    shared = SharedProblem(distances, demands, customers)
+    try:
+        pool = solver_pool()
+        futures = {
+            pool.submit(_solve_shared, shared.spec, max_trucks, max_capacity, depot, deadline, start_seed, algorithm,
+                        start > 0): start
+            for start, start_seed in enumerate(seeds)
+        }
+        best = None
+        completed = 0
+        # Ties go to the lowest start, whatever order they finish in
+        for future in as_completed(futures):
+            result = future.result()
+            if result is None:
+                continue
+            completed += 1
+            routes, unserved, stats = result
+            key = (len(unserved), stats['final_cost'] if stats else route_cost(distances, routes, depot), futures[future])
+            if best is None or key < best[0]:
+                best = (key, futures[future], result)
+                if on_improve is not None:
+                    on_improve(key[1], routes)
+    finally:
+        shared.close()
+
+    _, winner, (routes, unserved, stats) = best
+    stats = dict(stats or {}, starts=completed, best_start=winner)
+    return routes, unserved, stats
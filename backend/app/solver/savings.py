@@ -0,0 +1,115 @@
+import heapq
+import numpy as np
+
+# Savings are only computed between each bin and its nearest neighbours:
+# merges between far-apart bins are never the profitable ones.
+SAVINGS_NEIGHBORS = 40
+
+
+def clarke_wright(distances, demands, customers, max_trucks, max_capacity, depot=0, neighbors=SAVINGS_NEIGHBORS,
+                  noise=0.0, seed=None):
+    """Capacity-aware Clarke-Wright savings construction
+
+    distances: DistanceMatrix or SparseDistanceGraph, depot at index depot
+    demands: array of demand per matrix index
+    customers: matrix indexes to serve
+
+    Every customer starts on its own route; routes are then merged tail-to-head in
+    decreasing order of saving d(i, depot) + d(depot, j) - d(i, j), popped from a
+    heap, as long as the merged load fits max_capacity. If more than max_trucks
+    routes remain, the heaviest are kept and the others' bins are re-inserted where
+    it is cheapest and feasible.
+
+    noise > 0 scales each saving by a random factor in [1 - noise, 1 + noise]
+    (seeded by seed), so repeated runs explore different merge orders.
+
+    Returns (routes, unserved): lists of matrix indexes per truck (depot excluded)
+    and the customers that could not be served.
+    """
+    n = len(distances)
+    demands = np.asarray(demands, dtype=np.float64)
+    customers = [c for c in customers if c != depot]
+    unserved = [c for c in customers if demands[c] > max_capacity]
+    customers = [c for c in customers if demands[c] <= max_capacity]
+    if not customers or max_trucks <= 0:
+        return [], unserved + customers
+
+    is_customer = np.zeros(n, dtype=bool)
+    is_customer[customers] = True
+    customers_array = np.asarray(customers, dtype=np.intp)
+    to_depot = np.zeros(n)
+    from_depot = np.zeros(n)
+    to_depot[customers_array] = distances.distances_between(customers_array, np.full(len(customers), depot))
+    from_depot[customers_array] = distances.distances_between(np.full(len(customers), depot), customers_array)
+
+    # Savings for (i -> j) between neighbouring customers, heap-ordered
+    nearest = distances.nearest(neighbors)[customers_array]
+    rows = np.repeat(customers_array, nearest.shape[1])
+    cols = nearest.ravel().astype(np.intp)
+    valid = is_customer[cols] & (cols != rows)
+    rows, cols = rows[valid], cols[valid]
+    savings = to_depot[rows] + from_depot[cols] - distances.distances_between(rows, cols)
+    if noise > 0:
+        savings *= np.random.default_rng(seed).uniform(1 - noise, 1 + noise, len(savings))
+    positive = savings > 0
+    heap = list(zip((-savings[positive]).tolist(), rows[positive].tolist(), cols[positive].tolist()))
+    heapq.heapify(heap)
+
+    # One route per customer; routes are linked lists identified by their head
+    following = {c: None for c in customers}
+    route_of = {c: c for c in customers}
+    members = {c: [c] for c in customers}
+    head = {c: c for c in customers}
+    tail = {c: c for c in customers}
+    load = {c: float(demands[c]) for c in customers}
+
+    while heap:
+        _, i, j = heapq.heappop(heap)
+        ri, rj = route_of[i], route_of[j]
+        if ri == rj or tail[ri] != i or head[rj] != j:
+            continue
+        if load[ri] + load[rj] > max_capacity:
+            continue
+
+        following[i] = j
+        # Relabel the smaller route into the larger one
+        keep, drop = (ri, rj) if len(members[ri]) >= len(members[rj]) else (rj, ri)
+        for c in members[drop]:
+            route_of[c] = keep
+        members[keep].extend(members.pop(drop))
+        head[keep], tail[keep] = head[ri], tail[rj]
+        load[keep] = load[ri] + load[rj]
+        del head[drop], tail[drop], load[drop]
+
+    routes = []
+    for r in members:
+        route, c = [], head[r]
+        while c is not None:
+            route.append(c)
+            c = following[c]
+        routes.append((load[r], route))
+
+    # Keep the heaviest routes within the fleet size, re-insert the rest
+    routes.sort(key=lambda item: -item[0])
+    kept = [[load_, route] for load_, route in routes[:max_trucks]]
+    leftovers = sorted((c for _, route in routes[max_trucks:] for c in route), key=lambda c: -demands[c])
+    for c in leftovers:
+        best = None
+        for entry in kept:
+            route_load, route = entry
+            if route_load + demands[c] > max_capacity:
+                continue
+            stops = [depot] + route + [depot]
+            for pos in range(len(stops) - 1):
+                a, b = stops[pos], stops[pos + 1]
+                delta = distances.distance_at(a, c) + distances.distance_at(c, b) - distances.distance_at(a, b)
+                if best is None or delta < best[0]:
+                    best = (delta, entry, pos)
+        if best is None:
+            unserved.append(c)
+            continue
+        _, entry, pos = best
+        entry[1].insert(pos, c)
+        entry[0] += demands[c]
+
+    return [route for _, route in kept], unserved
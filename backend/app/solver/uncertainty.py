@@ -0,0 +1,69 @@
+import numpy as np
+
+# Bins without a measured weight are drawn uniformly in this range, as the simulations do
+UNKNOWN_WEIGHT_RANGE = (10.0, 90.0)
+# Scenario blocks are sized to keep the sampled weights around this many cells
+BLOCK_CELLS = 1 << 22
+
+
+def sample_weights(weights, unknown, scenarios, rng, noise=0.0):
+    """(scenarios x bins) float32 matrix of sampled weights
+
+    Unknown bins are uniform over UNKNOWN_WEIGHT_RANGE. Known weights are kept,
+    or drawn from a normal distribution with a standard deviation of noise times
+    the weight, truncated at zero.
+    """
+    weights = np.asarray(weights, dtype=np.float32)
+    unknown = np.asarray(unknown, dtype=bool)
+    if noise > 0:
+        samples = weights * (1 + noise * rng.standard_normal((scenarios, len(weights)), dtype=np.float32))
+        np.maximum(samples, 0, out=samples)
+    else:
+        samples = np.broadcast_to(weights, (scenarios, len(weights))).copy()
+    if unknown.any():
+        low, high = UNKNOWN_WEIGHT_RANGE
+        samples[:, unknown] = rng.uniform(low, high, (scenarios, int(unknown.sum()))).astype(np.float32)
+    return samples
+
+
+def route_loads(weights, unknown, trucks, scenarios, seed=None, noise=0.0):
+    """Load of every truck in every scenario, as a (scenarios x trucks) matrix
+
+    trucks[i] is the truck of bin i, numbered 0..k-1. Bins are grouped by truck
+    and each block of scenarios is summed per truck in one np.add.reduceat call.
+    """
+    trucks = np.asarray(trucks, dtype=np.intp)
+    order = np.argsort(trucks, kind="stable")
+    weights = np.asarray(weights, dtype=np.float32)[order]
+    unknown = np.asarray(unknown, dtype=bool)[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(trucks[order]) != 0])
+    truck_ids = trucks[order][starts]
+
+    rng = np.random.default_rng(seed)
+    n_trucks = int(trucks.max()) + 1 if len(trucks) else 0
+    loads = np.zeros((scenarios, n_trucks), dtype=np.float64)
+    if len(trucks) == 0:
+        return loads
+    block = max(1, BLOCK_CELLS // len(weights))
+    for first in range(0, scenarios, block):
+        samples = sample_weights(weights, unknown, min(block, scenarios - first), rng, noise)
+        loads[first:first + len(samples), truck_ids] = np.add.reduceat(samples, starts, axis=1, dtype=np.float64)
+    return loads
+
+
+def overflow_risk(loads, max_capacity):
+    """Per-truck and fleet statistics of sampled loads against the truck capacity
+
+    A truck over capacity goes back to the depot to unload: it needs
+    ceil(load / max_capacity) - 1 extra trips.
+    """
+    over = loads > max_capacity
+    extra_trips = np.maximum(np.ceil(loads / max_capacity) - 1, 0) if max_capacity > 0 else np.zeros_like(loads)
+    return {
+        'expected_load': loads.mean(axis=0),
+        'load_p95': np.percentile(loads, 95, axis=0) if len(loads) else np.zeros(loads.shape[1]),
+        'overflow_probability': over.mean(axis=0),
+        'expected_extra_trips': extra_trips.mean(axis=0),
+        'any_overflow_probability': float(over.any(axis=1).mean()) if len(loads) else 0.0,
+        'total_expected_extra_trips': float(extra_trips.sum(axis=1).mean()) if len(loads) else 0.0
+    }
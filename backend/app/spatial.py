@@ -0,0 +1,128 @@
+import numpy as np
+from .distances import EARTH_RADIUS
+
+
+class GridIndex:
+    """Uniform grid over points projected to local meters, for nearest-neighbour queries
+
+    Coordinates are projected with an equirectangular approximation around the
+    mean latitude, which is accurate to well under 1% at city scale.
+    """
+
+    def __init__(self, latitudes, longitudes, cell_size=None):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.origin_latitude = float(self.latitudes.mean()) if len(self.latitudes) else 0.0
+        self.x, self.y = self.project(self.latitudes, self.longitudes)
+
+        n = len(self.x)
+        if cell_size is None:
+            # About four points per cell on average, ignoring outliers when sizing
+            extent = max(
+                float(np.subtract(*np.percentile(self.x, [99, 1]))) if n else 0.0,
+                float(np.subtract(*np.percentile(self.y, [99, 1]))) if n else 0.0,
+                1.0
+            )
+            cell_size = max(extent / max(np.sqrt(n / 4), 1.0), 1.0)
+        self.cell_size = float(cell_size)
+
+        self.cell_x = np.floor(self.x / self.cell_size).astype(np.int64)
+        self.cell_y = np.floor(self.y / self.cell_size).astype(np.int64)
+        # Points sorted by cell so each cell is a contiguous slice of self.order
+        keys = self._keys(self.cell_x, self.cell_y)
+        self.order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[self.order]
+        self.cell_keys, starts = np.unique(sorted_keys, return_index=True)
+        self.cell_starts = np.append(starts, n)
+
+    def __len__(self):
+        return len(self.x)
+
+    def project(self, latitudes, longitudes):
+        """Project (lat, lon) degrees to local x/y meters"""
+        scale = EARTH_RADIUS * np.pi / 180
+        x = np.asarray(longitudes, dtype=np.float64) * scale * np.cos(np.radians(self.origin_latitude))
+        y = np.asarray(latitudes, dtype=np.float64) * scale
+        return x, y
+
+    @staticmethod
+    def _keys(cell_x, cell_y):
+        return (np.asarray(cell_x, dtype=np.int64) << 32) + (np.asarray(cell_y, dtype=np.int64) & 0xFFFFFFFF)
+
+    def _cells(self, cell_x, cell_y, ring):
+        """Indexes of the points in the square of cells within ring of (cell_x, cell_y)"""
+        if (2 * ring + 1) ** 2 >= len(self.cell_keys):
+            # Cheaper to scan every occupied cell than to enumerate the square
+            return self.order
+        xs, ys = np.meshgrid(
+            np.arange(cell_x - ring, cell_x + ring + 1),
+            np.arange(cell_y - ring, cell_y + ring + 1)
+        )
+        keys = self._keys(xs.ravel(), ys.ravel())
+        positions = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        positions = positions[self.cell_keys[positions] == keys]
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.order[self.cell_starts[p]:self.cell_starts[p + 1]] for p in positions])
+
+    def _grow(self, cell_x, cell_y, x, y, k):
+        """Candidates around a cell, growing rings until the k nearest are guaranteed inside"""
+        ring = 1
+        while True:
+            candidates = self._cells(cell_x, cell_y, ring)
+            if len(candidates) >= min(k, len(self)):
+                dx = x[:, None] - self.x[candidates][None, :]
+                dy = y[:, None] - self.y[candidates][None, :]
+                squared = dx * dx + dy * dy
+                kth = np.partition(squared, min(k, len(candidates)) - 1, axis=1)[:, min(k, len(candidates)) - 1]
+                # Anything outside the searched square is at least ring cells away
+                if len(candidates) == len(self) or np.sqrt(kth.max()) <= ring * self.cell_size:
+                    return candidates, squared
+            ring *= 2
+
+    def nearest(self, latitude, longitude, k=1):
+        """Indexes of the k points nearest to (latitude, longitude), closest first"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        x, y = self.project(np.array([latitude]), np.array([longitude]))
+        cell_x = int(np.floor(x[0] / self.cell_size))
+        cell_y = int(np.floor(y[0] / self.cell_size))
+        candidates, squared = self._grow(cell_x, cell_y, x, y, k)
+        best = np.argsort(squared[0], kind="stable")[:k]
+        return candidates[best]
+
+    def within_radius(self, latitude, longitude, radius):
+        """Indexes of the points within radius meters of (latitude, longitude)"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        x, y = self.project(np.array([latitude]), np.array([longitude]))
+        ring = int(np.ceil(radius / self.cell_size))
+        candidates = self._cells(int(np.floor(x[0] / self.cell_size)), int(np.floor(y[0] / self.cell_size)), ring)
+        dx = self.x[candidates] - x[0]
+        dy = self.y[candidates] - y[0]
+        return candidates[dx * dx + dy * dy <= radius * radius]
+
+    def knn_graph(self, k):
+        """N x k array of each point's k nearest other points, closest first
+
+        Points of the same cell are processed together as one vectorized block.
+        """
+        n = len(self)
+        k = min(k, n - 1)
+        neighbors = np.empty((n, max(k, 0)), dtype=np.int32)
+        if k <= 0:
+            return neighbors
+
+        for p in range(len(self.cell_keys)):
+            members = self.order[self.cell_starts[p]:self.cell_starts[p + 1]]
+            cell_x = int(self.cell_x[members[0]])
+            cell_y = int(self.cell_y[members[0]])
+            candidates, squared = self._grow(cell_x, cell_y, self.x[members], self.y[members], k + 1)
+            # Exclude each point itself
+            squared[candidates[None, :] == members[:, None]] = np.inf
+            best = np.argpartition(squared, k - 1, axis=1)[:, :k]
+            best_squared = np.take_along_axis(squared, best, axis=1)
+            best = np.take_along_axis(best, np.argsort(best_squared, axis=1, kind="stable"), axis=1)
+            neighbors[members] = candidates[best]
+
+        return neighbors
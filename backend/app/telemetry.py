@@ -0,0 +1,184 @@
+import os
+import queue
+import threading
+import time
+from sqlalchemy import bindparam, insert, select, update
+from .bin_store import bin_store
+from .database import SessionLocal
+from .models import Bin, Measurement
+from .result_cache import result_cache
+
+# Readings waiting for the writer; ingestion answers 503 beyond this
+TELEMETRY_QUEUE_SIZE = int(os.getenv("TELEMETRY_QUEUE_SIZE", "200000"))
+# The writer commits when this many readings are waiting or every FLUSH_INTERVAL seconds
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "5000"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "0.5"))
+
+
+class TelemetryWriter:
+    """Background thread writing sensor readings in large transactions
+
+    Readings are (bin_id, weight, presence, measured_at) tuples, bin_id being
+    the sensor-side string id and weight or presence None when not measured.
+    Each batch appends every reading to the measurements table and updates
+    bins once per bin with its latest weight and presence, all with Core
+    executemany statements in one commit. A bin keeps the measured_at of its
+    weight and presence, and a reading older than the stored one (a late
+    batch) goes to the history only.
+    """
+
+    def __init__(self, batch_size=TELEMETRY_BATCH_SIZE, flush_interval=TELEMETRY_FLUSH_INTERVAL,
+                 max_pending=TELEMETRY_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        # Room check and puts of concurrent submits, so a request fits entirely or is refused
+        self._submit_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self.written = 0
+        self.unknown = 0
+        self.batches = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer once the readings already queued are written"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, readings):
+        """Queue readings; returns False without queuing any if there is not enough room"""
+        with self._submit_lock:
+            if self._queue.maxsize - self._queue.qsize() < len(readings):
+                return False
+            for reading in readings:
+                self._queue.put_nowait(reading)
+        return True
+
+    def flush(self):
+        """Write everything queued now, in the calling thread"""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'written': self.written,
+            'unknown_bins': self.unknown,
+            'batches': self.batches,
+            'errors': self.errors
+        }
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            while self._queue.qsize() < self.batch_size and time.monotonic() < deadline:
+                if self._stopping.wait(0.01):
+                    break
+            batch = self._drain(self.batch_size)
+            if batch:
+                self._write(batch)
+        self.flush()
+
+    def _resolve(self, db, bin_ids):
+        """Database ids of sensor bin_ids, looked up per batch so deleted or re-created bins are seen"""
+        bin_ids = list(bin_ids)
+        ids = {}
+        for start in range(0, len(bin_ids), 500):
+            chunk = bin_ids[start:start + 500]
+            ids.update(db.execute(select(Bin.bin_id, Bin.id).where(Bin.bin_id.in_(chunk))).all())
+        return ids
+
+    def _stored_times(self, db, pks):
+        """measured_at of the current weight and presence of bins, as {pk: (weight_at, presence_at)}"""
+        pks = list(pks)
+        times = {}
+        for start in range(0, len(pks), 500):
+            chunk = pks[start:start + 500]
+            for pk, weight_at, presence_at in db.execute(
+                select(Bin.id, Bin.weight_measured_at, Bin.presence_measured_at).where(Bin.id.in_(chunk))
+            ):
+                times[pk] = (weight_at, presence_at)
+        return times
+
+    def _write(self, batch):
+        db = SessionLocal()
+        try:
+            ids = self._resolve(db, {reading[0] for reading in batch})
+            rows = []
+            latest_weight, latest_presence = {}, {}
+            for bin_id, weight, presence, measured_at in batch:
+                pk = ids.get(bin_id)
+                if pk is None:
+                    self.unknown += 1
+                    continue
+                rows.append({'bin_id': pk, 'weight': weight, 'presence': presence, 'measured_at': measured_at})
+                # Readings of a batch can arrive out of order: keep the most recent per bin
+                if weight is not None and (pk not in latest_weight or measured_at >= latest_weight[pk][1]):
+                    latest_weight[pk] = (weight, measured_at)
+                if presence is not None and (pk not in latest_presence or measured_at >= latest_presence[pk][1]):
+                    latest_presence[pk] = (presence, measured_at)
+            if not rows:
+                return
+
+            db.execute(insert(Measurement.__table__), rows)
+            # Only readings newer than what the bin holds replace its values. Read
+            # once the insert holds the write lock: manual writes also stamp the
+            # measured_at columns, and cannot land in between
+            stored = self._stored_times(db, set(latest_weight) | set(latest_presence))
+            latest_weight = {pk: latest for pk, latest in latest_weight.items()
+                             if stored.get(pk, (None, None))[0] is None or latest[1] >= stored[pk][0]}
+            latest_presence = {pk: latest for pk, latest in latest_presence.items()
+                               if stored.get(pk, (None, None))[1] is None or latest[1] >= stored[pk][1]}
+
+            bins = Bin.__table__
+            if latest_weight:
+                db.execute(
+                    update(bins).where(bins.c.id == bindparam('pk'))
+                    .values(weight=bindparam('value'), weight_measured_at=bindparam('at')),
+                    [{'pk': pk, 'value': value, 'at': at} for pk, (value, at) in latest_weight.items()]
+                )
+            if latest_presence:
+                db.execute(
+                    update(bins).where(bins.c.id == bindparam('pk'))
+                    .values(presence=bindparam('value'), presence_measured_at=bindparam('at')),
+                    [{'pk': pk, 'value': value, 'at': at} for pk, (value, at) in latest_presence.items()]
+                )
+            bin_store.commit(db, lambda: bin_store.update(
+                weight={pk: value for pk, (value, _) in latest_weight.items()},
+                presence={pk: value for pk, (value, _) in latest_presence.items()}
+            ))
+            self.written += len(rows)
+            self.batches += 1
+            result_cache.invalidate(set(latest_weight) | set(latest_presence))
+        except Exception as e:
+            db.rollback()
+            self.errors += 1
+            print(f"Telemetry write error ({len(batch)} readings dropped): {e}")
+        finally:
+            db.close()
+
+
+telemetry_writer = TelemetryWriter()
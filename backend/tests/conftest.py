@@ -0,0 +1,128 @@
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+
+# Tests import the backend as the server does, from backend/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# One database file shared by the test and the request threads of TestClient
+TEST_DIR = tempfile.mkdtemp(prefix="trashway-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{TEST_DIR}/test.db")
+os.environ.setdefault("SNAPSHOT_DIR", TEST_DIR)
+os.environ.setdefault("SNAPSHOT_REBUILD_DELAY", "3600")
+# No routing server: every pair falls back to the haversine estimate at once
+os.environ.setdefault("OSRM_URL", "http://127.0.0.1:9")
+os.environ.setdefault("OSRM_RETRIES", "0")
+
+from app.distances import build_distance_matrix  # noqa: E402
+from app.solver.parallel import shutdown_pool  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def solver_pool_shutdown():
+    yield
+    shutdown_pool()
+
+
+@pytest.fixture
+def make_problem():
+    """Factory of seeded random problems: (matrix, demands, customers, latitudes, longitudes), depot at index 0"""
+    def make(n, seed=0, spread=0.05):
+        rng = np.random.default_rng(seed)
+        latitudes = np.concatenate([[48.8566], 48.8566 + rng.uniform(-spread, spread, n)])
+        longitudes = np.concatenate([[2.3522], 2.3522 + rng.uniform(-spread, spread, n)])
+        matrix = build_distance_matrix(range(n + 1), latitudes, longitudes)
+        demands = np.concatenate([[0.0], rng.uniform(10, 90, n)])
+        return matrix, demands, list(range(1, n + 1)), latitudes, longitudes
+    return make
+
+
+@pytest.fixture
+def assert_valid():
+    """Check that every customer is served exactly once or reported unserved, no route over capacity"""
+    return check_routes
+
+
+def check_routes(routes, unserved, customers, demands, max_capacity, max_trucks=None):
+    served = [c for route in routes for c in route]
+    assert sorted(served + list(unserved)) == sorted(customers)
+    assert all(sum(demands[c] for c in route) <= max_capacity + 1e-6 for route in routes)
+    if max_trucks is not None:
+        assert len([route for route in routes if route]) <= max_trucks
+
+
+@pytest.fixture
+def make_bins():
+    """Factory resetting the bins table to the given sensor bin_ids, returning their ids"""
+    from app.database import Base, SessionLocal, engine
+    from app.models import Bin, Distance, Measurement
+
+    def make(*bin_ids):
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            db.query(Measurement).delete()
+            db.query(Distance).delete()
+            db.query(Bin).delete()
+            bins = [Bin(bin_id=bin_id, weight=0.0, presence=0, longitude=2.35, latitude=48.85) for bin_id in bin_ids]
+            db.add_all(bins)
+            db.commit()
+            return [b.id for b in bins]
+        finally:
+            db.close()
+    return make
+
+
+@pytest.fixture
+def bin_rows():
+    """Factory of n valid bin rows scattered around the depot, as sent to the bulk endpoints"""
+    def rows(n, seed=0, prefix="s"):
+        rng = np.random.default_rng(seed)
+        return [
+            {"bin_id": f"{prefix}{k}", "weight": round(float(weight), 1), "presence": 1,
+             "latitude": float(latitude), "longitude": float(longitude)}
+            for k, (weight, latitude, longitude) in enumerate(zip(
+                rng.uniform(10, 90, n), 48.8566 + rng.uniform(-0.03, 0.03, n), 2.3522 + rng.uniform(-0.03, 0.03, n)
+            ))
+        ]
+    return rows
+
+
+@pytest.fixture
+def client(make_bins):
+    """TestClient of the app, started with its lifespan (simulation workers, telemetry writer), on an empty bin set"""
+    from fastapi.testclient import TestClient
+    from app.bin_store import bin_store
+    from app.main import app
+    from app.result_cache import result_cache
+
+    make_bins()
+    bin_store.invalidate()
+    result_cache.clear()
+    with TestClient(app) as client:
+        yield client
+    bin_store.invalidate()
+    result_cache.clear()
+
+
+@pytest.fixture
+def held_solver(monkeypatch):
+    """Holds simulations at the start of their solve: (started, release) events
+
+    started is set when a simulation reaches the solver, which then waits for release.
+    """
+    from app.routers import simulations
+
+    started, release = threading.Event(), threading.Event()
+    optimize_routes = simulations.optimize_routes
+
+    def held(*args, **kwargs):
+        started.set()
+        release.wait(10)
+        return optimize_routes(*args, **kwargs)
+    monkeypatch.setattr(simulations, "optimize_routes", held)
+    yield started, release
+    release.set()
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from app.solver.alns import alns
+from app.solver.local_search import improve_routes
+from app.solver.parallel import route_cost
+from app.solver.savings import clarke_wright
+
+
+def local_optimum(matrix, demands, customers, max_trucks):
+    routes, unserved = clarke_wright(matrix, demands, customers, max_trucks, 400.0)
+    return improve_routes(matrix, routes, demands, 400.0)[0], unserved
+
+
+@pytest.mark.parametrize("n, seed, max_trucks", [(60, 1, 12), (80, 2, 10), (50, 4, 6), (40, 5, 3)])
+def test_alns_never_worse_than_its_start(make_problem, assert_valid, n, seed, max_trucks):
+    matrix, demands, customers, _, _ = make_problem(n, seed=seed)
+    routes, unserved = local_optimum(matrix, demands, customers, max_trucks)
+    result, result_unserved, stats = alns(matrix, routes, unserved, demands, max_trucks, 400.0, seed=3,
+                                          max_iterations=300)
+    assert_valid(result, result_unserved, customers, demands, 400.0, max_trucks=max_trucks)
+    assert stats['final_cost'] == pytest.approx(route_cost(matrix, result), rel=1e-6)
+    # Serving more bins first, then a shorter distance
+    assert len(result_unserved) <= len(unserved)
+    if len(result_unserved) == len(unserved):
+        assert stats['final_cost'] <= route_cost(matrix, routes) + 1e-6
+    assert stats['iterations'] == 300
+    assert alns(matrix, routes, unserved, demands, max_trucks, 400.0, seed=3, max_iterations=300)[:2] == (
+        result, result_unserved
+    )
+
+
+def test_alns_escapes_the_local_optimum(make_problem):
+    matrix, demands, customers, _, _ = make_problem(60, seed=1)
+    routes, unserved = local_optimum(matrix, demands, customers, 12)
+    # No local search move improves these routes, but removing and re-inserting bins does
+    assert improve_routes(matrix, routes, demands, 400.0)[1]['final_cost'] == pytest.approx(route_cost(matrix, routes))
+    result, _, stats = alns(matrix, routes, unserved, demands, 12, 400.0, seed=3, max_iterations=1000)
+    assert stats['final_cost'] < 0.99 * route_cost(matrix, routes)
+    # Operator weights adapted to how useful each operator was
+    assert len(set(stats['destroy_weights'].values()) | set(stats['repair_weights'].values())) > 1
+
+
+def test_alns_stops_at_its_deadline(make_problem):
+    matrix, demands, customers, _, _ = make_problem(60, seed=1)
+    routes, unserved = local_optimum(matrix, demands, customers, 12)
+    started = time.time()
+    _, _, stats = alns(matrix, routes, unserved, demands, 12, 400.0, seed=3, deadline=started + 0.3)
+    assert 0.3 <= time.time() - started < 0.6
+    assert stats['iterations'] > 0
+
+
+def test_alns_inserts_unserved_bins(make_problem, assert_valid):
+    matrix, demands, customers, _, _ = make_problem(40, seed=2)
+    demands[15] = 500.0
+    routes = [customers[:10]]
+    pending = customers[10:]
+    result, unserved, _ = alns(matrix, routes, pending, demands, 6, 400.0, seed=1, max_iterations=50)
+    # Only the bin heavier than a truck is left out
+    assert_valid(result, unserved, customers, demands, 400.0, max_trucks=6)
+    assert unserved == [15]
+
+
+def test_alns_without_bins():
+    assert alns(None, [], [], [0.0], 3, 100.0) == ([], [], None)
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from app.bin_store import bin_store
+from app.database import SessionLocal, write_lock
+from app.models import Bin
+from app.routers.bins import BinGeneralUpdate, update_bin_general
+
+
+@pytest.fixture
+def store(make_bins):
+    ids = make_bins("a", "b", "c")
+    bin_store.invalidate()
+    bin_store.snapshot()
+    yield ids
+    bin_store.invalidate()
+
+
+def values(ids):
+    snapshot = bin_store.snapshot()
+    return snapshot.records(snapshot.rows_of(ids), ("weight", "presence"))
+
+
+def test_general_update_patches_once(store):
+    version, patches = bin_store.version, bin_store.patches
+    db = SessionLocal()
+    try:
+        update_bin_general(store[1], BinGeneralUpdate(weight=42.0, presence=1), db)
+    finally:
+        db.close()
+    assert bin_store.version == version + 1 and bin_store.patches == patches + 1
+    assert values(store) == [{"weight": 0.0, "presence": 0}, {"weight": 42.0, "presence": 1},
+                             {"weight": 0.0, "presence": 0}]
+
+
+def test_commit_patches_under_the_write_lock(store):
+    held = []
+    db = SessionLocal()
+    try:
+        db.get(Bin, store[0]).weight = 7.0
+
+        def patch():
+            held.append(write_lock.locked())
+            bin_store.update(weight={store[0]: 7.0})
+        bin_store.commit(db, patch)
+        # Nothing written: no patch
+        db.get(Bin, store[0]).weight = 7.0
+        bin_store.commit(db, patch)
+    finally:
+        db.close()
+    assert held == [True] and not write_lock.locked()
+    assert values(store[:1]) == [{"weight": 7.0, "presence": 0}]
+
+
+def test_failed_commit_drops_the_snapshot(store):
+    db = SessionLocal()
+    try:
+        db.get(Bin, store[0]).weight = 7.0
+        with pytest.raises(RuntimeError):
+            def patch():
+                bin_store.update(weight={store[0]: 7.0})
+                raise RuntimeError("commit failed")
+            bin_store.commit(db, patch)
+        db.rollback()
+    finally:
+        db.close()
+    assert not bin_store.stats()['loaded']
+    assert values(store[:1]) == [{"weight": 0.0, "presence": 0}]
+
+
+def test_loads_wait_for_patched_writes(store):
+    patched, release = threading.Event(), threading.Event()
+    loaded = []
+
+    def patch():
+        bin_store.update(weight={store[0]: 7.0})
+        patched.set()
+        release.wait(5)
+
+    def load():
+        patched.wait(5)
+        bin_store.invalidate()
+        loaded.extend(values(store[:1]))
+        loaded.append(release.is_set())
+
+    loader = threading.Thread(target=load)
+    loader.start()
+    db = SessionLocal()
+    try:
+        db.get(Bin, store[0]).weight = 7.0
+        threading.Timer(0.2, release.set).start()
+        bin_store.commit(db, patch)
+    finally:
+        db.close()
+    loader.join(5)
+    assert loaded == [{"weight": 7.0, "presence": 0}, True]
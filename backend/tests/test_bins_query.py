@@ -0,0 +1,87 @@
+import json
+import math
+
+import pytest
+
+from app.bin_index import METERS_PER_DEGREE
+
+# A box over the north-east of the bins
+BBOX = (2.3522, 48.8566, 2.40, 48.90)
+
+
+@pytest.fixture
+def bins(client, bin_rows):
+    rows = bin_rows(25)
+    for k, row in enumerate(rows):
+        row["presence"] = int(k % 3 != 0)
+    client.put("/bins/", json=rows)
+    return client.get("/bins/").json()
+
+
+def pages(client, **params):
+    """Every page of a listing, following X-Next-Cursor"""
+    found, cursor = [], None
+    while True:
+        response = client.get("/bins/", params=dict(params, **({"after_id": cursor} if cursor is not None else {})))
+        assert response.status_code == 200
+        found.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return found
+
+
+def in_bbox(b):
+    west, south, east, north = BBOX
+    return west <= b["longitude"] <= east and south <= b["latitude"] <= north
+
+
+@pytest.mark.parametrize("area", [{}, {"bbox": ",".join(map(str, BBOX))}])
+def test_keyset_pages_cover_the_listing_once(client, bins, area):
+    expected = [b for b in bins if in_bbox(b)] if area else bins
+    assert len(expected) > 4
+    found = pages(client, limit=4, **area)
+    assert all(len(page) == 4 for page in found[:-1]) and 0 < len(found[-1]) <= 4
+    assert [b for page in found for b in page] == expected
+    assert [b["id"] for b in expected] == sorted(b["id"] for b in expected)
+
+    # The cursor still comes when the id is not projected
+    projected = pages(client, limit=4, fields="latitude,weight", **area)
+    assert [b for page in projected for b in page] == [{"latitude": b["latitude"], "weight": b["weight"]} for b in expected]
+
+
+@pytest.mark.parametrize("area", [{}, {"bbox": ",".join(map(str, BBOX))}])
+def test_filters_projection_and_streams_agree(client, bins, area):
+    params = dict(area, presence=1, min_weight=30, max_weight=80, fields="id,bin_id,weight")
+    expected = [
+        {"id": b["id"], "bin_id": b["bin_id"], "weight": b["weight"]} for b in bins
+        if b["presence"] == 1 and 30 <= b["weight"] <= 80 and (not area or in_bbox(b))
+    ]
+    assert expected
+    assert client.get("/bins/", params=params).json() == expected
+
+    ndjson = client.get("/bins/", params=dict(params, stream="ndjson"))
+    assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line) for line in ndjson.text.splitlines()] == expected
+    assert json.loads(client.get("/bins/", params=dict(params, stream="json")).text) == expected
+    # A streamed page is the first limit rows
+    assert json.loads(client.get("/bins/", params=dict(params, stream="json", limit=2)).text) == expected[:2]
+    assert json.loads(client.get("/bins/", params=dict(params, stream="json", min_weight=1000)).text) == []
+
+
+def test_near_a_point(client, bins):
+    def distance(b):
+        dx = (b["longitude"] - 2.3522) * METERS_PER_DEGREE * math.cos(math.radians(48.8566))
+        return math.hypot(dx, (b["latitude"] - 48.8566) * METERS_PER_DEGREE)
+
+    expected = [b["id"] for b in bins if distance(b) <= 1500]
+    assert 0 < len(expected) < len(bins)
+    near = pages(client, near="48.8566,2.3522", radius=1500, fields="id", limit=3)
+    assert [b["id"] for page in near for b in page] == expected
+
+
+@pytest.mark.parametrize("params", [
+    {"fields": "id,color"}, {"fields": ","}, {"stream": "xml"}, {"limit": 0}, {"bbox": "1,2,3"},
+    {"bbox": "a,b,c,d"}, {"near": "48.85,2.35"}, {"near": "48.85,2.35", "radius": -1}
+])
+def test_invalid_queries_are_rejected(client, params):
+    assert client.get("/bins/", params=params).status_code == 400
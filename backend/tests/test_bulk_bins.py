@@ -0,0 +1,90 @@
+from sqlalchemy import func, select
+
+from app.database import SessionLocal
+from app.models import Bin
+
+
+def by_bin_id(client):
+    return {b["bin_id"]: b for b in client.get("/bins/").json()}
+
+
+def table_rows():
+    db = SessionLocal()
+    try:
+        return db.scalar(select(func.count()).select_from(Bin))
+    finally:
+        db.close()
+
+
+def test_bulk_upsert_reports_rows_it_skipped(client, bin_rows):
+    rows = bin_rows(4)
+    assert client.post("/bins/bulk", json=rows[:2]).json() == {"inserted": 2, "updated": 0, "errors": []}
+    before = by_bin_id(client)
+
+    moved = dict(rows[0], latitude=48.86, weight=12.5)
+    response = client.post("/bins/bulk", json=[
+        moved,
+        rows[2],
+        dict(rows[3], latitude=95.0),
+        {"bin_id": "x", "weight": 1.0},
+        "not a bin",
+        dict(rows[2], weight=1.0),
+        dict(rows[3], bin_id="negative", weight=-1.0),
+        dict(rows[3], bin_id="half", presence=2)
+    ])
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["updated"]) == (1, 1)
+    errors = {error["index"]: error for error in result["errors"]}
+    assert sorted(errors) == [2, 3, 4, 5, 6, 7]
+    assert errors[2] == {"index": 2, "bin_id": "s3", "error": "coordinates out of range"}
+    assert errors[3]["bin_id"] == "x" and "presence" in errors[3]["error"] and "latitude" in errors[3]["error"]
+    assert errors[4]["bin_id"] is None
+    assert errors[5] == {"index": 5, "bin_id": "s2", "error": "duplicate bin_id in request"}
+    assert errors[6]["error"] == "weight must not be negative"
+    assert errors[7]["error"] == "presence must be 0 or 1"
+
+    after = by_bin_id(client)
+    assert sorted(after) == ["s0", "s1", "s2"]
+    # Updated by bin_id: same id, new values; the first occurrence of a duplicate wins
+    assert after["s0"]["id"] == before["s0"]["id"]
+    assert (after["s0"]["latitude"], after["s0"]["weight"]) == (48.86, 12.5)
+    assert after["s1"] == before["s1"] and after["s2"]["weight"] == rows[2]["weight"]
+    assert table_rows() == 3
+
+
+def test_replace_is_all_or_nothing(client, bin_rows):
+    rows = bin_rows(5)
+    client.put("/bins/", json=rows)
+    before = by_bin_id(client)
+
+    response = client.put("/bins/", json=rows[:2] + [dict(rows[2], longitude=200.0)])
+    assert response.status_code == 422
+    assert response.json()["detail"]["errors"] == [{"index": 2, "bin_id": "s2", "error": "coordinates out of range"}]
+    assert by_bin_id(client) == before
+
+    new = bin_rows(1, seed=1, prefix="n")
+    response = client.put("/bins/", json=[dict(rows[0], weight=99.0), rows[1]] + new)
+    assert response.json() == {"inserted": 1, "updated": 2, "deleted": 3, "errors": []}
+    after = by_bin_id(client)
+    assert sorted(after) == ["n0", "s0", "s1"]
+    # Kept bins keep their id
+    assert after["s0"]["id"] == before["s0"]["id"] and after["s0"]["weight"] == 99.0
+    assert table_rows() == 3
+
+
+def test_delete_by_filters(client, bin_rows):
+    rows = bin_rows(6)
+    for k, row in enumerate(rows):
+        row.update(weight=10.0 * (k + 1), presence=k % 2)
+    client.put("/bins/", json=rows)
+    ids = {bin_id: b["id"] for bin_id, b in by_bin_id(client).items()}
+
+    assert client.delete("/bins/").status_code == 400
+    # Every filter must match: present bins of 30 kg and over
+    assert client.delete("/bins/", params={"presence": 1, "min_weight": 30}).json() == {"deleted": 2}
+    assert sorted(by_bin_id(client)) == ["s0", "s1", "s2", "s4"]
+    assert client.delete("/bins/", params={"ids": [ids["s0"], ids["s3"]], "max_weight": 20}).json() == {"deleted": 1}
+    assert sorted(by_bin_id(client)) == ["s1", "s2", "s4"]
+    assert client.delete("/bins/", params={"all": True}).json() == {"deleted": 3}
+    assert client.get("/bins/").json() == [] and table_rows() == 0
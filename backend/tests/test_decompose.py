@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from app.distances import DEPOT_ID, DistanceMatrix
+from app.routers.simulations import optimize_routes
+from app.solver.decompose import KMEANS_SLACK, allocate_trucks, kmeans_clusters, solve_decomposed, sweep_clusters
+from app.solver.local_search import improve_routes
+from app.solver.parallel import route_cost
+
+
+def loads(demands, clusters):
+    return [float(np.sum(demands[cluster])) for cluster in clusters]
+
+
+@pytest.mark.parametrize("k", [2, 3, 5])
+def test_sweep_clusters_share_demand_evenly(make_problem, k):
+    _, demands, customers, latitudes, longitudes = make_problem(120, seed=1)
+    clusters = sweep_clusters(latitudes, longitudes, demands, customers, 0, k)
+    assert len(clusters) == k and sorted(c for cluster in clusters for c in cluster) == customers
+    # Cut at every multiple of the share: off by less than one bin
+    share = demands.sum() / k
+    for load in loads(demands, clusters):
+        assert abs(load - share) < demands.max()
+
+
+@pytest.mark.parametrize("k", [2, 3, 5])
+def test_kmeans_clusters_stay_within_their_share(make_problem, k):
+    _, demands, customers, latitudes, longitudes = make_problem(120, seed=1)
+    clusters = kmeans_clusters(latitudes, longitudes, demands, customers, 0, k)
+    assert len(clusters) == k and sorted(c for cluster in clusters for c in cluster) == customers
+    assert max(loads(demands, clusters)) <= demands.sum() / k * (1 + KMEANS_SLACK)
+
+
+@pytest.mark.parametrize("clustering", [sweep_clusters, kmeans_clusters])
+def test_clusters_follow_natural_groups(clustering):
+    # Two groups of 20 bins, west and east of the depot
+    rng = np.random.default_rng(4)
+    offsets = np.concatenate([np.full(20, -0.04), np.full(20, 0.04)]) + rng.uniform(-0.005, 0.005, 40)
+    latitudes = np.concatenate([[48.8566], 48.8566 + rng.uniform(-0.005, 0.005, 40)])
+    longitudes = np.concatenate([[2.3522], 2.3522 + offsets])
+    demands = np.concatenate([[0.0], np.full(40, 50.0)])
+    clusters = clustering(latitudes, longitudes, demands, list(range(1, 41)), 0, 2)
+    assert sorted(map(sorted, clusters)) == [list(range(1, 21)), list(range(21, 41))]
+
+
+def test_trucks_follow_the_demand_share():
+    demands = np.array([0.0, 50.0, 30.0, 20.0])
+    assert allocate_trucks(demands, [[1], [2], [3]], 7) == [4, 2, 1]
+    assert allocate_trucks(demands, [[1], [2], [3]], 10) == [5, 3, 2]
+    # Every cluster keeps a truck, however small its demand
+    demands = np.array([0.0, 97.0, 1.0, 1.0, 1.0])
+    assert allocate_trucks(demands, [[1], [2], [3], [4]], 4) == [1, 1, 1, 1]
+    assert allocate_trucks(demands, [[1], [2], [3], [4]], 6) == [3, 1, 1, 1]
+
+
+def test_decomposed_solve_is_valid(make_problem, assert_valid):
+    matrix, demands, customers, latitudes, longitudes = make_problem(120, seed=1)
+    for method in ("sweep", "kmeans"):
+        reported = []
+        routes, unserved, stats = solve_decomposed(matrix, demands, customers, 12, 400.0, latitudes, longitudes,
+                                                   method=method, seed=1, cluster_size=40,
+                                                   on_improve=lambda cost, routes: reported.append(cost))
+        assert_valid(routes, unserved, customers, demands, 400.0, max_trucks=12)
+        assert stats['clusters'] == 3
+        # The boundary repair starts from the merged cluster routes and never worsens them
+        assert reported[0] == stats['initial_cost']
+        assert stats['final_cost'] == pytest.approx(route_cost(matrix, routes), rel=1e-6)
+        assert stats['final_cost'] <= stats['initial_cost']
+
+
+def test_zero_budget_keeps_local_search_stats(make_problem, assert_valid):
+    matrix, demands, customers, latitudes, longitudes = make_problem(60, seed=2)
+    routes, unserved, stats = solve_decomposed(matrix, demands, customers, 8, 400.0, latitudes, longitudes,
+                                               time_limit=0, seed=2, cluster_size=20)
+    assert_valid(routes, unserved, customers, demands, 400.0, max_trucks=8)
+    _, full = improve_routes(matrix, routes, demands, 400.0, time_limit=0)
+    assert set(full) <= set(stats)
+    assert stats['initial_cost'] == stats['final_cost']
+
+
+def test_zero_budget_decomposed_simulation(make_problem):
+    matrix, demands, customers, latitudes, longitudes = make_problem(40, seed=3)
+    ids = [DEPOT_ID] + [100 + c for c in customers]
+    distances = DistanceMatrix(ids, matrix.distances, matrix.durations)
+    bins_data = [
+        {'id': 100 + c, 'bin_id': f"B{c}", 'weight': float(demands[c]), 'latitude': latitudes[c],
+         'longitude': longitudes[c]}
+        for c in customers
+    ]
+    routes, unserved, stats = optimize_routes(bins_data, 6, 400.0, distances, time_limit=0, seed=3,
+                                              decomposition="sweep")
+    served = [b['id'] for route in routes for b in route] + [b['id'] for b in unserved]
+    assert sorted(served) == sorted(b['id'] for b in bins_data)
+    assert 'initial_cost' in stats and 'moves' in stats
@@ -0,0 +1,30 @@
+import numpy as np
+from sqlalchemy import event
+
+from app import distance_cache
+from app.database import SessionLocal
+from app.distance_cache import load_cached_distances, store_distances
+from app.distances import build_distance_matrix
+
+
+def test_store_commits_chunk_by_chunk(make_bins, monkeypatch):
+    ids = make_bins(*(f"b{k}" for k in range(10)))
+    rng = np.random.default_rng(0)
+    latitudes, longitudes = 48.85 + rng.uniform(0, 0.05, 10), 2.35 + rng.uniform(0, 0.05, 10)
+    matrix = build_distance_matrix(ids, latitudes, longitudes)
+    cells = rng.random((10, 10)) < 0.6
+    monkeypatch.setattr(distance_cache, "STORE_CHUNK", 7)
+
+    db = SessionLocal()
+    commits = []
+    event.listen(db, "after_commit", lambda session: commits.append(1))
+    try:
+        assert store_distances(db, matrix, cells, True) == cells.sum()
+        fresh = build_distance_matrix(ids, latitudes + 1, longitudes)
+        known = load_cached_distances(db, fresh)
+    finally:
+        db.close()
+    # Blocks of 7 // 10 -> 1 row, each stored in chunks of at most 7 pairs
+    assert len(commits) == sum(-(-int(row.sum()) // 7) for row in cells)
+    np.testing.assert_array_equal(known, cells | np.eye(10, dtype=bool))
+    np.testing.assert_array_equal(fresh.distances[cells], matrix.distances[cells])
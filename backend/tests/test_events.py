@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+from app.jobs import simulation_queue
+
+RUN = {"name": "run", "max_trucks": 3, "max_capacity": 400.0, "bins_to_collect": 0, "time_limit": 0.2, "seed": 1}
+
+
+def read_events(response):
+    """(event, data) pairs of a server-sent events body"""
+    events = []
+    for block in response.text.split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_progress_then_final_status(client, bin_rows, held_solver):
+    started, release = held_solver
+    client.put("/bins/", json=bin_rows(15))
+    created = client.post("/simulations/", json=RUN).json()
+    assert started.wait(10)
+
+    def release_once_subscribed():
+        deadline = time.monotonic() + 10
+        while simulation_queue.stats()["subscribers"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+    threading.Thread(target=release_once_subscribed).start()
+
+    # The body ends with the final status event
+    response = client.get(f"/simulations/{created['id']}/events")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/event-stream")
+    events = read_events(response)
+
+    # A late subscriber starts from the current phase
+    assert events[0] == ("phase", {"phase": "construction", "percent": 10})
+    phases = [data for event, data in events if event == "phase"]
+    assert phases[-1] == {"phase": "persistence", "percent": 90}
+    percents = [data["percent"] for data in phases]
+    assert percents == sorted(percents)
+    bin_ids = sorted(b["id"] for b in client.get("/bins/").json())
+    for event, data in events:
+        if event == "incumbent":
+            assert data["cost"] > 0 and sorted(b for route in data["routes"] for b in route) == bin_ids
+
+    event, data = events[-1]
+    assert event == "status" and [e for e, _ in events].count("status") == 1
+    assert data["status"] == "completed" and data == client.get(f"/simulations/{created['id']}").json()
+    assert simulation_queue.stats()["subscribers"] == 0
+
+
+def test_finished_simulation_sends_only_its_status(client, bin_rows):
+    client.put("/bins/", json=bin_rows(5))
+    created = client.post("/simulations/", json=dict(RUN, time_limit=0)).json()
+    deadline = time.monotonic() + 20
+    while client.get(f"/simulations/{created['id']}").json()["status"] != "completed" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    events = read_events(client.get(f"/simulations/{created['id']}/events"))
+    assert [(event, data["status"]) for event, data in events] == [("status", "completed")]
+    assert client.get("/simulations/999999/events").status_code == 404
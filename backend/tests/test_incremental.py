@@ -0,0 +1,85 @@
+import time
+
+from app.solver.incremental import patch_routes
+from app.solver.parallel import route_cost, solve_once
+
+
+def solved(make_problem, n, seed, max_trucks):
+    matrix, demands, customers, _, _ = make_problem(n, seed=seed)
+    routes, unserved, _ = solve_once(matrix, demands, customers, max_trucks, 400.0)
+    assert not unserved
+    return matrix, demands, customers, routes
+
+
+def test_patch_leaves_untouched_routes_alone(make_problem, assert_valid):
+    matrix, demands, customers, routes = solved(make_problem, 60, 1, 12)
+    removed = [routes[0][0], routes[1][-1]]
+    inserted = [routes[2][1]]
+    demands[inserted[0]] += 30.0
+    patched, unserved, stats = patch_routes(matrix, routes, demands, 12, 400.0, removed=removed, inserted=inserted,
+                                            time_limit=0)
+    remaining = [c for c in customers if c not in removed]
+    assert_valid(patched, unserved, remaining, demands, 400.0, max_trucks=12)
+    assert stats['removed'] == 2 and stats['inserted'] == 1
+    # Without local search, routes without a changed bin come back as they were, at most gaining an inserted bin
+    changed = set(removed) | set(inserted)
+    for route in routes:
+        if set(route) & changed:
+            continue
+        (match,) = [p for p in patched if route[0] in p]
+        assert [c for c in match if c not in changed] == route
+    assert 'moves' not in stats
+
+
+def test_moved_bin_goes_to_its_cheapest_place(make_problem):
+    matrix, demands, customers, routes = solved(make_problem, 60, 4, 12)
+    cost = route_cost(matrix, routes)
+    for route in routes[:4]:
+        # Put back at its cheapest position: never further than where it was
+        patched, unserved, _ = patch_routes(matrix, routes, demands, 12, 400.0, inserted=[route[-1]], time_limit=0)
+        assert not unserved and route_cost(matrix, patched) <= cost + 1e-6
+
+
+def test_patch_displaces_bins_of_overloaded_routes(make_problem, assert_valid):
+    matrix, demands, customers, routes = solved(make_problem, 60, 2, 12)
+    fullest = max(routes, key=lambda route: sum(demands[c] for c in route))
+    assert len(fullest) > 1
+    # A bin filling up pushes its route over capacity
+    demands[fullest[0]] = 400.0
+    patched, unserved, stats = patch_routes(matrix, routes, demands, 12, 400.0)
+    assert_valid(patched, unserved, customers, demands, 400.0, max_trucks=12)
+    assert stats['displaced'] >= 1
+
+
+def test_patch_local_search_never_worsens(make_problem, assert_valid):
+    matrix, demands, customers, routes = solved(make_problem, 80, 3, 14)
+    removed = customers[::9]
+    inserted = [c for c in customers[1::13] if c not in removed]
+    patched, unserved, stats = patch_routes(matrix, routes, demands, 14, 400.0, removed=removed, inserted=inserted)
+    remaining = [c for c in customers if c not in removed]
+    assert_valid(patched, unserved, remaining, demands, 400.0, max_trucks=14)
+    assert not unserved
+    assert stats['final_cost'] <= stats['initial_cost']
+
+
+def test_reoptimize_applies_the_bin_delta(client, bin_rows):
+    client.put("/bins/", json=bin_rows(12))
+    created = client.post("/simulations/", json={"name": "rounds", "max_trucks": 4, "max_capacity": 400.0,
+                                                  "bins_to_collect": 0, "time_limit": 0, "seed": 1}).json()
+    deadline = time.monotonic() + 20
+    while client.get(f"/simulations/{created['id']}").json()["status"] != "completed" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stops = client.get(f"/simulations/{created['id']}/routes").json()
+    deleted, absent, dropped = (stop["bin_id"] for stop in stops[:3])
+    client.delete(f"/bins/{deleted}")
+    client.patch(f"/bins/{absent}/presence", json={"presence": 0})
+    new = client.post("/bins/", json=bin_rows(1, seed=1, prefix="n")[0]).json()["id"]
+
+    response = client.post(f"/simulations/{created['id']}/reoptimize", json={"removed": [dropped], "time_limit": 0})
+    assert response.status_code == 200
+    version = response.json()
+    assert (version["parent_id"], version["version"], version["status"]) == (created["id"], 2, "completed")
+    assert version["unserved_bins"] == 0
+    routed = sorted(stop["bin_id"] for stop in client.get(f"/simulations/{version['id']}/routes").json())
+    assert routed == sorted({stop["bin_id"] for stop in stops} - {deleted, absent, dropped} | {new})
+    assert client.post("/simulations/999999/reoptimize", json={}).status_code == 404
@@ -0,0 +1,88 @@
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.main import app
+from app.models import Simulation
+
+RUN = {"name": "run", "max_trucks": 3, "max_capacity": 400.0, "bins_to_collect": 0, "time_limit": 0, "seed": 1}
+
+
+def wait_for(client, simulation_id, *statuses, timeout=20):
+    deadline = time.monotonic() + timeout
+    while True:
+        simulation = client.get(f"/simulations/{simulation_id}").json()
+        if simulation["status"] in statuses or time.monotonic() > deadline:
+            return simulation
+        time.sleep(0.05)
+
+
+def routed_bins(client, simulation_id):
+    return sorted(stop["bin_id"] for stop in client.get(f"/simulations/{simulation_id}/routes").json())
+
+
+def test_simulation_goes_pending_running_completed(client, bin_rows, held_solver):
+    started, release = held_solver
+    assert client.put("/bins/", json=bin_rows(12)).status_code == 200
+    created = client.post("/simulations/", json=RUN).json()
+    assert created["status"] == "pending" and created["total_distance"] is None
+
+    assert started.wait(10)
+    assert client.get(f"/simulations/{created['id']}").json()["status"] == "running"
+    assert client.get("/debug/jobs").json()["running"] == [created["id"]]
+    release.set()
+
+    simulation = wait_for(client, created["id"], "completed", "failed")
+    assert simulation["status"] == "completed" and simulation["error"] is None
+    assert simulation["total_distance"] > 0 and simulation["unserved_bins"] == 0
+    assert routed_bins(client, created["id"]) == sorted(b["id"] for b in client.get("/bins/").json())
+    assert client.get("/debug/jobs").json()["running"] == []
+    # Finished: nothing left to cancel
+    assert client.post(f"/simulations/{created['id']}/cancel").status_code == 409
+
+
+def test_cancelled_simulation_drops_its_results(client, bin_rows, held_solver):
+    started, release = held_solver
+    client.put("/bins/", json=bin_rows(12))
+    created = client.post("/simulations/", json=RUN).json()
+    assert started.wait(10)
+
+    cancelled = client.post(f"/simulations/{created['id']}/cancel")
+    assert cancelled.status_code == 200 and cancelled.json()["status"] == "cancelled"
+    assert client.post(f"/simulations/{created['id']}/cancel").status_code == 409
+    release.set()
+
+    deadline = time.monotonic() + 10
+    while client.get("/debug/jobs").json()["running"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.get("/debug/jobs").json()["running"] == []
+    simulation = client.get(f"/simulations/{created['id']}").json()
+    assert simulation["status"] == "cancelled" and simulation["total_distance"] is None
+    assert routed_bins(client, created["id"]) == []
+    assert client.post("/simulations/999999/cancel").status_code == 404
+
+
+def test_interrupted_simulations_are_recovered(make_bins, bin_rows):
+    make_bins()
+    with TestClient(app) as client:
+        client.put("/bins/", json=bin_rows(8))
+    # Left behind by a process that stopped mid-run
+    db = SessionLocal()
+    try:
+        interrupted = [
+            Simulation(name=f"interrupted {status}", max_trucks=2, max_capacity=400.0, bins_to_collect=0,
+                       parameters=json.dumps({"time_limit": 0, "seed": 1}), status=status)
+            for status in ("running", "pending")
+        ]
+        db.add_all(interrupted)
+        db.commit()
+        ids = [simulation.id for simulation in interrupted]
+    finally:
+        db.close()
+
+    with TestClient(app) as client:
+        for simulation_id in ids:
+            assert wait_for(client, simulation_id, "completed", "failed")["status"] == "completed"
+            assert len(routed_bins(client, simulation_id)) == 8
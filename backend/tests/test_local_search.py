@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from app.distances import build_distance_matrix
+from app.solver.local_search import improve_routes
+from app.solver.parallel import route_cost
+
+
+def circle(n, radius=0.01):
+    """Depot at the centre of n bins on a circle, numbered around it"""
+    angles = 2 * np.pi * np.arange(n) / n
+    latitudes = np.concatenate([[48.8566], 48.8566 + radius * np.sin(angles)])
+    longitudes = np.concatenate([[2.3522], 2.3522 + radius * np.cos(angles) / np.cos(np.radians(48.8566))])
+    return build_distance_matrix(range(n + 1), latitudes, longitudes), latitudes, longitudes
+
+
+def crossings(route, latitudes, longitudes):
+    """Pairs of legs of a closed route (through the depot) that cross"""
+    points = [(longitudes[c], latitudes[c]) for c in [0] + route + [0]]
+    legs = list(zip(points, points[1:]))
+
+    def side(a, b, c):
+        return np.sign((b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0]))
+    return [(i, j) for i in range(len(legs)) for j in range(i + 2, len(legs))
+            if (i, j) != (0, len(legs) - 1)
+            and side(*legs[i], legs[j][0]) != side(*legs[i], legs[j][1])
+            and side(*legs[j], legs[i][0]) != side(*legs[j], legs[i][1])]
+
+
+def test_two_opt_removes_a_crossing():
+    matrix, latitudes, longitudes = circle(16)
+    # Around the circle with bins 5-10 reversed: the legs 4-10 and 5-11 cross
+    route = [1, 2, 3, 4, 10, 9, 8, 7, 6, 5, 11, 12, 13, 14, 15, 16]
+    assert crossings(route, latitudes, longitudes)
+    demands = np.concatenate([[0.0], np.full(16, 10.0)])
+    (improved,), stats = improve_routes(matrix, [route], demands, 400.0)
+    assert stats['moves']['2-opt'] >= 1
+    assert crossings(improved, latitudes, longitudes) == []
+    assert stats['final_cost'] == pytest.approx(route_cost(matrix, [list(range(1, 17))]), rel=1e-4)
+
+
+def test_or_opt_moves_a_misplaced_bin_back():
+    matrix, _, _ = circle(16)
+    route = [1, 2, 3, 9, 4, 5, 6, 7, 8, 10, 11, 12, 13, 14, 15, 16]
+    demands = np.concatenate([[0.0], np.full(16, 10.0)])
+    (improved,), stats = improve_routes(matrix, [route], demands, 400.0)
+    assert stats['moves']['or-opt'] >= 1
+    # Around the circle, from any bin: every depot leg has the same length
+    assert all((a - b) % 16 in (1, 15) for a, b in zip(improved, improved[1:]))
+
+
+def test_full_trucks_swap_instead_of_relocating():
+    matrix, _, _ = circle(8)
+    demands = np.concatenate([[0.0], np.full(8, 10.0)])
+    # Bins 4 and 5 ride with each other's neighbours, in full trucks: relocating either overloads one
+    improved, stats = improve_routes(matrix, [[1, 2, 3, 5], [4, 6, 7, 8]], demands, 40.0)
+    assert sorted(map(sorted, improved)) == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert stats['moves']['relocate'] == 0 and stats['moves']['swap'] >= 1
+
+
+def test_local_search_improves_scrambled_routes(make_problem, assert_valid):
+    matrix, demands, customers, _, _ = make_problem(60, seed=2)
+    # Bins in id order, five per truck: far from any local optimum
+    routes = [customers[i:i + 5] for i in range(0, len(customers), 5)]
+    improved, stats = improve_routes(matrix, routes, demands, 400.0, seed=3)
+    assert_valid(improved, [], customers, demands, 400.0)
+    assert stats['final_cost'] < stats['initial_cost']
+    assert sum(stats['moves'].values()) > 0
+    assert improve_routes(matrix, routes, demands, 400.0, seed=3)[0] == improved
+
+
+def test_zero_time_limit_keeps_routes(make_problem):
+    matrix, demands, customers, _, _ = make_problem(30, seed=4)
+    routes = [customers[:15], customers[15:]]
+    improved, stats = improve_routes(matrix, routes, demands, 1000.0, time_limit=0)
+    assert improved == routes and stats['timed_out']
+    assert stats['final_cost'] == stats['initial_cost']
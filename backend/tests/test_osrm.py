@@ -0,0 +1,235 @@
+import asyncio
+import time
+
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.distances import estimate_duration, haversine_block
+from app.osrm import RoutingClient, TokenBucket, table_edges, table_matrix
+
+
+def road_distance(a, b):
+    """Stand-in road distance between two (lon, lat) points"""
+    return abs(a[0] - b[0]) * 70000 + abs(a[1] - b[1]) * 111000
+
+
+class FakeOSRM:
+    """Local /table/v1 stand-in: records requests, fails or leaves cells unroutable on demand"""
+
+    def __init__(self, unroutable=(), failing=(), delay=0.01, errors=()):
+        # (lat, lon) pairs answered with null, source points whose requests fail,
+        # and HTTP statuses answered to the first requests, in order
+        self.unroutable = set(unroutable)
+        self.failing = set(failing)
+        self.errors = list(errors)
+        self.delay = delay
+        self.requests = []
+
+    async def table(self, request):
+        coordinates = [tuple(map(float, c.split(","))) for c in request.match_info["coordinates"].split(";")]
+        sources = [int(i) for i in request.query["sources"].split(";")]
+        destinations = [int(i) for i in request.query["destinations"].split(";")]
+        self.requests.append((len(coordinates), len(sources), len(destinations)))
+        if self.errors:
+            return web.Response(status=self.errors.pop(0))
+        # Slow enough for concurrent callers to overlap
+        await asyncio.sleep(self.delay)
+        if any((coordinates[i][1], coordinates[i][0]) in self.failing for i in sources):
+            return web.Response(status=503)
+        distances = [
+            [None if ((coordinates[i][1], coordinates[i][0]), (coordinates[j][1], coordinates[j][0])) in self.unroutable
+             else road_distance(coordinates[i], coordinates[j]) for j in destinations]
+            for i in sources
+        ]
+        durations = [[None if d is None else d / 10 for d in row] for row in distances]
+        return web.json_response({"code": "Ok", "distances": distances, "durations": durations})
+
+    def run(self, call, **options):
+        """Run call(client) against the server with a fresh routing client, options overriding its limits"""
+        async def main():
+            app = web.Application()
+            app.router.add_get("/table/v1/driving/{coordinates}", self.table)
+            async with TestServer(app) as server:
+                options.setdefault("retries", 0)
+                options.setdefault("rate_limit", 0)
+                client = RoutingClient(base_url=str(server.make_url("")).rstrip("/"), **options)
+                async with client:
+                    return await call(client)
+        return asyncio.run(main())
+
+
+def points(n, seed):
+    rng = np.random.default_rng(seed)
+    return [(48.85 + lat, 2.35 + lon) for lat, lon in rng.uniform(0, 0.05, (n, 2)).tolist()]
+
+
+def expected(sources, destinations):
+    return np.array([[road_distance(s[::-1], d[::-1]) for d in destinations] for s in sources], dtype=np.float32)
+
+
+def test_table_matrix_chunks_and_merges():
+    sources, destinations = points(7, 1), points(9, 2)
+    osrm = FakeOSRM()
+    distances, durations, answered = osrm.run(lambda client: table_matrix(client, sources, destinations,
+                                                                          max_coordinates=6))
+    # 3 x 3 chunks of at most 3 sources and 3 destinations
+    assert len(osrm.requests) == 9
+    assert all(coordinates <= 6 for coordinates, _, _ in osrm.requests)
+    assert answered.all()
+    np.testing.assert_allclose(distances, expected(sources, destinations), rtol=1e-5)
+    np.testing.assert_allclose(durations, expected(sources, destinations) / 10, rtol=1e-5)
+
+
+def test_table_matrix_falls_back_per_cell():
+    sources, destinations = points(5, 3), points(6, 4)
+    osrm = FakeOSRM(unroutable=[(sources[0], destinations[1])], failing=[sources[4]])
+    distances, durations, answered = osrm.run(lambda client: table_matrix(client, sources, destinations,
+                                                                          max_coordinates=4))
+    estimates = haversine_block([p[0] for p in sources], [p[1] for p in sources],
+                                [p[0] for p in destinations], [p[1] for p in destinations])
+    routed = expected(sources, destinations)
+    # Unroutable cell: answered, keeps its estimate
+    assert answered[0, 1] and distances[0, 1] == estimates[0, 1]
+    assert durations[0, 1] == estimate_duration(estimates[0, 1])
+    # Failed request (the chunk of source 4): estimates, not answered
+    assert not answered[4].any()
+    np.testing.assert_array_equal(distances[4], estimates[4])
+    # Everything else routed, across chunk borders
+    rest = answered.copy()
+    rest[0, 1] = False
+    np.testing.assert_allclose(distances[rest], routed[rest], rtol=1e-5)
+    assert rest.sum() == 4 * 6 - 1
+
+
+def test_table_edges_groups_and_falls_back():
+    pts = points(12, 5)
+    rows = np.repeat(np.arange(12), 3)
+    cols = (rows + np.tile([1, 2, 5], 12)) % 12
+    osrm = FakeOSRM(failing=[pts[11]])
+    distances, durations, answered = osrm.run(lambda client: table_edges(client, pts, rows, cols, max_coordinates=8))
+    assert all(coordinates <= 8 for coordinates, _, _ in osrm.requests)
+    routed = np.array([road_distance(pts[a][::-1], pts[b][::-1]) for a, b in zip(rows, cols)], dtype=np.float32)
+    estimates = np.array([haversine_block([pts[a][0]], [pts[a][1]], [pts[b][0]], [pts[b][1]])[0, 0]
+                          for a, b in zip(rows, cols)], dtype=np.float32)
+    # A failed request loses every edge it carried, the other groups are routed
+    assert not answered[rows == 11].any() and answered[rows < 8].all()
+    np.testing.assert_allclose(distances[answered], routed[answered], rtol=1e-5)
+    np.testing.assert_allclose(distances[~answered], estimates[~answered], rtol=1e-5)
+    np.testing.assert_allclose(durations[answered], routed[answered] / 10, rtol=1e-5)
+
+
+def test_concurrent_tables_share_common_pairs():
+    pts = points(9, 6)
+    first, second = pts[:6], pts[3:]
+
+    async def both(client):
+        return await asyncio.gather(table_matrix(client, first, first, max_coordinates=8),
+                                    table_matrix(client, second, second, max_coordinates=8)), client.stats()
+
+    osrm = FakeOSRM()
+    ((first_distances, _, first_answered), (second_distances, _, second_answered)), stats = osrm.run(both)
+    # The 3 x 3 pairs of the common points are routed once
+    assert sum(sources * destinations for _, sources, destinations in osrm.requests) == 36 + 36 - 9
+    assert stats['coalesced'] == 9 and stats['inflight_rows'] == 0
+    assert first_answered.all() and second_answered.all()
+    np.testing.assert_allclose(first_distances, expected(first, first), rtol=1e-5)
+    np.testing.assert_allclose(second_distances, expected(second, second), rtol=1e-5)
+
+
+def test_waiters_refetch_pairs_of_a_cancelled_caller():
+    pts = points(6, 7)
+
+    async def cancel_owner(client):
+        owner = asyncio.create_task(table_matrix(client, pts, pts))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(table_matrix(client, pts, pts))
+        await asyncio.sleep(0.05)
+        owner.cancel()
+        return await waiter, client.stats()
+
+    osrm = FakeOSRM(delay=0.2)
+    (distances, _, answered), stats = osrm.run(cancel_owner)
+    # The waiter routes the pairs itself instead of keeping the estimates
+    assert len(osrm.requests) == 2
+    assert answered.all() and stats['coalesced'] == 0 and stats['inflight_rows'] == 0
+    np.testing.assert_allclose(distances, expected(pts, pts), rtol=1e-5)
+
+
+def with_stats(call):
+    async def run(client):
+        return await call(client), client.stats()
+    return run
+
+
+def test_transient_errors_are_retried():
+    sources, destinations = points(3, 8), points(4, 9)
+    osrm = FakeOSRM(errors=[429, 503])
+    (distances, _, answered), stats = osrm.run(with_stats(lambda client: table_matrix(client, sources, destinations)),
+                                               retries=2, backoff=0)
+    assert len(osrm.requests) == 3
+    assert stats['retries'] == 2 and stats['failures'] == 0 and stats['fallbacks'] == 0
+    assert answered.all()
+    np.testing.assert_allclose(distances, expected(sources, destinations), rtol=1e-5)
+
+
+def test_exhausted_retries_fall_back_to_estimates():
+    sources, destinations = points(3, 10), points(4, 11)
+    estimates = haversine_block([p[0] for p in sources], [p[1] for p in sources],
+                                [p[0] for p in destinations], [p[1] for p in destinations])
+    osrm = FakeOSRM(errors=[500, 502, 504])
+    (distances, durations, answered), stats = osrm.run(
+        with_stats(lambda client: table_matrix(client, sources, destinations)), retries=2, backoff=0
+    )
+    assert len(osrm.requests) == 3
+    assert stats['retries'] == 2 and stats['failures'] == 1 and stats['fallbacks'] == 1
+    assert not answered.any()
+    np.testing.assert_array_equal(distances, estimates)
+    np.testing.assert_array_equal(durations, estimate_duration(estimates))
+
+
+def test_client_errors_are_not_retried():
+    osrm = FakeOSRM(errors=[400])
+    (_, _, answered), stats = osrm.run(with_stats(lambda client: table_matrix(client, points(2, 12), points(2, 13))),
+                                       retries=3, backoff=0)
+    assert len(osrm.requests) == 1 and stats['retries'] == 0 and stats['failures'] == 1
+    assert not answered.any()
+
+
+def test_token_bucket_limits_the_rate():
+    async def acquire(bucket, times):
+        started = time.monotonic()
+        for _ in range(times):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # The burst is free, then one token every 1 / rate seconds
+    assert asyncio.run(acquire(TokenBucket(20, capacity=5), 5)) < 0.05
+    assert asyncio.run(acquire(TokenBucket(20, capacity=1), 6)) >= 5 / 20 - 0.01
+
+
+def test_client_requests_respect_the_rate_limit():
+    sources = points(8, 14)
+    osrm = FakeOSRM(delay=0)
+    started = time.monotonic()
+    # 4 x 4 chunks of 2 sources and 2 destinations: a burst of 10, then 10 per second
+    _, _, answered = osrm.run(lambda client: table_matrix(client, sources, sources, max_coordinates=4),
+                              rate_limit=10)
+    assert len(osrm.requests) == 16 and answered.all()
+    assert time.monotonic() - started >= 6 / 10 - 0.01
+
+
+def test_chunk_boundaries():
+    sources, destinations = points(7, 15), points(4, 16)
+    osrm = FakeOSRM()
+    distances, _, answered = osrm.run(lambda client: table_matrix(client, sources, destinations, max_coordinates=7))
+    # Chunks of 7 // 2 = 3 points: sources 3 + 3 + 1, destinations 3 + 1
+    assert sorted(request[1:] for request in osrm.requests) == sorted(
+        (rows, cols) for rows in (3, 3, 1) for cols in (3, 1)
+    )
+    assert answered.all()
+    np.testing.assert_allclose(distances, expected(sources, destinations), rtol=1e-5)
+    # A single coordinate per request still routes one pair at a time
+    osrm = FakeOSRM(delay=0)
+    _, _, answered = osrm.run(lambda client: table_matrix(client, sources[:2], destinations[:3], max_coordinates=1))
+    assert len(osrm.requests) == 6 and all(request == (2, 1, 1) for request in osrm.requests) and answered.all()
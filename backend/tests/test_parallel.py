@@ -0,0 +1,43 @@
+from app.solver.parallel import multi_start, route_cost, solve_once
+
+
+def starts_in_process(matrix, demands, customers, max_trucks, max_capacity, starts, seed):
+    """(unserved, cost, start) of each start, solved one after the other in this process"""
+    results = []
+    for start in range(starts):
+        routes, unserved, stats = solve_once(matrix, demands, customers, max_trucks, max_capacity,
+                                             seed=seed + start, perturb=start > 0)
+        results.append(((len(unserved), stats['final_cost'], start), routes))
+    return results
+
+
+def test_multi_start_keeps_the_best_start(make_problem):
+    matrix, demands, customers, _, _ = make_problem(80, seed=1)
+    routes, unserved, stats = multi_start(matrix, demands, customers, 10, 400.0, starts=4, seed=5)
+    assert stats['starts'] == 4
+
+    # The pool workers solve exactly what this process would, and the best one wins
+    results = starts_in_process(matrix, demands, customers, 10, 400.0, 4, 5)
+    (best_unserved, best_cost, best_start), best_routes = min(results)
+    assert stats['best_start'] == best_start and routes == best_routes
+    assert len(unserved) == best_unserved and route_cost(matrix, routes) == best_cost
+    # The perturbed starts really explore other solutions
+    assert len({str(routes) for _, routes in results}) > 1
+
+
+def test_same_seed_same_winner(make_problem):
+    matrix, demands, customers, _, _ = make_problem(60, seed=3)
+
+    def solve():
+        routes, unserved, stats = multi_start(matrix, demands, customers, 8, 400.0, starts=3, seed=11)
+        return routes, unserved, {key: value for key, value in stats.items() if key != 'elapsed'}
+    first = solve()
+    for _ in range(2):
+        assert solve() == first
+
+
+def test_single_start_runs_in_process(make_problem):
+    matrix, demands, customers, _, _ = make_problem(40, seed=2)
+    routes, unserved, stats = multi_start(matrix, demands, customers, 5, 400.0, starts=1, seed=5)
+    assert (routes, unserved) == solve_once(matrix, demands, customers, 5, 400.0)[:2]
+    assert 'starts' not in stats and stats['final_cost'] <= stats['initial_cost']
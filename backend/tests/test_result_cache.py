@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from app.bin_store import bin_store
+from app.database import SessionLocal
+from app.result_cache import ENTRY_OVERHEAD, CachedResult, ResultCache, result_cache, result_key
+from app.routers.bins import BinWeightUpdate, update_bin_weight
+
+PARAMETERS = {'max_trucks': 2, 'max_capacity': 100.0, 'bins_to_collect': 3}
+
+
+@pytest.fixture
+def store(make_bins):
+    ids = make_bins("a", "b", "c")
+    bin_store.invalidate()
+    result_cache.clear()
+    yield ids
+    bin_store.invalidate()
+    result_cache.clear()
+
+
+def result(bin_ids, stops=1):
+    rows = [(0, order, bin_ids[order % len(bin_ids)], 10.0, 1.0) for order in range(stops)]
+    return CachedResult(rows, bin_ids, 10.0 * stops, 1.0 * stops, 0, 0.0)
+
+
+def bins_data():
+    snapshot = bin_store.snapshot()
+    return snapshot.records(np.arange(len(snapshot)))
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", result([1]))
+    cache.put("b", result([2]))
+    assert cache.get("a") is not None
+    cache.put("c", result([3]))
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats() == {'entries': 2, 'bytes': 2 * result([1]).size, 'hits': 3, 'misses': 1, 'evictions': 1}
+
+
+def test_evicted_by_size():
+    small, large = result([1]), result([1, 2], stops=40)
+    cache = ResultCache(max_bytes=small.size + large.size)
+    cache.put("small", small)
+    cache.put("large", large)
+    assert cache.stats()['entries'] == 2
+    # A second large entry pushes the oldest ones out until it fits
+    cache.put("other", result([3], stops=40))
+    assert cache.get("small") is None and cache.get("large") is None and cache.get("other") is not None
+    assert cache.stats()['evictions'] == 2
+    # Larger than the whole cache: never stored
+    cache.put("huge", result([4], stops=(cache.max_bytes - ENTRY_OVERHEAD) // 40 + 1))
+    assert cache.get("huge") is None and cache.get("other") is not None
+
+
+def test_bin_writes_invalidate_their_results(store):
+    result_cache.put("first", result(store[:2]))
+    result_cache.put("second", result(store[2:]))
+    db = SessionLocal()
+    try:
+        update_bin_weight(store[1], BinWeightUpdate(weight=55.0), db)
+    finally:
+        db.close()
+    assert result_cache.get("first") is None
+    assert result_cache.get("second") is not None
+    assert result_cache.stats()['bytes'] == result(store[2:]).size
+
+
+def test_changed_bin_changes_the_key(store):
+    key = result_key(bins_data(), PARAMETERS)
+    assert result_key(bins_data(), PARAMETERS) == key
+    assert result_key(bins_data(), dict(PARAMETERS, max_trucks=3)) != key
+    db = SessionLocal()
+    try:
+        update_bin_weight(store[2], BinWeightUpdate(weight=55.0), db)
+        changed = result_key(bins_data(), PARAMETERS)
+        assert changed != key
+        # Back to the same bins, back to the same key
+        update_bin_weight(store[2], BinWeightUpdate(weight=0.0), db)
+    finally:
+        db.close()
+    assert result_key(bins_data(), PARAMETERS) == key
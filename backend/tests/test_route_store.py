@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from sqlalchemy import func, select
+
+from app import route_store
+from app.bin_store import bin_store
+from app.database import SessionLocal
+from app.models import PackedRoute, Route, Simulation
+from app.route_store import delete_routes, read_routes, trucks_used, write_routes
+from app.routers.simulations import get_simulation_routes
+
+NAN = float("nan")
+
+
+@pytest.fixture
+def db(make_bins):
+    ids = make_bins(*(f"b{k}" for k in range(6)))
+    bin_store.invalidate()
+    db = SessionLocal()
+    db.query(Route).delete()
+    db.query(PackedRoute).delete()
+    db.query(Simulation).delete()
+    db.add_all([Simulation(id=k, name=f"s{k}", max_trucks=3, max_capacity=100.0, bins_to_collect=6) for k in (1, 2)])
+    db.commit()
+    db.ids = ids
+    yield db
+    db.close()
+    bin_store.invalidate()
+
+
+def stops(ids):
+    # Written out of order, with a missing leg
+    return [
+        (1, 1, ids[3], 30.5, 3.0),
+        (0, 0, ids[0], 10.25, 1.0),
+        (1, 0, ids[2], 20.0, NAN),
+        (0, 1, ids[1], 12.0, 1.5),
+        (1, 2, ids[4], 41.0, 4.0)
+    ]
+
+
+def count(db, model, simulation_id):
+    return db.scalar(select(func.count()).select_from(model).where(model.simulation_id == simulation_id))
+
+
+def test_packed_round_trip(db, monkeypatch):
+    monkeypatch.setattr(route_store, "ROUTE_STORAGE", "packed")
+    write_routes(db, 1, stops(db.ids))
+    db.commit()
+    assert count(db, Route, 1) == 0 and count(db, PackedRoute, 1) == 2
+
+    # One row per truck, little-endian int64 bin ids and float32 legs in stop order
+    truck = db.execute(select(PackedRoute).where(PackedRoute.simulation_id == 1, PackedRoute.truck_id == 1)).scalar_one()
+    assert truck.stops == 3
+    assert truck.bin_ids == np.array([db.ids[2], db.ids[3], db.ids[4]], dtype="<i8").tobytes()
+    assert truck.distances == np.array([20.0, 30.5, 41.0], dtype="<f4").tobytes()
+    assert truck.durations == np.array([NAN, 3.0, 4.0], dtype="<f4").tobytes()
+
+    rows = read_routes(db, 1)
+    expected = np.array(sorted(stops(db.ids)), dtype=np.float64)
+    np.testing.assert_array_equal(rows, expected)
+    assert trucks_used(db, [1]) == {1: 2}
+
+    delete_routes(db, 1)
+    db.commit()
+    assert count(db, PackedRoute, 1) == 0 and read_routes(db, 1).shape == (0, 5)
+
+
+def test_mixed_storage_reads_as_one(db):
+    rows = stops(db.ids)
+    write_routes(db, 2, [row for row in rows if row[0] == 0], storage="rows")
+    write_routes(db, 2, [row for row in rows if row[0] == 1], storage="packed")
+    write_routes(db, 1, rows, storage="rows")
+    db.commit()
+    np.testing.assert_array_equal(read_routes(db, 2), read_routes(db, 1))
+    assert trucks_used(db, [1, 2]) == {1: 2, 2: 2}
+
+    delete_routes(db, 2)
+    db.commit()
+    assert count(db, Route, 2) == 0 and count(db, PackedRoute, 2) == 0
+    assert len(read_routes(db, 1)) == len(rows)
+
+
+def test_routes_response_from_packed_storage(db):
+    write_routes(db, 1, stops(db.ids), storage="packed")
+    db.commit()
+    response = [route.model_dump() for route in get_simulation_routes(1, db)]
+    assert [(r['truck_id'], r['bin_order'], r['bin_id']) for r in response] == [
+        (0, 0, db.ids[0]), (0, 1, db.ids[1]), (1, 0, db.ids[2]), (1, 1, db.ids[3]), (1, 2, db.ids[4])
+    ]
+    assert response[0] == {'truck_id': 0, 'bin_order': 0, 'bin_id': db.ids[0], 'longitude': 2.35, 'latitude': 48.85,
+                           'weight': 0.0, 'distance_to_next': 10.25, 'time_to_next': 1.0}
+    # A missing leg is null
+    assert response[2]['distance_to_next'] == 20.0 and response[2]['time_to_next'] is None
@@ -0,0 +1,28 @@
+from app.solver.parallel import route_cost
+from app.solver.savings import clarke_wright
+
+
+def test_savings_beat_one_route_per_bin(make_problem, assert_valid):
+    matrix, demands, customers, _, _ = make_problem(80, seed=1)
+    routes, unserved = clarke_wright(matrix, demands, customers, 80, 400.0)
+    assert_valid(routes, unserved, customers, demands, 400.0, max_trucks=80)
+    assert not unserved
+    # Every merge has a positive saving over the routes it starts from
+    assert route_cost(matrix, routes) < route_cost(matrix, [[c] for c in customers])
+    assert clarke_wright(matrix, demands, customers, 80, 400.0) == (routes, unserved)
+
+
+def test_small_fleet_reports_unserved(make_problem, assert_valid):
+    matrix, demands, customers, _, _ = make_problem(60, seed=2)
+    demands[5] = 500.0
+    routes, unserved = clarke_wright(matrix, demands, customers, 3, 400.0)
+    assert_valid(routes, unserved, customers, demands, 400.0, max_trucks=3)
+    assert 5 in unserved and len(routes) <= 3
+    assert sum(demands[c] for route in routes for c in route) > 3 * 400.0 * 0.8
+
+
+def test_noise_is_seeded(make_problem, assert_valid):
+    matrix, demands, customers, _, _ = make_problem(60, seed=3)
+    first = clarke_wright(matrix, demands, customers, 10, 400.0, noise=0.2, seed=7)
+    assert_valid(*first, customers, demands, 400.0, max_trucks=10)
+    assert clarke_wright(matrix, demands, customers, 10, 400.0, noise=0.2, seed=7) == first
@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+import pytest
+from sqlalchemy import select, text
+
+from app.bin_index import METERS_PER_DEGREE, BinLocator, create_spatial_index
+from app.database import SessionLocal, engine
+from app.models import Bin
+from app.routers.bins import delete_bin_ids, upsert_bins
+from app.spatial import GridIndex
+
+
+def scattered(n, seed):
+    """City-scale points with a few far outliers"""
+    rng = np.random.default_rng(seed)
+    latitudes = 48.85 + rng.normal(0, 0.02, n)
+    longitudes = 2.35 + rng.normal(0, 0.03, n)
+    latitudes[:3] += [0.5, -0.4, 0.0]
+    longitudes[:3] += [0.0, 0.3, -0.6]
+    return latitudes, longitudes
+
+
+def squared_distances(index, latitude, longitude):
+    x, y = index.project(np.array([latitude]), np.array([longitude]))
+    return (index.x - x[0]) ** 2 + (index.y - y[0]) ** 2
+
+
+def test_grid_queries_match_brute_force():
+    latitudes, longitudes = scattered(500, 1)
+    index = GridIndex(latitudes, longitudes)
+    rng = np.random.default_rng(2)
+    for latitude, longitude in zip(48.85 + rng.normal(0, 0.03, 20), 2.35 + rng.normal(0, 0.04, 20)):
+        squared = squared_distances(index, latitude, longitude)
+        np.testing.assert_array_equal(index.nearest(latitude, longitude, 7), np.argsort(squared, kind="stable")[:7])
+        for radius in (50.0, 800.0, 5000.0):
+            np.testing.assert_array_equal(np.sort(index.within_radius(latitude, longitude, radius)),
+                                          np.flatnonzero(squared <= radius * radius))
+    # Far from every point, and more neighbours than points
+    assert len(index.nearest(60.0, 10.0, 3)) == 3
+    assert sorted(GridIndex(latitudes[:4], longitudes[:4]).nearest(48.85, 2.35, 10).tolist()) == [0, 1, 2, 3]
+
+
+def test_knn_graph_matches_brute_force():
+    latitudes, longitudes = scattered(300, 3)
+    index = GridIndex(latitudes, longitudes)
+    graph = index.knn_graph(5)
+    for point in range(len(index)):
+        squared = squared_distances(index, latitudes[point], longitudes[point])
+        squared[point] = np.inf
+        assert graph[point].tolist() == np.argsort(squared, kind="stable")[:5].tolist()
+
+
+@pytest.fixture
+def indexed(make_bins):
+    make_bins()
+    if not create_spatial_index(engine):
+        pytest.skip("SQLite without the R*Tree module")
+    latitudes, longitudes = scattered(200, 4)
+    db = SessionLocal()
+    upsert_bins(db, [
+        {"bin_id": f"b{k}", "weight": 10.0, "presence": 1, "latitude": lat, "longitude": lon}
+        for k, (lat, lon) in enumerate(zip(latitudes.tolist(), longitudes.tolist()))
+    ])
+    db.commit()
+    locator = BinLocator()
+    locator.start(engine)
+    yield db, locator
+    db.close()
+
+
+def bins(db):
+    return {row.id: (row.latitude, row.longitude) for row in db.execute(select(Bin.id, Bin.latitude, Bin.longitude))}
+
+
+def query(db, locator, **area):
+    return sorted(db.execute(select(Bin.id).where(*locator.area_conditions(**area))).scalars())
+
+
+def brute_force(db, bbox=None, near=None, radius=None):
+    found = []
+    for bin_id, (latitude, longitude) in bins(db).items():
+        if bbox is not None:
+            west, south, east, north = bbox
+            if not (west <= longitude <= east and south <= latitude <= north):
+                continue
+        if near is not None:
+            dx = (longitude - near[1]) * METERS_PER_DEGREE * math.cos(math.radians(near[0]))
+            dy = (latitude - near[0]) * METERS_PER_DEGREE
+            if dx * dx + dy * dy > radius * radius:
+                continue
+        found.append(bin_id)
+    return sorted(found)
+
+
+def check_areas(db, locator):
+    # The R*Tree holds every bin, at its current position (float32 bounds)
+    indexed = {row.id: (row.min_lat, row.min_lon) for row in db.execute(text("SELECT id, min_lat, min_lon FROM bins_rtree"))}
+    current = bins(db)
+    assert set(indexed) == set(current)
+    for bin_id, (latitude, longitude) in current.items():
+        assert indexed[bin_id] == pytest.approx((latitude, longitude), abs=1e-5)
+    for area in ({"bbox": (2.33, 48.84, 2.37, 48.87)}, {"bbox": (2.0, 48.0, 3.0, 49.0)},
+                 {"near": (48.85, 2.35), "radius": 1500.0}, {"near": (48.86, 2.36), "radius": 300.0},
+                 {"bbox": (2.34, 48.80, 2.40, 48.86), "near": (48.85, 2.35), "radius": 2500.0}):
+        assert query(db, locator, **area) == brute_force(db, **area)
+
+
+def test_rtree_queries_match_brute_force(indexed):
+    db, locator = indexed
+    assert locator.rtree
+    check_areas(db, locator)
+
+
+def test_triggers_follow_bin_writes(indexed):
+    db, locator = indexed
+    ids = sorted(bins(db))
+    # ORM update: move a bin into the queried areas
+    moved = db.get(Bin, ids[10])
+    moved.latitude, moved.longitude = 48.8601, 2.3601
+    db.commit()
+    # Delete
+    delete_bin_ids(db, ids[20:30])
+    db.commit()
+    # Bulk upsert: move existing bins by bin_id and add new ones
+    upsert_bins(db, [
+        {"bin_id": f"b{k}", "weight": 10.0, "presence": 1, "latitude": 48.855 + k / 1e4, "longitude": 2.355}
+        for k in list(range(40, 60)) + list(range(500, 510))
+    ])
+    db.commit()
+    assert ids[10] in query(db, locator, near=(48.86, 2.36), radius=50.0)
+    check_areas(db, locator)
@@ -0,0 +1,45 @@
+SWEEP = {"name": "grid", "max_trucks": [2, 4], "max_capacity": [250.0, 500.0], "bins_to_collect": [5, 0],
+         "time_limit": 0, "seed": 1}
+
+
+def routed_bins(client, simulation_id):
+    return sorted(stop["bin_id"] for stop in client.get(f"/simulations/{simulation_id}/routes").json())
+
+
+def test_sweep_solves_every_combination(client, bin_rows):
+    client.put("/bins/", json=bin_rows(10))
+    bins = client.get("/bins/").json()
+    heaviest = sorted(bins, key=lambda b: (-b["weight"], b["id"]))[:5]
+
+    response = client.post("/simulations/sweep", json=SWEEP)
+    assert response.status_code == 200
+    sweep = response.json()
+    runs = sweep["runs"]
+    assert [(run["max_trucks"], run["max_capacity"], run["bins_to_collect"]) for run in runs] == [
+        (trucks, capacity, count) for trucks in (2, 4) for capacity in (250.0, 500.0) for count in (5, 0)
+    ]
+    for run in runs:
+        assert run["status"] == "completed" and 0 < run["trucks_used"] <= run["max_trucks"]
+        # Heaviest bins first: each selection is a prefix of the largest one
+        expected = sorted(b["id"] for b in (heaviest if run["bins_to_collect"] else bins))
+        served = routed_bins(client, run["simulation_id"])
+        assert len(served) + run["unserved_bins"] == len(expected) and set(served) <= set(expected)
+        simulation = client.get(f"/simulations/{run['simulation_id']}").json()
+        assert simulation["sweep_id"] == sweep["id"] and simulation["total_distance"] == run["total_distance"]
+    assert client.get(f"/simulations/sweep/{sweep['id']}").json() == sweep
+
+    # Identical runs are copied from the result cache
+    again = client.post("/simulations/sweep", json=SWEEP).json()
+    assert again["id"] != sweep["id"]
+    assert client.get("/debug/result-cache").json()["hits"] >= len(runs)
+    assert [(run["total_distance"], run["trucks_used"], run["unserved_bins"]) for run in again["runs"]] == [
+        (run["total_distance"], run["trucks_used"], run["unserved_bins"]) for run in runs
+    ]
+
+
+def test_invalid_sweeps_are_rejected(client):
+    assert client.post("/simulations/sweep", json=dict(SWEEP, max_trucks=[])).status_code == 400
+    assert client.post("/simulations/sweep", json=dict(SWEEP, max_trucks=list(range(1, 60)))).status_code == 400
+    assert client.post("/simulations/sweep", json=dict(SWEEP, algorithm="genetic")).status_code == 400
+    assert client.post("/simulations/sweep", json=dict(SWEEP, distance_mode="exact")).status_code == 400
+    assert client.get("/simulations/sweep/999999").status_code == 404
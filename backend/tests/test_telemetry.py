@@ -0,0 +1,89 @@
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.bin_store import bin_store
+from app.database import SessionLocal
+from app.models import Bin
+from app.routers.bins import (
+    BinGeneralUpdate, BinUpdate, BinWeightUpdate, update_bin_general, update_bin_presence, update_bin_weight
+)
+from app.telemetry import TelemetryWriter
+
+
+def stored(bin_id):
+    db = SessionLocal()
+    try:
+        return db.execute(select(Bin.weight, Bin.presence, Bin.weight_measured_at, Bin.presence_measured_at)
+                          .where(Bin.bin_id == bin_id)).one()
+    finally:
+        db.close()
+
+
+def test_late_batch_keeps_newer_values(make_bins):
+    make_bins("a", "b")
+    now = datetime(2026, 1, 1, 12)
+    writer = TelemetryWriter()
+    assert writer.submit([("a", 40.0, 1, now), ("b", 10.0, None, now)])
+    writer.flush()
+    # An older batch arriving later goes to the history only
+    assert writer.submit([("a", 5.0, 0, now - timedelta(minutes=5)), ("b", None, 1, now - timedelta(minutes=5)),
+                          ("zz", 1.0, 1, now)])
+    writer.flush()
+    assert tuple(stored("a")) == (40.0, 1, now, now)
+    assert tuple(stored("b")) == (10.0, 1, now, now - timedelta(minutes=5))
+    assert writer.written == 4 and writer.unknown == 1 and writer.errors == 0
+    # A newer one replaces them
+    assert writer.submit([("a", 60.0, None, now + timedelta(minutes=1))])
+    writer.flush()
+    assert tuple(stored("a")) == (60.0, 1, now + timedelta(minutes=1), now)
+
+
+def test_manual_writes_are_stamped(make_bins):
+    ids = make_bins("a", "b")
+    bin_store.invalidate()
+    before = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        update_bin_weight(ids[0], BinWeightUpdate(weight=25.0), db)
+        update_bin_presence(ids[0], BinUpdate(presence=1), db)
+        update_bin_general(ids[1], BinGeneralUpdate(weight=30.0), db)
+    finally:
+        db.close()
+    after = datetime.utcnow()
+    weight, presence, weight_at, presence_at = stored("a")
+    assert (weight, presence) == (25.0, 1) and before <= weight_at <= presence_at <= after
+    # Only what was written is stamped
+    assert stored("b").weight_measured_at >= before and stored("b").presence_measured_at is None
+
+    # A reading taken before the manual write goes to the history only, a later one replaces it
+    writer = TelemetryWriter()
+    assert writer.submit([("a", 5.0, 0, before - timedelta(minutes=1))])
+    writer.flush()
+    assert tuple(stored("a")) == (25.0, 1, weight_at, presence_at)
+    assert writer.submit([("a", 50.0, None, after + timedelta(seconds=1))])
+    writer.flush()
+    assert tuple(stored("a")) == (50.0, 1, after + timedelta(seconds=1), presence_at)
+    bin_store.invalidate()
+
+
+def test_concurrent_submits_fit_or_are_refused():
+    writer = TelemetryWriter(max_pending=100)
+    readings = [("a", 1.0, 1, datetime(2026, 1, 1))] * 7
+    results = []
+    barrier = threading.Barrier(8)
+
+    def submit():
+        barrier.wait()
+        for _ in range(10):
+            results.append(writer.submit(readings))
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 14 requests of 7 fit in 100, every other one is refused whole
+    assert results.count(True) == 14
+    assert writer.stats()['pending'] == 98
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+RUN = {"name": "run", "max_trucks": 4, "max_capacity": 300.0, "bins_to_collect": 0, "time_limit": 0, "seed": 1}
+
+
+def completed(client, run=RUN):
+    created = client.post("/simulations/", json=run).json()
+    deadline = time.monotonic() + 20
+    while client.get(f"/simulations/{created['id']}").json()["status"] != "completed" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return created["id"]
+
+
+def truck_weights(client, simulation_id):
+    weights = {}
+    for stop in client.get(f"/simulations/{simulation_id}/routes").json():
+        weights.setdefault(stop["truck_id"], []).append(stop["weight"])
+    return weights
+
+
+def test_known_weights_give_exact_loads(client, bin_rows):
+    client.put("/bins/", json=bin_rows(12))
+    simulation_id = completed(client)
+    risk = client.get(f"/simulations/{simulation_id}/uncertainty", params={"scenarios": 200}).json()
+    weights = truck_weights(client, simulation_id)
+
+    assert risk["scenarios"] == 200 and risk["max_capacity"] == 300.0 and risk["unknown_weights"] == 0
+    assert [truck["truck_id"] for truck in risk["trucks"]] == sorted(weights)
+    for truck in risk["trucks"]:
+        assert truck["bins"] == len(weights[truck["truck_id"]])
+        assert truck["expected_load"] == pytest.approx(sum(weights[truck["truck_id"]]))
+        assert truck["load_p95"] == pytest.approx(truck["expected_load"])
+        # The solver kept every truck within capacity
+        assert truck["overflow_probability"] == 0 and truck["expected_extra_trips"] == 0
+    assert risk["overflow_probability"] == 0 and risk["expected_extra_trips"] == 0
+
+
+def test_uncertain_weights_can_overflow(client, bin_rows):
+    client.put("/bins/", json=bin_rows(12))
+    simulation_id = completed(client)
+    # Weights unknown since the run: drawn between 10 and 90
+    for b in client.get("/bins/", params={"limit": 3}).json():
+        assert client.patch(f"/bins/{b['id']}/weight", json={"weight": 0.0}).status_code == 200
+    params = {"scenarios": 2000, "seed": 3, "weight_noise": 0.5}
+    risk = client.get(f"/simulations/{simulation_id}/uncertainty", params=params).json()
+
+    assert risk["unknown_weights"] == 3
+    assert client.get(f"/simulations/{simulation_id}/uncertainty", params=params).json() == risk
+    assert 0 < risk["overflow_probability"] < 1
+    trucks = risk["trucks"]
+    assert max(truck["overflow_probability"] for truck in trucks) <= risk["overflow_probability"]
+    assert risk["expected_extra_trips"] == pytest.approx(sum(truck["expected_extra_trips"] for truck in trucks))
+    for truck in trucks:
+        assert truck["load_p95"] > truck["expected_load"]
+
+
+def test_only_completed_simulations_are_evaluated(client, bin_rows, held_solver):
+    started, release = held_solver
+    client.put("/bins/", json=bin_rows(5))
+    running = client.post("/simulations/", json=RUN).json()
+    assert started.wait(10)
+    assert client.get(f"/simulations/{running['id']}/uncertainty").status_code == 409
+    release.set()
+
+    simulation_id = completed(client)
+    assert client.get(f"/simulations/{simulation_id}/uncertainty", params={"scenarios": 0}).status_code == 400
+    assert client.get(f"/simulations/{simulation_id}/uncertainty", params={"weight_noise": -1}).status_code == 400
+    assert client.get("/simulations/999999/uncertainty").status_code == 404
@@ -4,7 +4,7 @@ import random
 import folium
 from streamlit_folium import st_folium
 import pandas as pd
-from utils import OSRM_API_URL, PARIS_CENTER, COLORS, format_distance, format_duration
+from utils import OSRM_API_URL, PARIS_CENTER, COLORS, format_distance, format_duration, read_events
 
 st.title("🚛 Simulation de collecte optimisée")
 
@@ -20,37 +20,36 @@ with col1:
     if st.button("🔄 Réinitialiser la base de données", type="primary"):
         with st.spinner("Chargement et insertion des poubelles..."):
             try:
-                # Clear existing bins first
-                resp = requests.get(f"{backend_url}/bins/")
-                if resp.status_code == 200:
-                    bins = resp.json()
-                    for bin_data in bins:
-                        requests.delete(f"{backend_url}/bins/{bin_data['id']}")
-                
                 # Fetch new data from Paris API
                 resp = requests.get(external_api)
                 resp.raise_for_status()
                 data = resp.json().get("results", [])
                 
-                count = 0
+                payload = []
                 for rec in data:
                     geom_x_y = rec.get("geom_x_y", {})
                     lon = geom_x_y.get("lon") if geom_x_y else None
                     lat = geom_x_y.get("lat") if geom_x_y else None
                     
                     if lon and lat:  # Only add bins with valid coordinates
-                        payload = {
+                        payload.append({
                             "bin_id": f"bin-{rec.get('objectid')}",
                             "weight": round(random.uniform(10.0, 95.0), 2),  # Random weight
                             "presence": 1,
                             "longitude": lon,
                             "latitude": lat
-                        }
-                        response = requests.post(f"{backend_url}/bins/", json=payload)
-                        if response.status_code == 200:
-                            count += 1
+                        })
                 
-                st.success(f"✅ {count} poubelles initialisées avec succès!")
+                # Replace the whole bin set in one request (one transaction);
+                # a bin_id listed twice would reject the whole set
+                payload = list({bin_data['bin_id']: bin_data for bin_data in payload}.values())
+                response = requests.put(f"{backend_url}/bins/", json=payload)
+                if response.status_code == 200:
+                    result = response.json()
+                    count = result['inserted'] + result['updated']
+                    st.success(f"✅ {count} poubelles initialisées avec succès!")
+                else:
+                    st.error(f"❌ Erreur: {response.text}")
                 
             except Exception as e:
                 st.error(f"❌ Erreur: {e}")
@@ -58,7 +57,7 @@ with col1:
 with col2:
     if st.button("📊 Voir l'état actuel"):
         try:
-            resp = requests.get(f"{backend_url}/bins/")
+            resp = requests.get(f"{backend_url}/bins/", params={"fields": "id,weight"})
             if resp.status_code == 200:
                 bins = resp.json()
                 if bins:
@@ -111,6 +110,50 @@ with col2_name:
 if simulation_name != st.session_state.simulation_name:
     st.session_state.simulation_name = simulation_name
 
+PHASES = {
+    'distances': "Calcul des distances",
+    'construction': "Construction des tournées",
+    'improvement': "Amélioration des tournées",
+    'persistence': "Enregistrement des tournées"
+}
+
+def draw_incumbent(routes, bins_by_id):
+    """Carte des meilleures tournées trouvées jusqu'ici (lignes droites entre les poubelles)"""
+    m = folium.Map(location=PARIS_CENTER, zoom_start=12)
+    for truck_id, route in enumerate(routes):
+        points = [[bins_by_id[b]['latitude'], bins_by_id[b]['longitude']] for b in route if b in bins_by_id]
+        if len(points) > 1:
+            folium.PolyLine(points, color=COLORS[truck_id % len(COLORS)], weight=3, opacity=0.7,
+                            tooltip=f"Camion {truck_id+1}").add_to(m)
+    return m
+
+def follow_simulation(simulation_id):
+    """Suit la progression d'une simulation (SSE) et affiche les tournées au fil de l'optimisation"""
+    bins_by_id = {b['id']: b for b in requests.get(f"{backend_url}/bins/", params={"fields": "id,latitude,longitude"}).json()}
+    progress_bar = st.progress(0, text="Simulation en file d'attente...")
+    best_cost = st.empty()
+    live_map = st.empty()
+    updates = 0
+    
+    with requests.get(f"{backend_url}/simulations/{simulation_id}/events", stream=True, timeout=60) as events:
+        for event, data in read_events(events):
+            if event == 'phase':
+                percent = data['percent'] if data['percent'] is not None else 10
+                progress_bar.progress(int(percent), text=f"{PHASES.get(data['phase'], data['phase'])}...")
+            elif event == 'incumbent':
+                updates += 1
+                best_cost.metric("Meilleure distance trouvée", format_distance(data['cost']))
+                with live_map.container():
+                    st_folium(draw_incumbent(data['routes'], bins_by_id), width=700, height=400,
+                              returned_objects=[], key=f"incumbent_{simulation_id}_{updates}")
+            elif event == 'status':
+                progress_bar.progress(100, text="Simulation terminée")
+                live_map.empty()
+                best_cost.empty()
+                break
+    
+    return requests.get(f"{backend_url}/simulations/{simulation_id}").json()
+
 # Section 3: Lancement de la simulation
 st.header("🚀 Simulation")
 
@@ -133,7 +176,15 @@ if st.button("▶️ Démarrer la simulation", type="primary"):
                 if response.status_code == 200:
                     simulation_result = response.json()
                     st.session_state.current_simulation = simulation_result['id']
-                    
+                    simulation_result = follow_simulation(simulation_result['id'])
+                
+                if response.status_code != 200:
+                    st.error(f"Erreur lors de la simulation: {response.text}")
+                elif simulation_result['status'] == 'failed':
+                    st.error(f"Échec de la simulation: {simulation_result.get('error')}")
+                elif simulation_result['status'] == 'cancelled':
+                    st.warning("Simulation annulée")
+                else:
                     # Display results
                     st.success("✅ Simulation terminée!")
                     
@@ -144,9 +195,9 @@ if st.button("▶️ Démarrer la simulation", type="primary"):
                         st.metric("Temps total", format_duration(simulation_result.get('total_time', 0)))
                     with col3:
                         st.metric("Status", simulation_result.get('status', 'unknown'))
-                
-                else:
-                    st.error(f"Erreur lors de la simulation: {response.text}")
+                    
+                    if simulation_result.get('unserved_bins'):
+                        st.warning(f"⚠️ {simulation_result['unserved_bins']} poubelles n'ont pas pu être collectées (capacité ou nombre de camions insuffisant)")
                     
             except Exception as e:
                 st.error(f"Erreur: {e}")
@@ -171,6 +222,7 @@ try:
                     'Poubelles': sim['bins_to_collect'],
                     'Distance': f"{sim['total_distance']/1000:.2f} km" if sim['total_distance'] else "N/A",
                     'Temps': f"{sim['total_time']/3600:.2f} h" if sim['total_time'] else "N/A",
+                    'Non collectées': sim.get('unserved_bins') or 0,
                     'Status': sim['status'],
                     'Date': sim['created_at'][:16].replace('T', ' ')
                 })
@@ -38,6 +38,34 @@ try:
             presence_counts = df["presence"].value_counts()
             st.write("Répartition des statuts de présence")
             st.bar_chart(presence_counts)
+            
+            # Historique des capteurs d'une poubelle
+            st.subheader("Évolution des mesures")
+            selected_bin = st.selectbox(
+                "Poubelle",
+                options=df["id"].tolist(),
+                format_func=lambda x: df.loc[df["id"] == x, "bin_id"].iloc[0]
+            )
+            limit = st.slider("Nombre de mesures", min_value=10, max_value=5000, value=500, step=10)
+            m = requests.get(f"{backend_url}/bins/{selected_bin}/measurements", params={"limit": limit})
+            if m.status_code == 200 and m.json():
+                history = pd.DataFrame(m.json())
+                history["measured_at"] = pd.to_datetime(history["measured_at"])
+                history = history.sort_values("measured_at").set_index("measured_at")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.metric("Mesures", len(history))
+                with col2:
+                    st.metric("Dernière mesure", history.index[-1].strftime("%d/%m/%Y %H:%M"))
+                st.write("Poids (kg)")
+                st.line_chart(history["weight"].dropna())
+                if history["presence"].notna().any():
+                    st.write("Présence")
+                    st.line_chart(history["presence"].dropna())
+            elif m.status_code == 200:
+                st.info("Aucune mesure reçue pour cette poubelle.")
+            else:
+                st.error(f"Erreur: {m.text}")
         else:
             st.info("Aucune donnée disponible.")
     else:
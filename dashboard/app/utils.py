@@ -1,7 +1,7 @@
 # Utilitaires pour le dashboard Trashway
-import math
 import requests 
 import time
+import json
 
 # Configuration
 OSRM_API_URL = "http://router.project-osrm.org/route/v1/driving"
@@ -53,44 +53,6 @@ def get_distance_duration(pos1, pos2, timeout=5):
         return route.get("distance"), route.get("duration")
     return None, None
 
-def get_euclidean_distance(pos1, pos2):
-    """
-    Calcule la distance euclidienne entre deux coordonnées GPS
-    Plus rapide que les API de routage mais moins précis pour les trajets réels
-    
-    Args:
-        pos1: tuple (lat, lon) point de départ
-        pos2: tuple (lat, lon) point d'arrivée
-    
-    Returns:
-        tuple: (distance_metres, duree_estimee_secondes)
-    """
-    lat1, lon1 = pos1
-    lat2, lon2 = pos2
-    
-    # Conversion en radians
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    
-    # Formule de Haversine pour la distance sur une sphère
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    
-    # Rayon de la Terre en mètres
-    R = 6371000
-    distance = R * c
-    
-    # Estimation de durée en supposant une vitesse moyenne urbaine de 30 km/h = 8.33 m/s
-    # Ajout de 20% pour les virages, feux, etc.
-    duration = (distance / 8.33) * 1.2
-    
-    return distance, duration
-
 def format_distance(distance_meters):
     """
     Formate une distance en mètres de manière lisible
@@ -126,3 +88,28 @@ def format_duration(duration_seconds):
     else:
         return f"{duration_seconds:.0f}s"
 
+
+def read_events(response):
+    """
+    Lit un flux Server-Sent Events (réponse requests ouverte avec stream=True)
+    
+    Args:
+        response: Réponse HTTP en streaming
+    
+    Yields:
+        tuple: (type_evenement, donnees_json) pour chaque événement reçu
+    """
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None or line.startswith(":"):
+            # Commentaire keep-alive
+            continue
+        if not line:
+            # Ligne vide: fin de l'événement
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
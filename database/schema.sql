@@ -4,7 +4,16 @@ CREATE TABLE IF NOT EXISTS bins (
     weight REAL NOT NULL,
     presence INTEGER NOT NULL,
     longitude REAL NOT NULL,
-    latitude REAL NOT NULL
+    latitude REAL NOT NULL,
+    weight_measured_at TIMESTAMP,
+    presence_measured_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    parameters TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE TABLE IF NOT EXISTS simulations (
@@ -15,8 +24,17 @@ CREATE TABLE IF NOT EXISTS simulations (
     bins_to_collect INTEGER NOT NULL,
     total_distance REAL,
     total_time REAL,
+    unserved_bins INTEGER,
+    parent_id INTEGER,
+    version INTEGER DEFAULT 1,
+    improvement REAL,
+    parameters TEXT,
+    error TEXT,
+    sweep_id INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    status TEXT DEFAULT 'pending'
+    status TEXT DEFAULT 'pending',
+    FOREIGN KEY (parent_id) REFERENCES simulations (id),
+    FOREIGN KEY (sweep_id) REFERENCES sweeps (id)
 );
 
 CREATE TABLE IF NOT EXISTS routes (
@@ -31,6 +49,20 @@ CREATE TABLE IF NOT EXISTS routes (
     FOREIGN KEY (bin_id) REFERENCES bins (id)
 );
 
+CREATE INDEX IF NOT EXISTS ix_routes_simulation ON routes (simulation_id, truck_id, bin_order);
+
+CREATE TABLE IF NOT EXISTS packed_routes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    simulation_id INTEGER NOT NULL,
+    truck_id INTEGER NOT NULL,
+    stops INTEGER NOT NULL,
+    bin_ids BLOB NOT NULL,
+    distances BLOB NOT NULL,
+    durations BLOB NOT NULL,
+    FOREIGN KEY (simulation_id) REFERENCES simulations (id),
+    UNIQUE(simulation_id, truck_id)
+);
+
 CREATE TABLE IF NOT EXISTS distances (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     from_bin_id INTEGER NOT NULL,
@@ -40,4 +72,31 @@ CREATE TABLE IF NOT EXISTS distances (
     FOREIGN KEY (from_bin_id) REFERENCES bins (id),
     FOREIGN KEY (to_bin_id) REFERENCES bins (id),
     UNIQUE(from_bin_id, to_bin_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bin_id INTEGER NOT NULL,
+    weight REAL,
+    presence INTEGER,
+    measured_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (bin_id) REFERENCES bins (id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_measurements_bin_time ON measurements (bin_id, measured_at);
+
+-- Bin locations for bounding-box and radius queries, kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS bins_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+
+CREATE TRIGGER IF NOT EXISTS bins_rtree_insert AFTER INSERT ON bins BEGIN
+    INSERT OR REPLACE INTO bins_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS bins_rtree_update AFTER UPDATE OF id, latitude, longitude ON bins BEGIN
+    DELETE FROM bins_rtree WHERE id = old.id;
+    INSERT OR REPLACE INTO bins_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS bins_rtree_delete AFTER DELETE ON bins BEGIN
+    DELETE FROM bins_rtree WHERE id = old.id;
+END;
@@ -35,6 +35,88 @@ try:
         print("Adding country column")
         cursor.execute("ALTER TABLE bins ADD COLUMN country TEXT DEFAULT 'France'")
     
+    for column in ("weight_measured_at", "presence_measured_at"):
+        if column not in columns:
+            print(f"Adding {column} column")
+            cursor.execute(f"ALTER TABLE bins ADD COLUMN {column} TIMESTAMP")
+    
+    cursor.execute("SELECT * FROM simulations LIMIT 1")
+    columns = [description[0] for description in cursor.description]
+    
+    if "unserved_bins" not in columns:
+        print("Adding unserved_bins column")
+        cursor.execute("ALTER TABLE simulations ADD COLUMN unserved_bins INTEGER")
+    
+    if "parent_id" not in columns:
+        print("Adding parent_id column")
+        cursor.execute("ALTER TABLE simulations ADD COLUMN parent_id INTEGER REFERENCES simulations(id)")
+    
+    if "version" not in columns:
+        print("Adding version column")
+        cursor.execute("ALTER TABLE simulations ADD COLUMN version INTEGER DEFAULT 1")
+    
+    for column, column_type in (("improvement", "REAL"), ("parameters", "TEXT"), ("error", "TEXT")):
+        if column not in columns:
+            print(f"Adding {column} column")
+            cursor.execute(f"ALTER TABLE simulations ADD COLUMN {column} {column_type}")
+    
+    if "sweep_id" not in columns:
+        print("Adding sweep_id column")
+        cursor.execute("ALTER TABLE simulations ADD COLUMN sweep_id INTEGER REFERENCES sweeps(id)")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sweeps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            parameters TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS measurements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bin_id INTEGER NOT NULL REFERENCES bins(id),
+            weight REAL,
+            presence INTEGER,
+            measured_at TIMESTAMP NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_measurements_bin_time ON measurements (bin_id, measured_at)")
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_routes_simulation ON routes (simulation_id, truck_id, bin_order)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS packed_routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            simulation_id INTEGER NOT NULL REFERENCES simulations(id),
+            truck_id INTEGER NOT NULL,
+            stops INTEGER NOT NULL,
+            bin_ids BLOB NOT NULL,
+            distances BLOB NOT NULL,
+            durations BLOB NOT NULL,
+            UNIQUE(simulation_id, truck_id)
+        )
+    """)
+    
+    # R*Tree over bin locations; the backend also creates it at startup
+    cursor.execute("SELECT name FROM sqlite_master WHERE name = 'bins_rtree'")
+    if cursor.fetchone() is None:
+        print("Creating bins_rtree spatial index")
+        cursor.execute("CREATE VIRTUAL TABLE bins_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+        cursor.execute("INSERT INTO bins_rtree SELECT id, latitude, latitude, longitude, longitude FROM bins")
+    cursor.executescript("""
+        CREATE TRIGGER IF NOT EXISTS bins_rtree_insert AFTER INSERT ON bins BEGIN
+            INSERT OR REPLACE INTO bins_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END;
+        CREATE TRIGGER IF NOT EXISTS bins_rtree_update AFTER UPDATE OF id, latitude, longitude ON bins BEGIN
+            DELETE FROM bins_rtree WHERE id = old.id;
+            INSERT OR REPLACE INTO bins_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END;
+        CREATE TRIGGER IF NOT EXISTS bins_rtree_delete AFTER DELETE ON bins BEGIN
+            DELETE FROM bins_rtree WHERE id = old.id;
+        END;
+    """)
+    
     # Commit changes
     conn.commit()
     print("Database migration completed successfully")
@@ -25,6 +25,17 @@ def test_bins_endpoint():
         print(f"❌ Erreur: {response.status_code}")
         return 0
 
+def wait_for_simulation(simulation_id, timeout=60):
+    """Attend la fin d'une simulation (terminée, échouée ou annulée)"""
+    started = time.time()
+    while True:
+        simulation = requests.get(f"{BACKEND_URL}/simulations/{simulation_id}").json()
+        if simulation['status'] not in ('pending', 'running'):
+            return simulation
+        if time.time() - started > timeout:
+            raise requests.exceptions.Timeout()
+        time.sleep(0.5)
+
 def test_simulation_creation():
     """Test de création d'une simulation"""
     print("\n🧪 Test de création de simulation...")
@@ -43,6 +54,11 @@ def test_simulation_creation():
         
         if response.status_code == 200:
             simulation = response.json()
+            print(f"   Simulation #{simulation['id']} en file d'attente, calcul en cours...")
+            simulation = wait_for_simulation(simulation['id'])
+            if simulation['status'] != 'completed':
+                print(f"❌ Simulation {simulation['status']}: {simulation.get('error')}")
+                return None
             print(f"✅ Simulation créée avec succès!")
             print(f"   ID: {simulation['id']}")
             print(f"   Distance totale: {simulation.get('total_distance', 0)/1000:.2f} km")